@@ -1,15 +1,26 @@
 # app.py
 import streamlit as st
+import uuid
+import metrics
 from auth_ui import show_auth_ui
-from auth import logout, delete_user
+from auth import logout, delete_user, restore_session
 from utils import load_css
-from timetable import timetable_page, display_saved_timetables
-from chat import chat_interface
+
+# timetable and chat (and with them LangChain and the LLM client) are imported
+# only when their tool is opened, so the login page starts without them
 
 # Set app configuration
 st.set_page_config(page_title="StudyGo AI", layout="wide", page_icon="🎓")
 load_css()
 
+# Rerun timings are grouped per browser session in the metrics log
+if "metrics_session" not in st.session_state:
+    st.session_state.metrics_session = uuid.uuid4().hex
+metrics.begin_rerun(st.session_state.metrics_session)
+
+# The session cookie logs a returning browser back in without a password
+restore_session()
+
 # Show login/signup + welcome if not authenticated
 if "user_id" not in st.session_state and "is_guest" not in st.session_state:
     with st.sidebar:
@@ -59,6 +70,7 @@ if "user_id" not in st.session_state and "is_guest" not in st.session_state:
     </div>
     ''', unsafe_allow_html=True)
     
+    metrics.end_rerun("welcome")
     st.stop()
 
 # 🎓 If logged in or guest, show main app
@@ -93,8 +105,14 @@ st.title("🎓 StudyGo AI")
 st.markdown("Your personalized learning assistant for any course, subject, or technology.")
 
 if tool == "📅 Timetable Generator":
+    from timetable import timetable_page, display_saved_timetables
+
     display_saved_timetables()
     st.markdown("---")
     timetable_page()
+    metrics.end_rerun("timetable")
 elif tool == "🗨️ Chat Assistant":
-    chat_interface()
\ No newline at end of file
+    from chat import chat_interface
+
+    chat_interface()
+    metrics.end_rerun("chat")
\ No newline at end of file
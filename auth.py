@@ -1,50 +1,287 @@
 # auth.py
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
 import uuid
 import sqlite3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from utils import get_db
+import retrieval
 import bcrypt
 import streamlit as st
+from metrics import span, traced
 
+# ---------------- Settings ----------------
+# bcrypt cost factor for new hashes (existing hashes keep the cost they were made with)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt runs on this many worker threads, never on the Streamlit script thread
+AUTH_WORKERS = int(os.getenv("AUTH_WORKERS", "2"))
+# Hashes waiting for a worker beyond this are refused instead of queued
+AUTH_MAX_PENDING = int(os.getenv("AUTH_MAX_PENDING", "16"))
+AUTH_TIMEOUT = float(os.getenv("AUTH_TIMEOUT", "10"))
+# Login/sign-up attempts allowed per username and per client IP within the window
+AUTH_RATE_LIMIT = int(os.getenv("AUTH_RATE_LIMIT", "5"))
+AUTH_RATE_WINDOW = float(os.getenv("AUTH_RATE_WINDOW", "300"))
+# Lifetime of a persistent login
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(30 * 24 * 3600)))
+# Rows removed per transaction when deleting an account
+DELETE_CHUNK_SIZE = int(os.getenv("DELETE_CHUNK_SIZE", "200"))
+# Browser cookie that carries the session token across refreshes
+SESSION_COOKIE = "studygo_session"
+# Older links carried the token in this query parameter; it is moved into the cookie
+SESSION_PARAM = "session"
 
-def create_user(username, password):
-    conn = get_db()
-    cursor = conn.cursor()
+
+class RateLimitedError(Exception):
+    """Too many attempts for this username or client; retry_after is in seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Too many attempts, try again in {int(retry_after) + 1} seconds.")
+        self.retry_after = retry_after
+
+
+class AuthBusyError(Exception):
+    """All password-hashing workers are busy."""
+
+
+# ---------------- Rate limiting ----------------
+class SlidingWindowLimiter:
+    """Allows at most `limit` hits per key within the last `window` seconds."""
+
+    def __init__(self, limit=AUTH_RATE_LIMIT, window=AUTH_RATE_WINDOW):
+        self.limit = limit
+        self.window = window
+        self._hits = {}
+        self._lock = threading.Lock()
+
+    def hit(self, *keys):
+        """Records one attempt for every key; raises RateLimitedError (recording nothing) if any is over."""
+        now = time.monotonic()
+        with self._lock:
+            windows = []
+            for key in keys:
+                hits = self._hits.setdefault(key, deque())
+                while hits and now - hits[0] >= self.window:
+                    hits.popleft()
+                if len(hits) >= self.limit:
+                    raise RateLimitedError(self.window - (now - hits[0]))
+                windows.append(hits)
+            for hits in windows:
+                hits.append(now)
+            # Forget keys whose window has emptied so the table doesn't grow forever
+            if len(self._hits) > 10000:
+                self._hits = {k: v for k, v in self._hits.items() if v and now - v[-1] < self.window}
+
+
+_limiter = SlidingWindowLimiter()
+
+
+def client_ip():
+    """Best-effort client address of the current Streamlit session (None if unknown)."""
+    context = getattr(st, "context", None)
+    if context is None:
+        return None
+    ip = getattr(context, "ip_address", None)
+    if not ip:
+        forwarded = (getattr(context, "headers", None) or {}).get("X-Forwarded-For", "")
+        ip = forwarded.split(",")[0].strip() or None
+    return ip
+
+
+def check_rate_limit(username, ip=None):
+    keys = [f"user:{username.strip().casefold()}"]
+    if ip:
+        keys.append(f"ip:{ip}")
+    _limiter.hit(*keys)
+
+
+# ---------------- Password hashing ----------------
+_hash_pool = ThreadPoolExecutor(max_workers=max(1, AUTH_WORKERS), thread_name_prefix="bcrypt")
+_pending = threading.BoundedSemaphore(max(1, AUTH_MAX_PENDING))
+
+
+def _run_bcrypt(name, fn, *args):
+    """Runs a bcrypt call on the worker pool and waits for it."""
+    if not _pending.acquire(blocking=False):
+        raise AuthBusyError("The server is busy signing other users in, please try again.")
     try:
-        user_id = str(uuid.uuid4())
-        hashed_pw = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
-        cursor.execute("INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)", (user_id, username, hashed_pw))
-        conn.commit()
+        future = _hash_pool.submit(fn, *args)
+    except BaseException:
+        _pending.release()
+        raise
+    # The slot is freed when the hash finishes, not when we stop waiting for it,
+    # so timed-out calls still count against AUTH_MAX_PENDING while they run
+    future.add_done_callback(lambda _: _pending.release())
+    try:
+        with span(name):
+            return future.result(timeout=AUTH_TIMEOUT)
+    except FutureTimeoutError:
+        raise AuthBusyError("Signing in took too long, please try again.") from None
+
+
+def hash_password(password):
+    return _run_bcrypt("auth.bcrypt_hash", bcrypt.hashpw, password.encode(), bcrypt.gensalt(BCRYPT_ROUNDS)).decode()
+
+
+def check_password(password, password_hash):
+    return _run_bcrypt("auth.bcrypt_check", bcrypt.checkpw, password.encode(), password_hash.encode())
+
+
+# ---------------- Accounts ----------------
+def create_user(username, password, ip=None):
+    check_rate_limit(username, ip)
+    user_id = str(uuid.uuid4())
+    hashed_pw = hash_password(password)
+    try:
+        with get_db() as conn:
+            conn.execute("INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)", (user_id, username, hashed_pw))
         return user_id
     except sqlite3.IntegrityError:
         return None
-    finally:
-        conn.close()
 
-def authenticate_user(username, password):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, password_hash FROM users WHERE username = ?", (username,))
-    row = cursor.fetchone()
-    conn.close()
-    if row and bcrypt.checkpw(password.encode(), row[1].encode()):
-        return row[0]
-    return None
+def authenticate_user(username, password, ip=None):
+    check_rate_limit(username, ip)
+    with get_db() as conn:
+        row = conn.execute("SELECT id, password_hash FROM users WHERE username = ?", (username,)).fetchone()
+    if row is None:
+        return None
+    return row[0] if check_password(password, row[1]) else None
+
+@traced("db.delete_user")
+def delete_user(user_id, chunk_size=DELETE_CHUNK_SIZE):
+    """
+    Deletes the account and everything it owns in chunks of `chunk_size` rows,
+    one transaction each, so a large account doesn't hold the write lock for long.
+    """
+    # Chat messages and their search index rows go with each chat (ON DELETE CASCADE)
+    for table in ("chats", "timetables", "sessions", "jobs"):
+        while True:
+            with get_db() as conn:
+                deleted = conn.execute(
+                    f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE user_id = ? LIMIT ?)",
+                    (user_id, chunk_size)
+                ).rowcount
+            if deleted < chunk_size:
+                break
+
+    with get_db() as conn:
+        # Anything saved while the chunks ran goes in the same transaction as the user
+        for table in ("chats", "timetables", "sessions", "jobs"):
+            conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+        conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+    retrieval.drop_user(user_id)
+
+
+# ---------------- Sessions ----------------
+def _token_hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def create_session(user_id):
+    """Stores a new login for user_id and returns its token (only the hash is kept)."""
+    token = secrets.token_urlsafe(32)
+    now = time.time()
+    with get_db() as conn:
+        conn.execute("DELETE FROM sessions WHERE user_id = ? AND expires_at <= ?", (user_id, now))
+        conn.execute(
+            "INSERT INTO sessions (token_hash, user_id, created_at, expires_at) VALUES (?, ?, ?, ?)",
+            (_token_hash(token), user_id, now, now + SESSION_TTL)
+        )
+    return token
+
+@traced("db.resolve_session")
+def resolve_session(token):
+    """Returns (user_id, username) for a valid, unexpired token, else None."""
+    with get_db() as conn:
+        row = conn.execute("""
+            SELECT u.id, u.username FROM sessions s JOIN users u ON u.id = s.user_id
+            WHERE s.token_hash = ? AND s.expires_at > ?
+        """, (_token_hash(token), time.time())).fetchone()
+    return (row[0], row[1]) if row else None
+
+def revoke_session(token):
+    with get_db() as conn:
+        conn.execute("DELETE FROM sessions WHERE token_hash = ?", (_token_hash(token),))
+
+def revoke_user_sessions(user_id):
+    with get_db() as conn:
+        conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+def _cookie_token():
+    """The session cookie the browser sent when this Streamlit session connected (None if absent)."""
+    cookies = getattr(getattr(st, "context", None), "cookies", None) or {}
+    return cookies.get(SESSION_COOKIE)
+
+def _write_cookie(token):
+    """Sets the session cookie in the browser, or clears it when token is None."""
+    cookie = f"{SESSION_COOKIE}={token or ''}; Max-Age={SESSION_TTL if token else 0}; Path=/; SameSite=Strict"
+    snippet = f"""<script>
+        const secure = window.parent.location.protocol === "https:" ? "; Secure" : "";
+        window.parent.document.cookie = {json.dumps(cookie)} + secure;
+    </script>"""
+    # The snippet runs in a zero-height frame from the app's own origin
+    if hasattr(st, "iframe"):
+        st.iframe(snippet, height="content")
+    else:
+        # Streamlit before st.iframe
+        from streamlit.components.v1 import html as component_html
 
-def delete_user(user_id):
-    conn = get_db()
-    cursor = conn.cursor()
+        component_html(snippet, height=0)
 
-    # First delete related records from child tables
-    cursor.execute("DELETE FROM chats WHERE user_id = ?", (user_id,))
-    cursor.execute("DELETE FROM timetables WHERE user_id = ?", (user_id,))
+def _queue_cookie(token):
+    # Written by restore_session() on the next rerun: the callers rerun right away,
+    # which would drop a component rendered now before the browser runs it
+    st.session_state.session_cookie_update = token or ""
 
-    # Now it's safe to delete the user
-    cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
+def start_session(user_id, username):
+    """Logs the browser session in and keeps it logged in across refreshes via the session cookie."""
+    token = create_session(user_id)
+    st.session_state.user_id = user_id
+    st.session_state.username = username
+    st.session_state.is_guest = False
+    st.session_state.session_token = token
+    _queue_cookie(token)
 
-    conn.commit()
-    conn.close()
+def restore_session():
+    """
+    Logs a returning browser back in from its session cookie with one indexed
+    lookup. Call it at the top of every rerun.
+    """
+    pending = st.session_state.pop("session_cookie_update", None)
+    if pending is not None:
+        _write_cookie(pending or None)
+    # A token in the URL (links from before the cookie) is taken out of it right away
+    url_token = st.query_params.get(SESSION_PARAM)
+    if url_token:
+        del st.query_params[SESSION_PARAM]
+    if ("user_id" in st.session_state or "is_guest" in st.session_state
+            or st.session_state.get("session_restore_done")):
+        return
+    # Once per browser session: the cookie seen by st.context doesn't change until the next connection
+    st.session_state.session_restore_done = True
+    token = url_token or _cookie_token()
+    if not token:
+        return
+    session = resolve_session(token)
+    if session is None:
+        # Expired or revoked
+        if _cookie_token():
+            _write_cookie(None)
+        return
+    st.session_state.user_id, st.session_state.username = session
+    st.session_state.is_guest = False
+    st.session_state.session_token = token
+    if url_token:
+        _write_cookie(token)
 
 
 def logout():
-    for key in ["user_id", "username", "is_guest"]:
+    token = st.session_state.get("session_token")
+    if token:
+        revoke_session(token)
+    _queue_cookie(None)
+    for key in ["user_id", "username", "is_guest", "session_token"]:
         st.session_state.pop(key, None)
@@ -1,7 +1,6 @@
 # auth_ui.py
 import streamlit as st
-from auth import create_user, authenticate_user, delete_user
-import uuid
+from auth import create_user, authenticate_user, start_session, client_ip, RateLimitedError, AuthBusyError
 
 def show_auth_ui():
     st.sidebar.subheader("🔐 Authentication")
@@ -16,15 +15,17 @@ def show_auth_ui():
         st.sidebar.markdown('<div class="success-button">', unsafe_allow_html=True)
         if st.sidebar.button("Sign Up", use_container_width=True):
             if username and password:
-                user_id = create_user(username, password)
-                if user_id:
-                    st.session_state.user_id = user_id
-                    st.session_state.username = username
-                    st.session_state.is_guest = False
-                    st.sidebar.success("✅ Account created successfully!")
-                    st.rerun()
+                try:
+                    user_id = create_user(username, password, client_ip())
+                except (RateLimitedError, AuthBusyError) as e:
+                    st.sidebar.error(f"⏳ {e}")
                 else:
-                    st.sidebar.error("❌ Username already exists.")
+                    if user_id:
+                        start_session(user_id, username)
+                        st.sidebar.success("✅ Account created successfully!")
+                        st.rerun()
+                    else:
+                        st.sidebar.error("❌ Username already exists.")
             else:
                 st.sidebar.error("❌ Please fill in both fields.")
         st.sidebar.markdown('</div>', unsafe_allow_html=True)
@@ -37,15 +38,17 @@ def show_auth_ui():
         st.sidebar.markdown('<div class="primary-button">', unsafe_allow_html=True)
         if st.sidebar.button("Login", use_container_width=True):
             if username and password:
-                user_id = authenticate_user(username, password)
-                if user_id:
-                    st.session_state.user_id = user_id
-                    st.session_state.username = username
-                    st.session_state.is_guest = False
-                    st.sidebar.success("✅ Welcome back!")
-                    st.rerun()
+                try:
+                    user_id = authenticate_user(username, password, client_ip())
+                except (RateLimitedError, AuthBusyError) as e:
+                    st.sidebar.error(f"⏳ {e}")
                 else:
-                    st.sidebar.error("❌ Invalid username or password.")
+                    if user_id:
+                        start_session(user_id, username)
+                        st.sidebar.success("✅ Welcome back!")
+                        st.rerun()
+                    else:
+                        st.sidebar.error("❌ Invalid username or password.")
             else:
                 st.sidebar.error("❌ Please enter both username and password.")
         st.sidebar.markdown('</div>', unsafe_allow_html=True)
@@ -0,0 +1,251 @@
+# batch_timetables.py
+"""
+Headless timetable generation for whole classes.
+
+Reads rows of (user, topics, days, hours[, name]) from a CSV file with a
+header row or from JSONL, and saves one plan per row to that user's account.
+`user` is a username or user id. Rows asking for the same topics share one
+topic analysis, which runs on a bounded worker pool. Finished plans are
+written in batched transactions. After each batch the written rows go into a
+checkpoint file, so an interrupted run picks up where it stopped.
+
+    LLM_PROVIDER=fake python batch_timetables.py cohort.csv          # offline
+    python batch_timetables.py cohort.jsonl --workers 8 --report report.json
+"""
+import argparse
+import csv
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from db import get_db
+from llm_cache import make_key
+from scheduler import plan_schedule
+from timetable import analyze_topics, canonical_topics
+from utils import save_timetables
+
+# Topic analyses running at once (LLM calls are further bounded by LLM_MAX_CONCURRENCY)
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+# Plans written per transaction (and per checkpoint update)
+BATCH_WRITE_SIZE = int(os.getenv("BATCH_WRITE_SIZE", "50"))
+
+
+# ---------------- Input ----------------
+def read_records(path):
+    """Yields (line number, record dict) from a .jsonl/.ndjson file or a CSV file with a header."""
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    yield number, json.loads(line)
+        else:
+            # Line 1 is the header
+            for number, record in enumerate(csv.DictReader(f), 2):
+                yield number, record
+
+
+def parse_row(number, record):
+    """Validates one input record; raises ValueError with the reason if it is unusable."""
+    user = str(record.get("user") or "").strip()
+    topics = record.get("topics") or ""
+    if isinstance(topics, list):
+        topics = "\n".join(map(str, topics))
+    if not user or not topics.strip():
+        raise ValueError("user and topics are required")
+    try:
+        days, hours = int(record.get("days") or 7), float(record.get("hours") or 3)
+    except (TypeError, ValueError):
+        raise ValueError("days and hours must be numbers") from None
+    if days < 1 or not 0 < hours <= 24:
+        raise ValueError("days must be at least 1 and hours between 0 and 24")
+    name = str(record.get("name") or "").strip()
+    if not name:
+        label = ", ".join(canonical_topics(topics)[:3])
+        name = f"{label[:40]} ({days} days, {hours:g}h/day)"
+    row = {"line": number, "user": user, "topics": topics, "days": days, "hours": hours, "name": name}
+    # Line number plus content, so an edited input file doesn't match stale checkpoint entries
+    row["id"] = f"{number}:{make_key(user, canonical_topics(topics), days, hours, name)[:16]}"
+    return row
+
+
+def resolve_users(names):
+    """Maps each username or user id in `names` to a user id (missing ones are left out)."""
+    names = list(names)
+    found = {}
+    with get_db() as conn:
+        for start in range(0, len(names), 500):
+            chunk = names[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            for user_id, username in conn.execute(
+                f"SELECT id, username FROM users WHERE username IN ({marks}) OR id IN ({marks})", chunk * 2
+            ):
+                found[username] = user_id
+                found[user_id] = user_id
+    return {name: found[name] for name in names if name in found}
+
+
+# ---------------- Checkpoint ----------------
+class Checkpoint:
+    """Ids of rows already saved, kept in a JSON file replaced atomically on every save."""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.done = set(json.load(f)["done"])
+
+    def __contains__(self, row_id):
+        return row_id in self.done
+
+    def mark(self, row_ids):
+        self.done.update(row_ids)
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".checkpoint-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"done": sorted(self.done)}, f)
+        os.replace(tmp, self.path)
+
+
+# ---------------- Batch run ----------------
+def _percentile(values, share):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def run_batch(rows, checkpoint, workers=BATCH_WORKERS, write_size=BATCH_WRITE_SIZE, use_cache=True, log=None):
+    """
+    Generates and saves plans for parsed `rows`, skipping those in `checkpoint`.
+    Returns a report with counts, elapsed time, throughput and per-row latency.
+    Rows that fail are reported through log(message) and left out of the
+    checkpoint, so the next run retries them.
+    """
+    log = log or (lambda message: None)
+    start = time.perf_counter()
+    report = {"rows": len(rows), "skipped": 0, "saved": 0, "failed": 0, "analyses": 0}
+
+    pending = []
+    for row in rows:
+        if row["id"] in checkpoint:
+            report["skipped"] += 1
+        else:
+            pending.append(row)
+    users = resolve_users({row["user"] for row in pending})
+
+    # Identical topic lists are analyzed once; days and hours are packed locally per row
+    groups = {}
+    for row in pending:
+        if row["user"] not in users:
+            report["failed"] += 1
+            log(f"line {row['line']}: unknown user {row['user']!r}")
+            continue
+        groups.setdefault(make_key(canonical_topics(row["topics"])), []).append(row)
+    report["analyses"] = len(groups)
+
+    def analyze(topics_text):
+        began = time.perf_counter()
+        return analyze_topics(topics_text, use_cache), time.perf_counter() - began
+
+    buffer, buffer_ids, latencies = [], [], []
+
+    def flush():
+        if buffer:
+            save_timetables(buffer)
+            checkpoint.mark(buffer_ids)
+            report["saved"] += len(buffer)
+            buffer.clear()
+            buffer_ids.clear()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="batch") as pool:
+        futures = {pool.submit(analyze, group[0]["topics"]): group for group in groups.values()}
+        try:
+            for future in as_completed(futures):
+                group = futures[future]
+                try:
+                    analysis, seconds = future.result()
+                except Exception as e:
+                    analysis, seconds = None, 0.0
+                    error = f"{type(e).__name__}: {e}"
+                else:
+                    error = "the topic analysis could not be parsed"
+                if analysis is None:
+                    report["failed"] += len(group)
+                    for row in group:
+                        log(f"line {row['line']}: {error}")
+                    continue
+                for row in group:
+                    began = time.perf_counter()
+                    plan = plan_schedule(analysis["topics"], row["days"], row["hours"], analysis.get("tips"))
+                    buffer.append((users[row["user"]], row["name"], plan["schedule"]))
+                    buffer_ids.append(row["id"])
+                    latencies.append(seconds + time.perf_counter() - began)
+                if len(buffer) >= write_size:
+                    flush()
+        finally:
+            # Also on Ctrl-C: keep what is done so far, then stop waiting for the rest
+            for future in futures:
+                future.cancel()
+            flush()
+
+    elapsed = time.perf_counter() - start
+    report.update({
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(report["saved"] / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(statistics.median(latencies) * 1000, 1) if latencies else 0.0,
+            "p95": round(_percentile(latencies, 0.95) * 1000, 1),
+            "max": round(max(latencies, default=0.0) * 1000, 1),
+        },
+    })
+    return report
+
+
+# ---------------- CLI ----------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate StudyGo timetables for a list of users")
+    parser.add_argument("input", help="CSV with a header row, or .jsonl, with user, topics, days, hours[, name]")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_WRITE_SIZE, help="plans per transaction")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <input>.checkpoint)")
+    parser.add_argument("--no-cache", action="store_true", help="don't reuse cached topic analyses")
+    parser.add_argument("--report", help="also write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    rows = []
+    invalid = 0
+    for number, record in read_records(args.input):
+        try:
+            rows.append(parse_row(number, record))
+        except ValueError as e:
+            invalid += 1
+            log(f"line {number}: {e}")
+
+    checkpoint = Checkpoint(args.checkpoint or args.input + ".checkpoint")
+    report = run_batch(rows, checkpoint, args.workers, args.batch_size, not args.no_cache, log)
+    report["failed"] += invalid
+    report["rows"] += invalid
+
+    latency = report["latency_ms"]
+    print(f"{report['rows']} rows: {report['saved']} saved, {report['skipped']} already done, "
+          f"{report['failed']} failed ({report['analyses']} topic analyses)")
+    print(f"{report['elapsed_seconds']:.2f} s, {report['rows_per_second']:.1f} rows/s, "
+          f"row latency p50 {latency['p50']:.0f} ms, p95 {latency['p95']:.0f} ms, max {latency['max']:.0f} ms")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
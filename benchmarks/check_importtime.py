@@ -0,0 +1,76 @@
+# benchmarks/check_importtime.py
+"""
+Cold-start budget for the login page.
+
+Imports the modules app.py needs before a user picks a tool under
+`python -X importtime` in a fresh interpreter and fails when the total import
+time exceeds the budget or when a heavy dependency (LangChain, the OpenAI
+client, ...) is pulled in eagerly.
+
+    python benchmarks/check_importtime.py [--budget-ms 1500]
+
+tests/test_importtime.py runs the same check under pytest.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What app.py imports before the sidebar selection
+STARTUP_MODULES = ["auth_ui", "auth", "utils"]
+# Packages that may only be imported once a tool page is opened
+FORBIDDEN = ["langchain", "langchain_community", "langchain_core", "langchain_openai",
+             "openai", "httpx", "tiktoken", "duckduckgo_search"]
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "1500"))
+
+
+def measure(modules):
+    """Returns {module: cumulative microseconds} for every module imported."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + ", ".join(modules)],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        timings[name] = int(cumulative)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return timings
+
+
+def check(modules=STARTUP_MODULES):
+    """Returns (timings, total startup milliseconds, forbidden modules that were imported)."""
+    timings = measure(modules)
+    total_ms = sum(timings.get(name, 0) for name in modules) / 1000
+    loaded = sorted(name for name in timings if name.split(".")[0] in FORBIDDEN)
+    return timings, total_ms, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    args = parser.parse_args()
+
+    timings, total_ms, loaded = check()
+
+    print(f"Startup imports: {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    for name, micros in sorted(timings.items(), key=lambda item: item[1], reverse=True)[:10]:
+        print(f"  {micros / 1000:8.1f} ms  {name}")
+
+    failed = False
+    if loaded:
+        print("Heavy modules imported at startup: " + ", ".join(loaded))
+        failed = True
+    if total_ms > args.budget_ms:
+        print("Import time is over budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
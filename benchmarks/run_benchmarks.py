@@ -0,0 +1,325 @@
+# benchmarks/run_benchmarks.py
+"""
+Microbenchmarks for the storage and parsing hot paths.
+
+Seeds synthetic users with 10 to 10,000 chats and timetables in a throwaway
+database and times the helpers in utils.py, auth.py and timetable.py. Results
+are compared against a JSON baseline (benchmarks/baseline.json, committed).
+Every run also times a fixed calibration workload, and baseline medians are
+scaled by how much faster or slower this host runs it than the baseline host.
+A benchmark more than the threshold, and more than BENCH_NOISE_MS, slower than
+its scaled baseline counts as a regression (exit code 1). Comparing without a
+baseline file is an error (exit code 2).
+
+    python benchmarks/run_benchmarks.py                  # compare with the baseline
+    python benchmarks/run_benchmarks.py --save           # record a new baseline
+    python benchmarks/run_benchmarks.py --sizes 10,1000 --only load_chats
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baseline.json")
+# Allowed slowdown of the median against the baseline before it is a regression
+BENCH_REGRESSION_THRESHOLD = float(os.getenv("BENCH_REGRESSION_THRESHOLD", "0.25"))
+# Differences below this are timer noise, whatever the ratio
+BENCH_NOISE_MS = float(os.getenv("BENCH_NOISE_MS", "0.2"))
+CALIBRATION = "calibration"
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+MESSAGES_PER_CHAT = 6
+
+
+# ---------------- Synthetic data ----------------
+def make_messages(index):
+    messages = []
+    for turn in range(MESSAGES_PER_CHAT // 2):
+        messages.append({"role": "user", "content": f"How do I study topic {index}-{turn} efficiently for my exam?"})
+        messages.append({"role": "assistant", "content": (
+            f"Here is a structured plan for topic {index}-{turn}:\n\n"
+            "1. Review the fundamentals and key vocabulary.\n"
+            "2. Work through one guided tutorial end to end.\n"
+            "3. Practice with small exercises every day.\n" * 3
+        )})
+    return messages
+
+
+def make_schedule(index, days=7):
+    return {
+        f"Day {day}": [
+            {"topic": f"Topic {index}-{day}-a", "hours": 1.5},
+            {"topic": f"Topic {index}-{day}-b", "hours": 2},
+        ]
+        for day in range(1, days + 1)
+    }
+
+
+def seed_user(conn, chats, timetables):
+    """
+    Inserts a user with `chats` conversations and `timetables` plans; returns the user id.
+
+    Rows are bulk-inserted as plain text, bypassing save_chat (compression and
+    per-message search indexing), so only the save_chat benchmark measures the
+    real write path. The messages are indexed in one statement at the end so
+    reads and deletes see a search index like the app's.
+    """
+    user_id = str(uuid.uuid4())
+    conn.execute("INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)",
+                 (user_id, f"bench-{user_id}", "x"))
+    conn.executemany(
+        "INSERT INTO chats (user_id, title, timestamp) VALUES (?, ?, ?)",
+        [(user_id, f"Chat {i}", f"2025-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}.{i:06d}") for i in range(chats)]
+    )
+    chat_ids = [row[0] for row in conn.execute("SELECT id FROM chats WHERE user_id = ? ORDER BY id", (user_id,))]
+    conn.executemany(
+        "INSERT INTO chat_messages (chat_id, seq, role, content) VALUES (?, ?, ?, ?)",
+        [
+            (chat_id, seq, m["role"], m["content"])
+            for i, chat_id in enumerate(chat_ids)
+            for seq, m in enumerate(make_messages(i))
+        ]
+    )
+    conn.execute("""
+        INSERT INTO chat_messages_fts (rowid, owner, content)
+        SELECT m.id, 'u' || replace(c.user_id, '-', ''), m.content
+        FROM chat_messages m JOIN chats c ON c.id = m.chat_id WHERE c.user_id = ?
+    """, (user_id,))
+    from scheduler import schedule_summary
+
+    conn.executemany(
+        """INSERT INTO timetables (user_id, name, schedule_json, day_count, total_hours, topic_count, created_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        [(user_id, f"Plan {i}", json.dumps(make_schedule(i)), *schedule_summary(make_schedule(i)), time.time())
+         for i in range(timetables)]
+    )
+    return user_id
+
+
+def llm_outputs():
+    """Topic-analysis answers in the shapes the model actually returns."""
+    topics = [
+        {"topic": f"Chapter {i}: {name}", "difficulty": ("easy", "medium", "hard")[i % 3], "hours": 2 + i % 5}
+        for i, name in enumerate(["Limits", "Derivatives", "Integrals", "Series", "Vectors", "Matrices",
+                                  "Probability", "Statistics", "Graphs", "Recursion"] * 3)
+    ]
+    document = {"topics": topics, "tips": ["Review each topic the day after you study it.", "Sleep well."]}
+    clean = json.dumps(document, indent=2)
+    return {
+        "fenced": "```json\n" + clean + "\n```",
+        "prose": "Sure! Here is the analysis you asked for:\n\n```json\n" + clean + "\n```\n\nGood luck with your exams!",
+        "trailing_commas": clean.replace("\n    }", ",\n    }").replace("\n  ]", ",\n  ]"),
+        "truncated": "```json\n" + clean[:int(len(clean) * 0.7)],
+    }
+
+
+# ---------------- Timing ----------------
+def measure(func, rounds, setup=None):
+    """Runs func `rounds` times (calling setup() untimed before each) and returns timings in ms."""
+    timings = []
+    for _ in range(rounds):
+        argument = setup() if setup else None
+        start = time.perf_counter()
+        func(argument) if setup else func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": round(statistics.median(timings), 4),
+        "min_ms": round(min(timings), 4),
+        "max_ms": round(max(timings), 4),
+        "rounds": rounds,
+    }
+
+
+def rounds_for(size):
+    return max(3, min(50, 20000 // max(size, 1)))
+
+
+def calibrate():
+    """A fixed mix of JSON, string and in-memory SQLite work that tracks how fast this host runs the app code."""
+    document = {"topics": [{"topic": f"Topic {i}", "hours": i % 5} for i in range(200)]}
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, body TEXT)")
+
+    def work():
+        text = json.dumps(document)
+        json.loads(text)
+        conn.executemany("INSERT INTO t (body) VALUES (?)", [(text[i:i + 40],) for i in range(0, 4000, 40)])
+        conn.execute("SELECT COUNT(*), MAX(LENGTH(body)) FROM t WHERE body LIKE '%Topic 1%'").fetchone()
+        conn.execute("DELETE FROM t")
+
+    try:
+        return measure(work, 200)
+    finally:
+        conn.close()
+
+
+# ---------------- Benchmarks ----------------
+def run(sizes, only=None):
+    # Imported here so STUDYGO_DB_PATH points at the throwaway database first
+    from db import get_db
+    from utils import count_timetables, list_timetables, load_chats, load_timetables, save_chat
+    from auth import delete_user
+    import retrieval
+    from timetable import extract_json
+
+    def wanted(name):
+        return only is None or name in only
+
+    results = {CALIBRATION: calibrate()}
+    for size in sizes:
+        with get_db() as conn:
+            user_id = seed_user(conn, size, size)
+        rounds = rounds_for(size)
+
+        if wanted("load_chats"):
+            results[f"load_chats[n={size}]"] = measure(lambda: load_chats(user_id), rounds)
+        if wanted("load_timetables"):
+            results[f"load_timetables[n={size}]"] = measure(lambda: load_timetables(user_id), rounds)
+        if wanted("saved_plans_page"):
+            # What the saved-plans list reads per rerun: the count plus one page of summaries
+            results[f"saved_plans_page[n={size}]"] = measure(
+                lambda: (count_timetables(user_id), list_timetables(user_id, limit=10)), rounds
+            )
+        if wanted("retrieval_build"):
+            results[f"retrieval_build[n={size}]"] = measure(lambda: retrieval._build(user_id), min(rounds, 10))
+        if wanted("retrieval_search"):
+            retrieval.drop_user(user_id)
+            retrieval.get_index(user_id)
+            results[f"retrieval_search[n={size}]"] = measure(
+                lambda: retrieval.retrieve_past_work(user_id, "How should I revise functions and modules?"), rounds
+            )
+        if wanted("delete_user"):
+            def fresh_user():
+                with get_db() as conn:
+                    return seed_user(conn, size, size)
+            results[f"delete_user[n={size}]"] = measure(delete_user, min(rounds, 5), setup=fresh_user)
+
+    if wanted("save_chat"):
+        with get_db() as conn:
+            user_id = seed_user(conn, 0, 0)
+        messages = make_messages(0)
+        results["save_chat"] = measure(
+            lambda: save_chat(user_id, "Benchmark chat", messages, "2025-01-01T00:00:00"), 200
+        )
+    if wanted("retrieve_context"):
+        # Stand-in corpus with a fixed 20 ms per search: "cold" runs the queries
+        # in parallel, "cached" is served from the response cache
+        from llm_cache import get_response_cache
+        from search import CACHE_NAMESPACE, LocalCorpusBackend, retrieve_context
+
+        backend = LocalCorpusBackend([text for shape, text in llm_outputs().items()]
+                                     + [m["content"] for m in make_messages(0)], latency=0.02)
+        question = "How should I plan my study week?"
+        results["retrieve_context[cold]"] = measure(
+            lambda _: retrieve_context(question, backend), 20,
+            setup=lambda: get_response_cache().clear(CACHE_NAMESPACE)
+        )
+        results["retrieve_context[cached]"] = measure(lambda: retrieve_context(question, backend), 50)
+    if wanted("extract_json"):
+        for shape, text in llm_outputs().items():
+            results[f"extract_json[{shape}]"] = measure(lambda: extract_json(text), 200)
+    return results
+
+
+# ---------------- Baselines ----------------
+def host_scale(results, baseline):
+    """How much slower (>1) or faster (<1) this run's host is than the baseline's, from the calibration workload."""
+    current, previous = results.get(CALIBRATION), baseline.get(CALIBRATION)
+    if not current or not previous:
+        return 1.0
+    return current["median_ms"] / previous["median_ms"]
+
+
+def compare(results, baseline, threshold, noise_ms=BENCH_NOISE_MS):
+    """Returns (name, scaled baseline ms, current ms) for every benchmark that regressed."""
+    scale = host_scale(results, baseline)
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None or name == CALIBRATION:
+            continue
+        expected = previous["median_ms"] * scale
+        if result["median_ms"] > expected * (1 + threshold) and result["median_ms"] - expected > noise_ms:
+            regressions.append((name, expected, result["median_ms"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="StudyGo storage and parsing microbenchmarks")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="chats/timetables per synthetic user (default: %(default)s)")
+    parser.add_argument("--only", default=None, help="comma-separated benchmark names")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--threshold", type=float, default=BENCH_REGRESSION_THRESHOLD)
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--output", default=None, help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="studygo-bench-")
+    os.environ["STUDYGO_DB_PATH"] = os.path.join(workdir, "bench.db")
+    os.environ.setdefault("LLM_CACHE_PATH", os.path.join(workdir, "llm_cache.db"))
+    sys.path.insert(0, ROOT)
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    only = set(args.only.split(",")) if args.only else None
+    results = run(sizes, only)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get("results", {})
+    elif not args.save:
+        # Otherwise every benchmark would be skipped and the run would pass without comparing anything
+        print(f"No baseline at {args.baseline}; record one with --save", file=sys.stderr)
+        return 2
+
+    scale = host_scale(results, baseline)
+    if baseline:
+        print(f"Host speed vs baseline: x{scale:.2f} (baseline medians are scaled by this)")
+    print(f"{'benchmark':<36} {'median ms':>12} {'baseline':>12} {'change':>8}")
+    for name, result in results.items():
+        previous = baseline.get(name, {}).get("median_ms")
+        if previous is not None and name != CALIBRATION:
+            previous = round(previous * scale, 4)
+        change = f"{(result['median_ms'] / previous - 1) * 100:+.0f}%" if previous else ""
+        print(f"{name:<36} {result['median_ms']:>12.3f} {previous if previous is not None else '-':>12} {change:>8}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save:
+        if os.path.exists(args.baseline):
+            # Keep entries for benchmarks that were not part of this run
+            with open(args.baseline) as f:
+                report["results"] = {**json.load(f).get("results", {}), **results}
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    missing = [name for name in results if name not in baseline]
+    if missing:
+        print("Not in the baseline (not compared): " + ", ".join(missing))
+    regressions = compare(results, baseline, args.threshold)
+    for name, expected, current in regressions:
+        print(f"REGRESSION {name}: {expected:.3f} ms (scaled baseline) -> {current:.3f} ms")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
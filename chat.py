@@ -2,17 +2,39 @@
 
 import streamlit as st
 from datetime import datetime
-from langchain.prompts import PromptTemplate
-from llm_utils import create_chain
-from utils import load_css, load_chats, save_chat, delete_chat
-import json
+from llm_utils import get_chain, invoke_chain, stream_chain, TimedStream, LLMUnavailableError, LLMTimeoutError
+from context import build_history, new_summary_state
+from llm_cache import LLM_CACHE_ENABLED, get_response_cache, make_key, normalize_query
+from retrieval import CHAT_RETRIEVAL, retrieve_past_work
+import metrics
+from metrics import span
+from utils import list_chats, count_chats, search_chats, load_chat, create_chat, append_chat_message, delete_chat
+import html
+import os
+import sqlite3
+import time
 import traceback  
+from functools import lru_cache
+from urllib.parse import urlsplit
+import markdown
+from markdown.treeprocessors import Treeprocessor
 
-load_css()
+# Number of conversations listed per sidebar page
+CHAT_PAGE_SIZE = 8
+# Render assistant tokens as they arrive instead of waiting for the whole answer
+CHAT_STREAMING = os.getenv("CHAT_STREAMING", "1") == "1"
+# Seconds between re-renders of a streaming answer
+CHAT_STREAM_RENDER_INTERVAL = float(os.getenv("CHAT_STREAM_RENDER_INTERVAL", "0.1"))
+# Newest messages rendered at first, and how many more "load earlier" reveals
+CHAT_WINDOW = int(os.getenv("CHAT_WINDOW", "30"))
+# Default of the sidebar "Use web search" toggle (see search.py)
+CHAT_WEB_SEARCH = os.getenv("CHAT_WEB_SEARCH", "0") == "1"
 
-def get_llm_chain():
-    prompt = PromptTemplate(
-        input_variables=["history", "query"],
+def build_chat_prompt():
+    from langchain.prompts import PromptTemplate
+
+    return PromptTemplate(
+        input_variables=["history", "past_work", "search_context", "query"],
         template="""You are an intelligent study planner and academic roadmap assistant.
 
 Your role is to help users:
@@ -28,24 +50,263 @@ Your role is to help users:
 Stay focused, helpful, and professional.
 
 Chat History:{history}
+From the User's Earlier Chats and Saved Plans (may be empty; build on them where relevant):
+{past_work}
+Web Search Results (may be empty; use them only where relevant):
+{search_context}
 New Question:{query}
 Give a helpful, structured answer suitable for a learning plan.
 """
     )
-    return create_chain(prompt)
+
+def get_llm_chain():
+    # Built once per process and LLM config, see llm_utils.get_chain
+    return get_chain("chat", build_chat_prompt)
+
+def build_summary_prompt():
+    from langchain.prompts import PromptTemplate
+
+    return PromptTemplate(
+        input_variables=["summary", "messages"],
+        template="""Update the running summary of a study-planning conversation.
+Keep the learner's goals, level, chosen topics, constraints and any plans or recommendations already given.
+Be concise (at most 150 words). Return only the updated summary.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}
+
+Updated summary:"""
+    )
+
+def summarize_turns(summary, messages):
+    chain = get_chain("chat_summary", build_summary_prompt, temperature=0, max_tokens=300)
+    response = invoke_chain(chain, {
+        "summary": summary or "(none yet)",
+        "messages": "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    })
+    return response["text"].strip()
+
+def get_summary_state():
+    """Running summary of the open conversation, cached per chat in session state."""
+    key = st.session_state.selected_chat_id or "unsaved"
+    return st.session_state.chat_summaries.setdefault(key, new_summary_state())
+
+# ---------------- Message rendering ----------------
+# Link and image URLs allowed in rendered messages (plus relative ones)
+SAFE_URL_SCHEMES = ("", "http", "https", "mailto")
+
+class _SafeURLs(Treeprocessor):
+    """Removes href/src attributes whose scheme isn't in SAFE_URL_SCHEMES (javascript:, data:, ...)."""
+
+    def run(self, root):
+        for element in root.iter():
+            for attribute in ("href", "src"):
+                url = element.get(attribute)
+                if url is not None and urlsplit(url.strip()).scheme.lower() not in SAFE_URL_SCHEMES:
+                    del element.attrib[attribute]
+
+def render_markdown(text):
+    """
+    Message Markdown as HTML. Raw HTML in the text is shown as text instead of
+    being passed through, and unsafe link URLs are dropped.
+    """
+    # Markdown instances keep state between conversions, so each call gets its own
+    md = markdown.Markdown(extensions=["fenced_code", "tables", "sane_lists", "nl2br"])
+    md.preprocessors.deregister("html_block")
+    md.inlinePatterns.deregister("html")
+    # After the inline processor, which is what creates links and images
+    md.treeprocessors.register(_SafeURLs(md), "safe_urls", 5)
+    return md.convert(text)
+
+def format_message_html(role, content):
+    """HTML for one chat bubble, with the content rendered from Markdown."""
+    css_class, icon = ("user-message", "🤓") if role == "user" else ("ai-message", "🧠")
+    # One line per bubble: Streamlit would parse whatever follows a blank line as Markdown
+    body = render_markdown(content).replace("\n", "&#10;")
+    return f'<div class="{css_class}"><strong>{icon}</strong><br>{body}</div>'
+
+@lru_cache(maxsize=2048)
+def message_html(role, content):
+    """Cached format_message_html() for finished messages, so reruns don't re-format them."""
+    return format_message_html(role, content)
+
+def render_transcript(messages):
+    """
+    Renders the newest CHAT_WINDOW messages of the open chat as a single block,
+    with a button that reveals earlier messages CHAT_WINDOW at a time.
+    """
+    if "chat_window" not in st.session_state or st.session_state.chat_window_for != st.session_state.selected_chat_id:
+        st.session_state.chat_window_for = st.session_state.selected_chat_id
+        st.session_state.chat_window = CHAT_WINDOW
+
+    hidden = max(0, len(messages) - st.session_state.chat_window)
+    if hidden and st.button(f"⬆️ Load earlier messages ({hidden} hidden)", key="chat_load_earlier", use_container_width=True):
+        st.session_state.chat_window += CHAT_WINDOW
+        hidden = max(0, len(messages) - st.session_state.chat_window)
+
+    with span("render.chat_transcript", messages=len(messages) - hidden):
+        st.markdown("\n".join(message_html(m["role"], m["content"]) for m in messages[hidden:]), unsafe_allow_html=True)
+
+def stream_response(chain, inputs, placeholder):
+    """
+    Streams the answer into `placeholder` as tokens arrive.
+    Returns the full text and the TimedStream holding its timings.
+    """
+    stream = TimedStream(stream_chain(chain, inputs))
+    text = ""
+    last_render = 0.0
+    for chunk in stream:
+        text += chunk
+        # Re-rendering the Markdown costs more per token as the answer grows, so partials are throttled
+        if time.monotonic() - last_render >= CHAT_STREAM_RENDER_INTERVAL:
+            placeholder.markdown(format_message_html("assistant", text + "▌"), unsafe_allow_html=True)
+            last_render = time.monotonic()
+    placeholder.markdown(message_html("assistant", text), unsafe_allow_html=True)
+    return text, stream
+
+def invoke_response(chain, inputs):
+    """Blocking call used when streaming is off; returns the text and its timing in ms."""
+    start = time.perf_counter()
+    response = invoke_chain(chain, inputs)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    if isinstance(response, dict):
+        ai_msg = response.get("text") or response.get("content") or str(response)
+    else:
+        ai_msg = str(response)
+    return ai_msg, elapsed_ms
+
+def chat_cache_key(chain, inputs, user_id=None):
+    # The prompt template is part of the key so prompt edits invalidate old answers.
+    # Retrieved past work shifts with every chat the user saves and search snippets
+    # follow from the query, so only whose work and whether search was used are keyed.
+    scope = f"user:{user_id}" if inputs["past_work"] else None
+    return make_key(normalize_query(inputs["query"]), inputs["history"], scope,
+                    bool(inputs["search_context"]), chain.prompt.template)
+
+def past_work_context(user_id, query):
+    """Passages from the user's other chats and saved plans (see retrieval.py)."""
+    try:
+        context, _ = retrieve_past_work(user_id, query, exclude_chat=st.session_state.selected_chat_id)
+    except Exception as e:
+        # Retrieval is optional: answer without it rather than fail the question
+        metrics.log_event("chat.context_error", source="past_work", error=f"{type(e).__name__}: {e}")
+        return ""
+    return context
+
+def web_search_context(query):
+    """Search snippets for the prompt; an unavailable search just means no snippets."""
+    from search import retrieve_context
+
+    try:
+        context, stats = retrieve_context(query)
+    except Exception as e:
+        metrics.log_event("chat.context_error", source="web_search", error=f"{type(e).__name__}: {e}")
+        return ""
+    st.session_state.chat_search_stats = stats
+    return context
+
+def get_cached_answer(cache_key):
+    try:
+        return get_response_cache().get("chat", cache_key)
+    except sqlite3.Error:
+        # The cache is an optimization; never fail a question because of it
+        return None
+
+def store_cached_answer(cache_key, answer):
+    try:
+        get_response_cache().set("chat", cache_key, answer)
+    except sqlite3.Error:
+        pass
+
+def record_turn_metrics(ttft_ms, total_ms, source, context_stats):
+    st.session_state.chat_metrics.append({
+        "ttft_ms": round(ttft_ms, 1),
+        "total_ms": round(total_ms, 1),
+        "source": source,
+        "prompt_tokens_before": context_stats["tokens_before"],
+        "prompt_tokens_after": context_stats["tokens_after"]
+    })
+
+def persist_message(user_id, role, content):
+    """Appends one turn to the open conversation, creating the conversation on its first message."""
+    if st.session_state.selected_chat_id is None:
+        chat_title = content[:40] + "..." if len(content) > 40 else content
+        st.session_state.selected_chat_id = create_chat(user_id, chat_title, datetime.now().isoformat())
+    append_chat_message(st.session_state.selected_chat_id, role, content)
+
+def render_search_results(user_id, query):
+    """Sidebar list of full-text search hits, paginated with the query's own offset."""
+    if st.session_state.get("chat_search_for") != query:
+        st.session_state.chat_search_for = query
+        st.session_state.chat_search_page = 0
+    page = st.session_state.chat_search_page
+    results, has_more = search_chats(user_id, query, limit=CHAT_PAGE_SIZE, offset=page * CHAT_PAGE_SIZE)
+
+    if not results:
+        st.markdown("<div class='info-card'><p>🔎 No chats match your search.</p></div>", unsafe_allow_html=True)
+        return
+    for result in results:
+        display_title = result['title'][:22] + "..." if len(result['title']) > 22 else result['title']
+        if st.button(f"💬 {display_title}", key=f"search_{result['id']}", use_container_width=True,
+                     help=f"{result['matches']} matching message(s)"):
+            st.session_state.chat_messages = load_chat(user_id, result["id"]) or []
+            st.session_state.selected_chat_id = result["id"]
+            st.success(f"📖 Loaded: {display_title}")
+            st.rerun()
+        st.caption(result["snippet"])
+
+    col_prev, col_next = st.columns(2)
+    with col_prev:
+        if page and st.button("⬅️ Previous", key="search_prev", use_container_width=True):
+            st.session_state.chat_search_page -= 1
+            st.rerun()
+    with col_next:
+        if has_more and st.button("More ➡️", key="search_next", use_container_width=True):
+            st.session_state.chat_search_page += 1
+            st.rerun()
 
 def chat_interface():
     if "chat_messages" not in st.session_state:
         st.session_state.chat_messages = []
-    if "selected_chat_index" not in st.session_state:
-        st.session_state.selected_chat_index = None
+    if "selected_chat_id" not in st.session_state:
+        st.session_state.selected_chat_id = None
+    if "chat_page_cursors" not in st.session_state:
+        st.session_state.chat_page_cursors = []
+    if "chat_metrics" not in st.session_state:
+        st.session_state.chat_metrics = []
+    if "chat_summaries" not in st.session_state:
+        st.session_state.chat_summaries = {}
 
     user_id = st.session_state.get("user_id")
     is_guest = st.session_state.get("is_guest", False)
 
-    chats = load_chats(user_id) if not is_guest and user_id else []
+    chats, total_chats = [], 0
+    if not is_guest and user_id:
+        cursors = st.session_state.chat_page_cursors
+        chats = list_chats(user_id, limit=CHAT_PAGE_SIZE, before=cursors[-1] if cursors else None)
+        if not chats and cursors:
+            # The page emptied out (e.g. after deletes), fall back to the newest chats
+            cursors.clear()
+            chats = list_chats(user_id, limit=CHAT_PAGE_SIZE)
+        total_chats = count_chats(user_id)
 
     with st.sidebar:
+        if LLM_CACHE_ENABLED:
+            st.checkbox("🔄 Fresh answer (skip cache)", key="chat_bypass_cache",
+                        help="Ask the AI again instead of reusing a saved answer to the same question")
+        st.checkbox("🌐 Use web search", key="chat_web_search", value=CHAT_WEB_SEARCH,
+                    help="Look the question up on the web and give the results to the AI")
+        if not is_guest:
+            st.checkbox("📚 Use my past chats and plans", key="chat_past_work", value=CHAT_RETRIEVAL,
+                        help="Let the AI draw on the most relevant parts of your earlier chats and saved timetables")
+        search_stats = st.session_state.get("chat_search_stats")
+        if st.session_state.get("chat_web_search") and search_stats:
+            st.caption(f"Last search: {search_stats['snippets']} snippets from {search_stats['queries']} queries "
+                       f"({search_stats['cache_hits']} cached) in {search_stats['elapsed_ms']:.0f} ms")
         st.markdown("### 🧠 Chat History")
         if is_guest:
             st.markdown("""
@@ -60,36 +321,55 @@ def chat_interface():
             st.markdown('<div class="success-button">', unsafe_allow_html=True)
             if st.button("✨ Start New Chat", use_container_width=True):
                 st.session_state.chat_messages = []
-                st.session_state.selected_chat_index = None
+                st.session_state.selected_chat_id = None
+                st.session_state.chat_metrics = []
+                st.session_state.chat_summaries.pop("unsaved", None)
                 st.success("🆕 New chat started!")
                 st.rerun()
             st.markdown('</div>', unsafe_allow_html=True)
             st.markdown("---")
 
-            if chats:
+            search_query = st.text_input("🔍 Search chats", key="chat_search_query",
+                                         placeholder="Search titles and messages...").strip()
+            if search_query:
+                render_search_results(user_id, search_query)
+            elif chats:
                 st.markdown("**📚 Previous Conversations:**")
-                recent_chats = chats[-8:] if len(chats) > 8 else chats
-                for i, chat in enumerate(reversed(recent_chats)):
-                    actual_index = len(chats) - 1 - i
+                for chat in chats:
                     col1, col2 = st.columns([4, 1])
                     with col1:
                         display_title = chat['title'][:22] + "..." if len(chat['title']) > 22 else chat['title']
-                        is_current = st.session_state.selected_chat_index == actual_index
-                        if st.button(f"{'🟢' if is_current else '💬'} {display_title}", key=f"load_{actual_index}", use_container_width=True):
-                            st.session_state.chat_messages = chat["messages"]
-                            st.session_state.selected_chat_index = actual_index
+                        is_current = st.session_state.selected_chat_id == chat["id"]
+                        if st.button(f"{'🟢' if is_current else '💬'} {display_title}", key=f"load_{chat['id']}", use_container_width=True,
+                                     help=f"{chat['message_count']} messages"):
+                            st.session_state.chat_messages = load_chat(user_id, chat["id"]) or []
+                            st.session_state.selected_chat_id = chat["id"]
                             st.success(f"📖 Loaded: {display_title}")
                             st.rerun()
                     with col2:
                         st.markdown('<div class="danger-button">', unsafe_allow_html=True)
-                        if st.button("🗑️", key=f"delete_{actual_index}"):
-                            delete_chat(user_id, chat["title"])
+                        if st.button("🗑️", key=f"delete_{chat['id']}"):
+                            delete_chat(user_id, chat["id"])
+                            if st.session_state.selected_chat_id == chat["id"]:
+                                st.session_state.chat_messages = []
+                                st.session_state.selected_chat_id = None
                             st.success("🗑️ Chat deleted!")
                             st.rerun()
                         st.markdown('</div>', unsafe_allow_html=True)
 
-                if len(chats) > 8:
-                    st.markdown(f"<div class='info-card' style='text-align: center;'>... and {len(chats) - 8} more chats</div>", unsafe_allow_html=True)
+                cursors = st.session_state.chat_page_cursors
+                shown_until = len(cursors) * CHAT_PAGE_SIZE + len(chats)
+                if total_chats > CHAT_PAGE_SIZE:
+                    st.markdown(f"<div class='info-card' style='text-align: center;'>Showing {shown_until - len(chats) + 1}–{shown_until} of {total_chats} chats</div>", unsafe_allow_html=True)
+                    col_newer, col_older = st.columns(2)
+                    with col_newer:
+                        if cursors and st.button("⬅️ Newer", key="chats_newer", use_container_width=True):
+                            cursors.pop()
+                            st.rerun()
+                    with col_older:
+                        if shown_until < total_chats and st.button("Older ➡️", key="chats_older", use_container_width=True):
+                            cursors.append((chats[-1]["timestamp"], chats[-1]["id"]))
+                            st.rerun()
             else:
                 st.markdown("""
                     <div class="info-card">
@@ -105,7 +385,7 @@ def chat_interface():
         current_chat_title = st.session_state.chat_messages[0]["content"][:35] + "..." if len(st.session_state.chat_messages[0]["content"]) > 35 else st.session_state.chat_messages[0]["content"]
         st.markdown(f"""
             <div class="info-card" style="border-left: 4px solid #28a745;">
-                <p><strong>📖 Current Chat:</strong> {current_chat_title}</p>
+                <p><strong>📖 Current Chat:</strong> {html.escape(current_chat_title)}</p>
                 <p style="font-size: 0.85rem;">💬 {len(st.session_state.chat_messages)} messages in this conversation</p>
             </div>
         """, unsafe_allow_html=True)
@@ -114,21 +394,7 @@ def chat_interface():
 
     with chat_container:
         if st.session_state.chat_messages:
-            for msg in st.session_state.chat_messages:
-                if msg["role"] == "user":
-                    st.markdown(f"""
-                        <div class="user-message">
-                            <strong>🤓</strong><br>
-                            <span>{msg["content"]}</span>
-                        </div>
-                    """, unsafe_allow_html=True)
-                else:
-                    st.markdown(f"""
-                        <div class="ai-message">
-                            <strong>🧠</strong><br>
-                            <span>{msg["content"]}</span>
-                        </div>
-                    """, unsafe_allow_html=True)
+            render_transcript(st.session_state.chat_messages)
         else:
             st.markdown("""
                 <div class="welcome-section">
@@ -155,34 +421,61 @@ def chat_interface():
     user_query = st.chat_input("💬 Ask your study question here... ")
 
     if user_query:
+        persist = not is_guest and user_id
         st.session_state.chat_messages.append({"role": "user", "content": user_query})
+        if persist:
+            persist_message(user_id, "user", user_query)
+
+        with chat_container:
+            st.markdown(message_html("user", user_query), unsafe_allow_html=True)
+            placeholder = st.empty()
 
         with st.spinner("AI is analyzing your question and preparing a helpful response..."):
             chain = get_llm_chain()
-            history = "\n".join(f"{m['role']}: {m['content']}" for m in st.session_state.chat_messages[:-1])
+            history, context_stats = build_history(st.session_state.chat_messages[:-1], get_summary_state(), summarize_turns)
+            past_work = ""
+            if persist and st.session_state.get("chat_past_work", CHAT_RETRIEVAL):
+                past_work = past_work_context(user_id, user_query)
+            search_context = ""
+            if st.session_state.get("chat_web_search", CHAT_WEB_SEARCH):
+                search_context = web_search_context(user_query)
+            inputs = {"history": history, "past_work": past_work, "search_context": search_context, "query": user_query}
 
             try:
-                response = chain.invoke({"history": history, "query": user_query})
+                use_cache = LLM_CACHE_ENABLED and not st.session_state.get("chat_bypass_cache", False)
+                cache_key = chat_cache_key(chain, inputs, user_id) if LLM_CACHE_ENABLED else None
+                start = time.perf_counter()
+                ai_msg = get_cached_answer(cache_key) if use_cache else None
 
-                if isinstance(response, dict):
-                    ai_msg = response.get("text") or response.get("content") or str(response)
+                if ai_msg is not None:
+                    elapsed_ms = (time.perf_counter() - start) * 1000
+                    placeholder.markdown(message_html("assistant", ai_msg), unsafe_allow_html=True)
+                    record_turn_metrics(elapsed_ms, elapsed_ms, "cache", context_stats)
                 else:
-                    ai_msg = str(response)
+                    if CHAT_STREAMING:
+                        ai_msg, timing = stream_response(chain, inputs, placeholder)
+                        record_turn_metrics(timing.ttft_ms, timing.total_ms, "stream", context_stats)
+                    else:
+                        ai_msg, elapsed_ms = invoke_response(chain, inputs)
+                        record_turn_metrics(elapsed_ms, elapsed_ms, "invoke", context_stats)
+                    if cache_key is not None:
+                        # Also refreshes the entry when the user asked to skip the cache
+                        store_cached_answer(cache_key, ai_msg)
 
-                st.session_state.chat_messages.append({"role": "assistant", "content": ai_msg})
+            except (LLMUnavailableError, LLMTimeoutError) as e:
+                ai_msg = "I apologize, but the AI service is busy right now. Please try again in a moment."
+                st.warning(f"⚠️ {e}")
             except Exception as e:
-                error_msg = "I apologize, but I encountered an error processing your request."
-                st.session_state.chat_messages.append({"role": "assistant", "content": error_msg})
+                ai_msg = "I apologize, but I encountered an error processing your request."
                 st.error("⚠️ Error occurred during chain invocation:")
                 st.code(traceback.format_exc(), language="python")  # Show full traceback
 
-        if not is_guest and user_id:
-            if "chat_saved" not in st.session_state or not st.session_state.chat_saved:
-                if len([m for m in st.session_state.chat_messages if m["role"] == "assistant"]) > 0:
-                    chat_title = st.session_state.chat_messages[0]["content"][:40] + "..." if len(st.session_state.chat_messages[0]["content"]) > 40 else st.session_state.chat_messages[0]["content"]
-                    save_chat(user_id, chat_title, st.session_state.chat_messages, datetime.now().isoformat())
-                    st.session_state.chat_saved = True
+            st.session_state.chat_messages.append({"role": "assistant", "content": ai_msg})
+            if persist:
+                persist_message(user_id, "assistant", ai_msg)
 
+        # The rerun below cuts this one short; record it now so the LLM turn is timed
+        metrics.end_rerun("chat")
         st.rerun()
 
     if not st.session_state.chat_messages:
@@ -214,4 +507,15 @@ def chat_interface():
                     • 🧠 AI responses: {ai_messages}<br>
                     • 📈 Total messages: {len(st.session_state.chat_messages)}</p>
                 </div>
-            """, unsafe_allow_html=True)
\ No newline at end of file
+            """, unsafe_allow_html=True)
+            if st.session_state.chat_metrics:
+                last = st.session_state.chat_metrics[-1]
+                st.markdown(f"""
+                    <div class="info-card">
+                        <p><strong>Last Response:</strong><br>
+                        • ⚡ First token: {last['ttft_ms']:.0f} ms<br>
+                        • ⏱️ Total time: {last['total_ms']:.0f} ms<br>
+                        • 🧾 Context: {last['prompt_tokens_before']} → {last['prompt_tokens_after']} tokens<br>
+                        • {'♻️ Served from cache' if last['source'] == 'cache' else '🌐 Fresh from the AI'}</p>
+                    </div>
+                """, unsafe_allow_html=True)
\ No newline at end of file
@@ -0,0 +1,259 @@
+# compression.py
+"""
+Transparent compression for stored chat messages and timetables.
+
+Each row records the codec its payload was written with (NULL = plain text),
+so rows written before compression, or too small to be worth it, still load.
+zlib is always available; zstd (optionally with a dictionary trained on the
+existing data) is used when the zstandard package is installed.
+
+    python compression.py report                 # bytes per codec, decode time
+    python compression.py recompress [--codec zstd --train-dict]
+"""
+import argparse
+import os
+import threading
+import time
+import zlib
+from functools import lru_cache
+
+from db import get_db
+
+# "zlib", "zstd" or "none" for newly written rows
+STORAGE_CODEC = os.getenv("STORAGE_CODEC", "zlib")
+# Payloads shorter than this (in bytes) are stored as plain text
+STORAGE_COMPRESS_MIN_BYTES = int(os.getenv("STORAGE_COMPRESS_MIN_BYTES", "256"))
+ZLIB_LEVEL = int(os.getenv("STORAGE_ZLIB_LEVEL", "6"))
+ZSTD_LEVEL = int(os.getenv("STORAGE_ZSTD_LEVEL", "9"))
+ZSTD_DICT_SIZE = 64 * 1024
+
+# Tables holding compressed payloads: (table, payload column)
+PAYLOADS = (("chat_messages", "content"), ("timetables", "schedule_json"))
+# FTS5 search indexes, reported next to the payloads they take space beside
+SEARCH_INDEXES = ("chat_messages_fts", "chats_fts")
+
+
+@lru_cache(maxsize=1)
+def _zstd():
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+
+# ---------------- Dictionaries ----------------
+_dicts = {}
+_dicts_lock = threading.Lock()
+
+
+def _load_dict(dict_id, conn=None):
+    with _dicts_lock:
+        if dict_id not in _dicts:
+            if conn is None:
+                with get_db() as conn:
+                    row = conn.execute("SELECT data FROM compression_dicts WHERE id = ?", (dict_id,)).fetchone()
+            else:
+                row = conn.execute("SELECT data FROM compression_dicts WHERE id = ?", (dict_id,)).fetchone()
+            if row is None:
+                raise LookupError(f"compression dictionary {dict_id} is missing")
+            _dicts[dict_id] = _zstd().ZstdCompressionDict(row[0])
+        return _dicts[dict_id]
+
+
+_UNSET = object()
+_active_dict_id = _UNSET
+
+
+def active_dict_id():
+    """Newest trained dictionary, used for new zstd rows (None if there is none)."""
+    global _active_dict_id
+    if _active_dict_id is _UNSET:
+        with get_db() as conn:
+            _active_dict_id = conn.execute("SELECT MAX(id) FROM compression_dicts").fetchone()[0]
+    return _active_dict_id
+
+
+def train_dictionary(size=ZSTD_DICT_SIZE, sample_rows=5000):
+    """Trains a zstd dictionary on recent payloads, stores it and returns its id."""
+    zstd = _zstd()
+    if zstd is None:
+        raise RuntimeError("Training a dictionary needs the zstandard package")
+    samples = []
+    with get_db() as conn:
+        for table, column in PAYLOADS:
+            rows = conn.execute(
+                f"SELECT {column}, codec FROM {table} ORDER BY rowid DESC LIMIT ?", (sample_rows,)
+            ).fetchall()
+            samples.extend(decode(value, codec).encode() for value, codec in rows)
+    trained = zstd.train_dictionary(size, samples)
+    with get_db() as conn:
+        cursor = conn.execute(
+            "INSERT INTO compression_dicts (codec, data, created_at) VALUES ('zstd', ?, ?)",
+            (trained.as_bytes(), time.time())
+        )
+    global _active_dict_id
+    _active_dict_id = cursor.lastrowid
+    return cursor.lastrowid
+
+
+# ---------------- Encode / decode ----------------
+def encode(text, codec=None, dict_id=None):
+    """
+    Returns (value, codec) to store for `text`. Small payloads, codec "none" and
+    payloads that don't shrink are kept as text with codec None. zstd uses
+    `dict_id`, or the newest trained dictionary if there is one.
+    """
+    codec = codec or STORAGE_CODEC
+    raw = text.encode()
+    if codec == "none" or len(raw) < STORAGE_COMPRESS_MIN_BYTES:
+        return text, None
+    if codec == "zstd" and _zstd() is not None:
+        dict_id = active_dict_id() if dict_id is None else dict_id
+        if dict_id is not None:
+            compressor = _zstd().ZstdCompressor(level=ZSTD_LEVEL, dict_data=_load_dict(dict_id))
+            value, codec = compressor.compress(raw), f"zstd:{dict_id}"
+        else:
+            value = _zstd().ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    else:
+        # zstd requested but not installed: zlib still saves most of the space.
+        # A window no larger than the payload makes small messages much cheaper
+        # to compress; zlib.decompress reads the window size from the header.
+        wbits = min(15, max(9, len(raw).bit_length()))
+        value, codec = zlib.compress(raw, ZLIB_LEVEL, wbits=wbits), "zlib"
+    if len(value) >= len(raw) * 0.9:
+        return text, None
+    return value, codec
+
+
+def decode(value, codec, conn=None):
+    """
+    Inverse of encode(): the stored value and codec back to text. Dictionaries
+    are read through `conn` when given (migrations and SQL functions run before
+    the pool exists or inside one of its connections).
+    """
+    if codec is None:
+        return value
+    if codec == "zlib":
+        return zlib.decompress(value).decode()
+    if codec == "zstd":
+        return _zstd().ZstdDecompressor().decompress(value).decode()
+    if codec.startswith("zstd:"):
+        dict_data = _load_dict(int(codec.split(":", 1)[1]), conn)
+        return _zstd().ZstdDecompressor(dict_data=dict_data).decompress(value).decode()
+    raise ValueError(f"Unknown storage codec {codec!r}")
+
+
+# ---------------- Report / recompression ----------------
+def report():
+    """Stored bytes per table and codec, plus the mean decode time per row."""
+    result = {}
+    with get_db() as conn:
+        for table, column in PAYLOADS:
+            groups = conn.execute(f"""
+                SELECT COALESCE(codec, 'plain'), COUNT(*), SUM(LENGTH(CAST({column} AS BLOB)))
+                FROM {table} GROUP BY codec
+            """).fetchall()
+            sample = conn.execute(f"SELECT {column}, codec FROM {table} ORDER BY rowid DESC LIMIT 2000").fetchall()
+
+            start = time.perf_counter()
+            for value, codec in sample:
+                decode(value, codec)
+            elapsed = time.perf_counter() - start
+            result[table] = {
+                "codecs": {codec: {"rows": rows, "bytes": size or 0} for codec, rows, size in groups},
+                "decode_us_per_row": elapsed / len(sample) * 1e6 if sample else 0.0,
+            }
+        result["search_index"] = {name: _index_bytes(conn, name) for name in SEARCH_INDEXES}
+    return result
+
+
+def _index_bytes(conn, name):
+    """Bytes in an FTS5 table's shadow tables: postings, sizes and any stored copy of the text."""
+    total = 0
+    for (shadow,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN (?, ?, ?)",
+        (f"{name}_data", f"{name}_docsize", f"{name}_content")
+    ).fetchall():
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({shadow})") if row[1] != "id"]
+        lengths = " + ".join(f"COALESCE(LENGTH(CAST({column} AS BLOB)), 0)" for column in columns)
+        total += conn.execute(f"SELECT COALESCE(SUM({lengths}), 0) FROM {shadow}").fetchone()[0]
+    return total
+
+
+def recompress(codec=None, dict_id=None, batch_size=500):
+    """
+    Rewrites every payload with `codec` (default STORAGE_CODEC) in batches of
+    `batch_size` rows, one transaction each. Returns per-table bytes before and
+    after, rows changed and the mean decode time per row of the new values.
+    """
+    codec = codec or STORAGE_CODEC
+    result = {}
+    for table, column in PAYLOADS:
+        stats = {"rows": 0, "changed": 0, "bytes_before": 0, "bytes_after": 0, "decode_seconds": 0.0}
+        after = 0
+        while True:
+            with get_db() as conn:
+                rows = conn.execute(
+                    f"SELECT rowid, {column}, codec FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (after, batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+                updates = []
+                for rowid, value, old_codec in rows:
+                    text = decode(value, old_codec)
+                    new_value, new_codec = encode(text, codec, dict_id)
+                    start = time.perf_counter()
+                    decode(new_value, new_codec)
+                    stats["decode_seconds"] += time.perf_counter() - start
+                    stats["rows"] += 1
+                    stats["bytes_before"] += _size(value)
+                    stats["bytes_after"] += _size(new_value)
+                    if new_codec != old_codec or new_value != value:
+                        updates.append((new_value, new_codec, rowid))
+                conn.executemany(f"UPDATE {table} SET {column} = ?, codec = ? WHERE rowid = ?", updates)
+                stats["changed"] += len(updates)
+            after = rows[-1][0]
+        stats["decode_us_per_row"] = stats.pop("decode_seconds") / stats["rows"] * 1e6 if stats["rows"] else 0.0
+        stats["bytes_saved"] = stats["bytes_before"] - stats["bytes_after"]
+        result[table] = stats
+    return result
+
+
+def _size(value):
+    return len(value) if isinstance(value, bytes) else len(value.encode())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="StudyGo storage compression")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("report", help="show stored bytes per codec and decode time")
+    run = commands.add_parser("recompress", help="rewrite stored payloads with a codec")
+    run.add_argument("--codec", choices=["zlib", "zstd", "none"], default=STORAGE_CODEC)
+    run.add_argument("--train-dict", action="store_true", help="train a zstd dictionary first and use it")
+    run.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    if args.command == "report":
+        result = report()
+        indexes = result.pop("search_index")
+        for table, stats in result.items():
+            print(f"{table}: decode {stats['decode_us_per_row']:.1f} µs/row")
+            for codec, group in stats["codecs"].items():
+                print(f"  {codec:<10} {group['rows']:>8} rows {group['bytes']:>12} bytes")
+        print("search index:")
+        for name, size in indexes.items():
+            print(f"  {name:<18} {size:>21} bytes")
+        return
+
+    dict_id = train_dictionary() if args.train_dict else None
+    for table, stats in recompress(args.codec, dict_id, args.batch_size).items():
+        before, after = stats["bytes_before"], stats["bytes_after"]
+        saved = (1 - after / before) * 100 if before else 0.0
+        print(f"{table}: {stats['rows']} rows, {stats['changed']} rewritten, "
+              f"{before} -> {after} bytes ({saved:.1f}% saved), decode {stats['decode_us_per_row']:.1f} µs/row")
+
+
+if __name__ == "__main__":
+    main()
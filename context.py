@@ -0,0 +1,92 @@
+# context.py
+"""
+Token-budgeted conversation context for the chat prompt.
+
+The newest turns are kept verbatim; turns that no longer fit the budget are
+folded into a running summary that is updated incrementally, so each summary
+call only sees the turns that just dropped out of the window.
+"""
+import os
+from functools import lru_cache
+
+# Token budget for the history part of the chat prompt
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "2000"))
+# Share of the budget reserved for the running summary
+CHAT_SUMMARY_SHARE = float(os.getenv("CHAT_SUMMARY_SHARE", "0.25"))
+# When the window overflows, fold turns until the verbatim part is this full,
+# so the summary is refreshed every few turns rather than on every turn
+CHAT_SUMMARY_REFILL = float(os.getenv("CHAT_SUMMARY_REFILL", "0.6"))
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    # tiktoken is optional; fall back to a ~4 characters per token estimate
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text):
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def format_message(message):
+    return f"{message['role']}: {message['content']}"
+
+
+def new_summary_state():
+    """Summary of messages[:upto] for one conversation."""
+    return {"upto": 0, "text": ""}
+
+
+def build_history(messages, summary_state, summarize, budget=CHAT_CONTEXT_TOKENS):
+    """
+    Builds the history string for the prompt from earlier `messages`.
+
+    `summarize(previous_summary, messages)` returns an updated summary text and is
+    only called for turns that newly fall out of the verbatim window.
+    `summary_state` (see new_summary_state) is updated in place.
+    Returns (history, stats) where stats holds prompt token counts before/after.
+    """
+    lines = [format_message(m) for m in messages]
+    tokens_before = sum(count_tokens(line) + 1 for line in lines)
+
+    # Walk back from the newest turn until the verbatim budget is used up
+    recent_budget = budget - int(budget * CHAT_SUMMARY_SHARE) if tokens_before > budget else budget
+    start, used = len(lines), 0
+    while start > 0 and used + count_tokens(lines[start - 1]) + 1 <= recent_budget:
+        start -= 1
+        used += count_tokens(lines[start]) + 1
+    if start == len(lines) and lines:
+        # Always keep the latest turn, trimmed if it alone exceeds the budget
+        start -= 1
+        lines[start] = lines[start][:recent_budget * 4]
+
+    if start > summary_state["upto"]:
+        while start < len(lines) - 1 and used > recent_budget * CHAT_SUMMARY_REFILL:
+            used -= count_tokens(lines[start]) + 1
+            start += 1
+        try:
+            summary_state["text"] = summarize(summary_state["text"], messages[summary_state["upto"]:start])
+            summary_state["upto"] = start
+        except Exception:
+            # Keep the old summary; the dropped turns are retried on the next turn
+            pass
+
+    recent = lines[max(start, summary_state["upto"]):]
+    history = "\n".join(recent)
+    if summary_state["text"] and summary_state["upto"]:
+        history = f"Summary of the earlier conversation: {summary_state['text']}\n{history}"
+
+    stats = {
+        "tokens_before": tokens_before,
+        "tokens_after": count_tokens(history),
+        "summarized_messages": summary_state["upto"],
+    }
+    return history, stats
@@ -0,0 +1,195 @@
+# db.py
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from env import load_env
+from migrations import migrate, register_functions
+import metrics
+
+# ---------------- Settings ----------------
+load_env()
+
+DB_PATH = os.getenv("STUDYGO_DB_PATH", "database.db")
+
+# Maximum number of open connections kept by the process-wide pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+# Seconds a caller waits for a free connection before giving up
+DB_CHECKOUT_TIMEOUT = float(os.getenv("DB_CHECKOUT_TIMEOUT", "5"))
+# Seconds SQLite itself waits on a locked database (busy_timeout)
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "5"))
+# Number of prepared statements cached per connection
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
+# Apply pending schema migrations when the pool is first created
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "1") == "1"
+
+DB_PRAGMAS = {
+    "journal_mode": os.getenv("DB_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("DB_SYNCHRONOUS", "NORMAL"),
+    # Negative cache_size is in KiB rather than pages
+    "cache_size": os.getenv("DB_CACHE_SIZE", "-16000"),
+    "mmap_size": os.getenv("DB_MMAP_SIZE", str(128 * 1024 * 1024)),
+    "temp_store": "MEMORY",
+    "foreign_keys": "1",
+}
+
+
+class PoolTimeoutError(sqlite3.OperationalError):
+    """Raised when no pooled connection becomes free within the checkout timeout."""
+
+
+# ---------------- Connection Pool ----------------
+class ConnectionPool:
+    """
+    Thread-aware pool of SQLite connections that lives for the whole process.
+
+    A thread that already holds a connection gets the same one back on nested
+    checkouts, so helpers can call each other inside a single transaction.
+    """
+
+    def __init__(self, path, size=DB_POOL_SIZE, timeout=DB_CHECKOUT_TIMEOUT, pragmas=None):
+        self.path = path
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.pragmas = DB_PRAGMAS if pragmas is None else pragmas
+        self._idle = queue.LifoQueue()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._closed = False
+        self._checkouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DB_BUSY_TIMEOUT,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE,
+        )
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        register_functions(conn)
+        return conn
+
+    def _checkout(self):
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._opened < self.size:
+                    self._opened += 1
+                    conn = self._connect_or_release()
+            if conn is None:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise PoolTimeoutError(
+                        f"No database connection available after {self.timeout}s "
+                        f"(pool size {self.size})"
+                    ) from None
+
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def _connect_or_release(self):
+        try:
+            return self._connect()
+        except Exception:
+            self._opened -= 1
+            raise
+
+    def _checkin(self, conn):
+        if self._closed:
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection; commits on success and rolls back on error."""
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            yield held
+            return
+
+        conn = self._checkout()
+        self._local.conn = conn
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._local.conn = None
+            self._checkin(conn)
+
+    def stats(self):
+        with self._lock:
+            checkouts = self._checkouts
+            return {
+                "pool_size": self.size,
+                "open_connections": self._opened,
+                "idle_connections": self._idle.qsize(),
+                "checkouts": checkouts,
+                "checkout_timeouts": self._timeouts,
+                "checkout_wait_avg_ms": (self._wait_total / checkouts * 1000) if checkouts else 0.0,
+                "checkout_wait_max_ms": self._wait_max * 1000,
+            }
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Return the process-wide pool for DB_PATH, creating it on first use.
+    Nothing touches the database before this is first called.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = ConnectionPool(DB_PATH)
+                if DB_AUTO_MIGRATE:
+                    with pool.connection() as conn:
+                        migrate(conn)
+                metrics.register_gauges("studygo_db_pool", pool.stats)
+                _pool = pool
+    return _pool
+
+
+def get_db():
+    """
+    Context manager yielding a pooled connection to the app database.
+
+        with get_db() as conn:
+            conn.execute(...)
+    """
+    return get_pool().connection()
+
+
+def pool_stats():
+    return get_pool().stats()
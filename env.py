@@ -0,0 +1,18 @@
+# env.py
+import threading
+
+_loaded = False
+_lock = threading.Lock()
+
+def load_env(override=False):
+    """
+    Loads variables from .env once per process (again when `override` is set).
+    Modules that read settings at import time call this first.
+    """
+    global _loaded
+    with _lock:
+        if _loaded and not override:
+            return
+        from dotenv import load_dotenv
+        load_dotenv(override=override)
+        _loaded = True
@@ -0,0 +1,110 @@
+# fake_llm.py
+"""
+Local stand-in for the Azure GPT-4o client, for offline development and tests.
+
+Enable it with LLM_PROVIDER=fake. It streams its answer word by word with
+configurable latency and can inject HTTP-style errors (429, 5xx), so streaming,
+caching, retry and timing code paths behave like they do against the real
+endpoint without any network access.
+"""
+import json
+import os
+import random
+import re
+import time
+from typing import Any, Callable, Iterator, List, Optional
+
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+# Seconds before the first token and between tokens
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.2"))
+FAKE_LLM_TOKEN_DELAY = float(os.getenv("FAKE_LLM_TOKEN_DELAY", "0.01"))
+# Share of calls that fail, and the HTTP status they fail with
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+FAKE_LLM_ERROR_STATUS = int(os.getenv("FAKE_LLM_ERROR_STATUS", "429"))
+
+
+class FakeLLMError(Exception):
+    """Injected failure carrying an HTTP status like the OpenAI client's errors."""
+
+    def __init__(self, status_code):
+        super().__init__(f"Injected fake LLM error (HTTP {status_code})")
+        self.status_code = status_code
+
+
+def topic_analysis_responder(prompt: str) -> str:
+    """Answers the timetable topic-analysis prompt with plausible JSON for the listed topics."""
+    block = prompt.split("<topics>", 1)[1].split("</topics>", 1)[0]
+    names = [re.sub(r"\s+", " ", item).strip(" -•*") for item in re.split(r"[\n,;]+", block)]
+    topics = []
+    for name in filter(None, names):
+        difficulty = ("easy", "medium", "hard")[len(name) % 3]
+        topics.append({"topic": name, "difficulty": difficulty, "hours": {"easy": 2, "medium": 4, "hard": 6}[difficulty]})
+    payload = {"topics": topics, "tips": ["Review each topic the day after you study it."]}
+    return "```json\n" + json.dumps(payload, indent=2) + "\n```"
+
+
+def default_responder(prompt: str) -> str:
+    """Answers the timetable prompt with topic JSON, anything else with a short canned study plan."""
+    if "<topics>" in prompt:
+        return topic_analysis_responder(prompt)
+    question = prompt.strip().splitlines()[-1] if prompt.strip() else ""
+    for line in reversed(prompt.splitlines()):
+        if line.startswith("New Question:"):
+            question = line[len("New Question:"):].strip()
+            break
+    return (
+        f"Here is a structured plan for: {question}\n\n"
+        "1. Review the fundamentals and key vocabulary.\n"
+        "2. Work through one guided tutorial end to end.\n"
+        "3. Practice with small exercises every day.\n"
+        "4. Build a mini project that combines what you learned.\n"
+        "5. Revisit weak spots with spaced repetition."
+    )
+
+
+def split_tokens(text: str) -> List[str]:
+    """Splits text into word-sized chunks that keep their trailing whitespace."""
+    tokens, current = [], ""
+    for char in text:
+        current += char
+        if char.isspace():
+            tokens.append(current)
+            current = ""
+    if current:
+        tokens.append(current)
+    return tokens
+
+
+class FakeStreamingLLM(LLM):
+    """LangChain LLM that answers locally and streams the answer token by token."""
+
+    latency: float = FAKE_LLM_LATENCY
+    token_delay: float = FAKE_LLM_TOKEN_DELAY
+    error_rate: float = FAKE_LLM_ERROR_RATE
+    error_status: int = FAKE_LLM_ERROR_STATUS
+    responder: Optional[Callable[[str], str]] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming"
+
+    def _respond(self, prompt: str) -> str:
+        return (self.responder or default_responder)(prompt)
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None,
+                **kwargs: Any) -> Iterator[GenerationChunk]:
+        time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            raise FakeLLMError(self.error_status)
+        for index, token in enumerate(split_tokens(self._respond(prompt))):
+            if index and self.token_delay:
+                time.sleep(self.token_delay)
+            chunk = GenerationChunk(text=token)
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
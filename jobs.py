@@ -0,0 +1,355 @@
+# jobs.py
+"""
+SQLite-backed background job queue.
+
+Slow work (timetable generation) is stored as a row in `jobs` and picked up by
+worker threads, so it survives the user navigating away and the page only has
+to poll the row. Workers claim jobs in a BEGIN IMMEDIATE transaction, which
+makes a claim atomic across threads and processes sharing the database. A job
+whose worker stopped sending heartbeats (e.g. the process died) is put back in
+the queue and retried up to JOB_MAX_ATTEMPTS times. Retries wait an
+exponentially growing delay, so a failing dependency isn't hammered.
+
+The Streamlit app starts JOB_WORKERS threads in-process; workers can also run
+on their own:
+
+    python jobs.py work --workers 4
+    python jobs.py stats
+"""
+import argparse
+import importlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+import metrics
+from db import get_db
+
+# ---------------- Settings ----------------
+# Worker threads started by the app (0: only separate `python jobs.py work` processes run jobs)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Seconds an idle worker sleeps between checks (new jobs in the same process wake it at once)
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+# A running job without a heartbeat for this many seconds is requeued
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Seconds before the first retry of a failed job; doubles with every further attempt
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "10"))
+# Finished jobs are deleted after this many seconds
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", str(7 * 24 * 3600)))
+# Minimum seconds between progress writes of one job
+JOB_PROGRESS_INTERVAL = 0.5
+
+ACTIVE_STATUSES = ("queued", "running")
+
+# kind -> callable or "module:function"; handler(job, report_progress) returns the JSON-able result
+HANDLERS = {
+    "timetable": "timetable:run_timetable_job",
+}
+
+
+class JobError(Exception):
+    """A failure that retrying won't fix; the job is marked failed with this message."""
+
+
+def register_handler(kind, handler):
+    HANDLERS[kind] = handler
+
+
+def _handler(kind):
+    handler = HANDLERS[kind]
+    if isinstance(handler, str):
+        module, name = handler.split(":")
+        handler = HANDLERS[kind] = getattr(importlib.import_module(module), name)
+    return handler
+
+
+# ---------------- Queue ----------------
+_wakeup = threading.Event()
+
+
+def _row_to_job(row):
+    (job_id, kind, user_id, session_id, payload, status, progress, result, error,
+     attempts, created_at, started_at, finished_at, not_before) = row
+    return {
+        "id": job_id, "kind": kind, "user_id": user_id, "session_id": session_id,
+        "payload": json.loads(payload), "status": status,
+        "progress": json.loads(progress) if progress else None,
+        "result": json.loads(result) if result else None,
+        "error": error, "attempts": attempts,
+        "created_at": created_at, "started_at": started_at, "finished_at": finished_at,
+        "not_before": not_before,
+    }
+
+
+_JOB_COLUMNS = """id, kind, user_id, session_id, payload_json, status, progress_json, result_json, error,
+                  attempts, created_at, started_at, finished_at, not_before"""
+
+
+def submit_job(kind, payload, user_id=None, session_id=None):
+    """Queues a job and returns its id."""
+    if kind not in HANDLERS:
+        raise ValueError(f"No handler for job kind {kind!r}")
+    with get_db() as conn:
+        cursor = conn.execute(
+            "INSERT INTO jobs (kind, user_id, session_id, payload_json, created_at) VALUES (?, ?, ?, ?, ?)",
+            (kind, user_id, session_id, json.dumps(payload), time.time())
+        )
+    _wakeup.set()
+    return cursor.lastrowid
+
+
+def get_job(job_id):
+    with get_db() as conn:
+        row = conn.execute(f"SELECT {_JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _row_to_job(row) if row else None
+
+
+def list_jobs(user_id=None, session_id=None, limit=10):
+    """Newest jobs of a user, or of a guest's browser session."""
+    column, owner = ("user_id", user_id) if user_id is not None else ("session_id", session_id)
+    with get_db() as conn:
+        rows = conn.execute(
+            f"SELECT {_JOB_COLUMNS} FROM jobs WHERE {column} = ? ORDER BY id DESC LIMIT ?", (owner, limit)
+        ).fetchall()
+    return [_row_to_job(row) for row in rows]
+
+
+def claim_job(worker):
+    """
+    Marks the oldest queued job that is due as running for `worker` and returns
+    it (None if no job is ready).
+    """
+    now = time.time()
+    with get_db() as conn:
+        if conn.in_transaction:
+            conn.commit()
+        # Takes the write lock before reading, so two workers can't claim the same row
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            f"""SELECT {_JOB_COLUMNS} FROM jobs
+                WHERE status = 'queued' AND (not_before IS NULL OR not_before <= ?) ORDER BY id LIMIT 1""",
+            (now,)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("""
+            UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1,
+                            started_at = ?, heartbeat_at = ?
+            WHERE id = ?
+        """, (worker, now, now, row[0]))
+    job = _row_to_job(row)
+    job.update(status="running", attempts=job["attempts"] + 1, started_at=now)
+    return job
+
+
+def update_progress(job_id, progress):
+    with get_db() as conn:
+        conn.execute(
+            "UPDATE jobs SET progress_json = ?, heartbeat_at = ? WHERE id = ? AND status = 'running'",
+            (json.dumps(progress), time.time(), job_id)
+        )
+
+
+def _heartbeat(job_ids):
+    if job_ids:
+        with get_db() as conn:
+            conn.execute(
+                f"UPDATE jobs SET heartbeat_at = ? WHERE id IN ({','.join('?' * len(job_ids))})",
+                (time.time(), *job_ids)
+            )
+
+
+def _finish(job, status, result=None, error=None):
+    now = time.time()
+    with get_db() as conn:
+        conn.execute("""
+            UPDATE jobs SET status = ?, result_json = ?, error = ?, finished_at = ?, worker = NULL
+            WHERE id = ?
+        """, (status, json.dumps(result) if result is not None else None, error, now, job["id"]))
+    if metrics.METRICS_ENABLED:
+        metrics.observe("studygo_job_wait_seconds", job["started_at"] - job["created_at"], kind=job["kind"])
+        metrics.observe("studygo_job_run_seconds", now - job["started_at"], kind=job["kind"])
+        metrics.increment("studygo_jobs_total", kind=job["kind"], outcome=status)
+
+
+def retry_delay(attempts):
+    """Seconds to wait before running a job again after `attempts` tries (with ±25% jitter)."""
+    return JOB_RETRY_BACKOFF * 2 ** max(0, attempts - 1) * random.uniform(0.75, 1.25)
+
+
+def _retry(job, error):
+    with get_db() as conn:
+        conn.execute("""
+            UPDATE jobs SET status = 'queued', error = ?, worker = NULL, started_at = NULL, not_before = ?
+            WHERE id = ?
+        """, (error, time.time() + retry_delay(job["attempts"]), job["id"]))
+    if metrics.METRICS_ENABLED:
+        metrics.increment("studygo_jobs_total", kind=job["kind"], outcome="retried")
+
+
+def requeue_stale(stale_after=JOB_STALE_AFTER):
+    """Requeues running jobs without a recent heartbeat (or fails them after JOB_MAX_ATTEMPTS); returns the count."""
+    cutoff, now = time.time() - stale_after, time.time()
+    with get_db() as conn:
+        conn.execute("""
+            UPDATE jobs SET status = 'failed', error = 'The worker stopped responding.', finished_at = ?, worker = NULL
+            WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ?
+        """, (now, cutoff, JOB_MAX_ATTEMPTS))
+        stale = conn.execute(
+            "SELECT id, attempts FROM jobs WHERE status = 'running' AND heartbeat_at < ?", (cutoff,)
+        ).fetchall()
+        conn.executemany("""
+            UPDATE jobs SET status = 'queued', worker = NULL, started_at = NULL, not_before = ?
+            WHERE id = ? AND status = 'running'
+        """, [(now + retry_delay(attempts), job_id) for job_id, attempts in stale])
+        return len(stale)
+
+
+def prune_jobs(retention=JOB_RETENTION):
+    with get_db() as conn:
+        return conn.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (time.time() - retention,)
+        ).rowcount
+
+
+def queue_stats(window=3600):
+    """Queue depth, age of the oldest queued job, and mean wait/run time of jobs finished within `window` seconds."""
+    now = time.time()
+    with get_db() as conn:
+        counts = dict(conn.execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE status IN ('queued', 'running') GROUP BY status"
+        ).fetchall())
+        oldest = conn.execute("SELECT MIN(created_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        finished, avg_wait, avg_run = conn.execute("""
+            SELECT COUNT(*), AVG(started_at - created_at), AVG(finished_at - started_at)
+            FROM jobs WHERE finished_at > ? AND status = 'done'
+        """, (now - window,)).fetchone()
+    return {
+        "queued": counts.get("queued", 0),
+        "running": counts.get("running", 0),
+        "oldest_wait_seconds": now - oldest if oldest else 0.0,
+        "finished": finished,
+        "avg_wait_seconds": avg_wait or 0.0,
+        "avg_run_seconds": avg_run or 0.0,
+        "workers": len(_workers),
+    }
+
+
+# ---------------- Workers ----------------
+_workers = []
+_workers_lock = threading.Lock()
+_running = set()
+_running_lock = threading.Lock()
+
+
+def run_job(job):
+    """Runs one claimed job through its handler and records the outcome."""
+    last_write = [0.0]
+
+    def report_progress(progress):
+        now = time.monotonic()
+        if now - last_write[0] >= JOB_PROGRESS_INTERVAL:
+            last_write[0] = now
+            update_progress(job["id"], progress)
+
+    with _running_lock:
+        _running.add(job["id"])
+    try:
+        with metrics.span("jobs.run", kind=job["kind"]):
+            result = _handler(job["kind"])(job, report_progress)
+    except JobError as e:
+        _finish(job, "failed", error=str(e))
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        if job["attempts"] < JOB_MAX_ATTEMPTS:
+            _retry(job, error)
+        else:
+            _finish(job, "failed", error=error)
+    else:
+        _finish(job, "done", result=result)
+    finally:
+        with _running_lock:
+            _running.discard(job["id"])
+
+
+def _work(worker, stop):
+    while not stop.is_set():
+        try:
+            job = claim_job(worker)
+        except Exception:
+            # Database busy or locked: try again on the next tick
+            job = None
+        if job is None:
+            _wakeup.wait(JOB_POLL_INTERVAL)
+            _wakeup.clear()
+            continue
+        run_job(job)
+
+
+def _maintain(stop):
+    """Heartbeats for this process's running jobs, plus periodic requeueing and pruning."""
+    last_sweep = 0.0
+    while not stop.wait(min(JOB_STALE_AFTER / 4, 30)):
+        try:
+            with _running_lock:
+                running = list(_running)
+            _heartbeat(running)
+            if time.monotonic() - last_sweep > JOB_STALE_AFTER:
+                last_sweep = time.monotonic()
+                if requeue_stale():
+                    _wakeup.set()
+                prune_jobs()
+        except Exception as e:
+            # A missed round is retried on the next tick; the thread has to keep running
+            metrics.log_event("jobs.maintenance_error", error=f"{type(e).__name__}: {e}")
+
+
+_stop = threading.Event()
+
+
+def start_workers(count=JOB_WORKERS):
+    """Starts `count` worker threads plus a maintenance thread (once per process)."""
+    if count <= 0 or _workers:
+        return
+    with _workers_lock:
+        if _workers:
+            return
+        prefix = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        for number in range(count):
+            thread = threading.Thread(target=_work, args=(f"{prefix}-{number}", _stop),
+                                      name=f"studygo-job-{number}", daemon=True)
+            thread.start()
+            _workers.append(thread)
+        threading.Thread(target=_maintain, args=(_stop,), name="studygo-job-maintenance", daemon=True).start()
+        metrics.register_gauges("studygo_jobs", queue_stats)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="StudyGo background jobs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    work = commands.add_parser("work", help="run job workers until interrupted")
+    work.add_argument("--workers", type=int, default=max(1, JOB_WORKERS))
+    commands.add_parser("stats", help="show queue depth and timings")
+    args = parser.parse_args(argv)
+
+    if args.command == "stats":
+        for key, value in queue_stats().items():
+            print(f"{key}: {value:.1f}" if isinstance(value, float) else f"{key}: {value}")
+        return
+
+    requeue_stale()
+    start_workers(args.workers)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        _stop.set()
+        _wakeup.set()
+
+
+if __name__ == "__main__":
+    main()
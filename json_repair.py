@@ -0,0 +1,182 @@
+# json_repair.py
+"""
+Tolerant, incremental JSON extraction for LLM output.
+
+LLM answers arrive wrapped in code fences, with trailing commas, or cut off at
+max_tokens. JSONRepairer scans the text once (chunk by chunk when streaming) and
+can at any point produce the longest valid JSON document made of the values
+that are complete so far. A document inside a ``` code block wins over
+brackets in the prose before it; without a code block the first bracket
+starts the document.
+
+    repairer = JSONRepairer()
+    for chunk in stream:
+        partial = repairer.feed(chunk).snapshot()
+"""
+import json
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+class JSONRepairer:
+    def __init__(self):
+        self._ticks = 0          # backticks in a row, outside strings
+        self._in_fence = False
+        self._fenced = False     # the document started inside a ``` block
+        self._fence_closed = False
+        self._reset()
+
+    def _reset(self):
+        self._out = []
+        self._stack = []
+        self._started = False
+        self._done = False
+        self._in_string = False
+        self._escape = False
+        self._string_is_key = False
+        self._prev = ""          # last significant character kept, outside strings
+        self._last_comma = -1    # index of that character in _out when it is a comma
+        # Longest prefix of _out that is made of complete values, and the
+        # containers still open at that point
+        self._safe_len = 0
+        self._safe_stack = []
+        self.repaired = False
+
+    def _mark_safe(self):
+        self._safe_len = len(self._out)
+        self._safe_stack = list(self._stack)
+
+    def feed(self, chunk):
+        for char in chunk:
+            if char == "`" and not self._in_string:
+                self._ticks += 1
+                if self._ticks == 3:
+                    self._ticks = 0
+                    self._toggle_fence()
+                continue
+            self._ticks = 0
+            if self._fenced and (self._done or self._fence_closed):
+                break
+            if self._in_fence and not self._fenced:
+                # The first bracket in a code block replaces whatever started in the prose before it
+                if char in _CLOSERS:
+                    self._reset()
+                    self._fenced = self._started = True
+                    self._open(char)
+                continue
+            if self._done:
+                # Keep watching for a code block after a document found in prose
+                continue
+            if not self._started:
+                if char in _CLOSERS:
+                    self._started = True
+                    self._open(char)
+                continue
+            if self._in_string:
+                self._out.append(char)
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._prev = '"'
+                    if not self._string_is_key:
+                        self._mark_safe()
+                continue
+            if char.isspace():
+                self._out.append(char)
+                continue
+            if char == '"':
+                self._in_string = True
+                self._string_is_key = self._stack[-1] == "{" and self._prev in ("{", ",")
+                self._out.append(char)
+            elif char in _CLOSERS:
+                self._open(char)
+            elif char in "}]":
+                self._close(char)
+            elif char == ",":
+                if self._prev in (",", "{", "[", ":"):
+                    # Doubled or leading comma
+                    self.repaired = True
+                    continue
+                self._mark_safe()
+                self._last_comma = len(self._out)
+                self._out.append(char)
+                self._prev = char
+            else:
+                self._out.append(char)
+                self._prev = char
+        return self
+
+    def _toggle_fence(self):
+        self._in_fence = not self._in_fence
+        if not self._in_fence and self._fenced:
+            # The block ended; a document still open in it was cut off
+            self._fence_closed = True
+
+    def _open(self, char):
+        self._stack.append(char)
+        self._out.append(char)
+        self._prev = char
+        self._mark_safe()
+
+    def _close(self, char):
+        if not self._stack:
+            return
+        if self._prev == ",":
+            # Trailing comma before a closing bracket
+            del self._out[self._last_comma]
+            self.repaired = True
+        opener = self._stack.pop()
+        self._out.append(_CLOSERS[opener])
+        if _CLOSERS[opener] != char:
+            self.repaired = True
+        self._prev = "}"
+        self._mark_safe()
+        if not self._stack:
+            self._done = True
+
+    @property
+    def complete(self):
+        """True once the root value has been closed."""
+        return self._done
+
+    def text(self):
+        """The repaired JSON text of everything complete so far ("" if nothing started)."""
+        if not self._started:
+            return ""
+        if self._done:
+            return "".join(self._out)
+        head = "".join(self._out[:self._safe_len]).rstrip()
+        if head.endswith(","):
+            head = head[:-1]
+        return head + "".join(_CLOSERS[c] for c in reversed(self._safe_stack))
+
+    def snapshot(self):
+        """Parses text(); returns None if no JSON value has started or it can't be parsed."""
+        text = self.text()
+        if not text:
+            return None
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return None
+
+
+def repair_json(text):
+    """Returns `text` as valid JSON text, keeping only complete values."""
+    return JSONRepairer().feed(text).text()
+
+
+def loads_tolerant(text):
+    """
+    json.loads for LLM output: ignores fences and surrounding prose, drops
+    trailing commas and closes truncated documents. Raises json.JSONDecodeError
+    when no JSON object or array can be recovered.
+    """
+    repairer = JSONRepairer().feed(text)
+    repaired = repairer.text()
+    if not repaired:
+        raise json.JSONDecodeError("No JSON object or array found", text, 0)
+    return json.loads(repaired)
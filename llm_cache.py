@@ -0,0 +1,153 @@
+# llm_cache.py
+"""
+Persistent cache for LLM results, stored in SQLite next to the app database.
+
+Entries live in namespaces ("chat", "timetable", "search"), expire after a
+TTL and are evicted least-recently-used once their namespace holds more than
+its quota, so a burst of chat answers can't push out cached plan analyses.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from db import DB_PATH, ConnectionPool
+import metrics
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(os.path.dirname(DB_PATH), "llm_cache.db"))
+# Seconds before a cached answer is considered stale
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+# Entries kept per namespace; LLM_CACHE_QUOTAS overrides it per namespace, e.g. "chat=5000,timetable=2000"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+LLM_CACHE_QUOTAS = os.getenv("LLM_CACHE_QUOTAS", "")
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+
+
+def normalize_query(text):
+    """Case-folds, collapses whitespace and drops trailing punctuation."""
+    return re.sub(r"\s+", " ", text).strip().rstrip("?!. ").casefold()
+
+
+def make_key(*parts):
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode()).hexdigest()
+
+
+def parse_quotas(text):
+    """{namespace: max entries} from "name=count,name=count"."""
+    quotas = {}
+    for item in text.split(","):
+        if item.strip():
+            namespace, _, count = item.partition("=")
+            quotas[namespace.strip()] = int(count)
+    return quotas
+
+
+class ResponseCache:
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES, quotas=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.quotas = parse_quotas(LLM_CACHE_QUOTAS) if quotas is None else dict(quotas)
+        self.pool = ConnectionPool(path, size=4)
+        self._lock = threading.Lock()
+        self._counters = {}
+        with self.pool.connection() as conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY(namespace, key)
+            )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_namespace_used ON llm_cache(namespace, last_used)")
+
+    def _count(self, namespace, outcome):
+        with self._lock:
+            counters = self._counters.setdefault(namespace, {"hits": 0, "misses": 0})
+            counters[outcome] += 1
+
+    def get(self, namespace, key, ttl=None):
+        """
+        Returns the cached value, or None on a miss or an expired entry.
+        `ttl` overrides the cache-wide TTL for namespaces that go stale sooner.
+        """
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row is not None and now - row[1] > ttl:
+                conn.execute("DELETE FROM llm_cache WHERE namespace = ? AND key = ?", (namespace, key))
+                row = None
+            if row is not None:
+                conn.execute(
+                    "UPDATE llm_cache SET last_used = ?, hits = hits + 1 WHERE namespace = ? AND key = ?",
+                    (now, namespace, key)
+                )
+        self._count(namespace, "hits" if row is not None else "misses")
+        return json.loads(row[0]) if row is not None else None
+
+    def set(self, namespace, key, value):
+        now = time.time()
+        with self.pool.connection() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO llm_cache (namespace, key, value, created_at, last_used)
+                VALUES (?, ?, ?, ?, ?)
+            """, (namespace, key, json.dumps(value, ensure_ascii=False), now, now))
+            # Least recently used entries beyond the namespace's quota go first;
+            # other namespaces are never evicted to make room
+            conn.execute("""
+                DELETE FROM llm_cache WHERE rowid IN (
+                    SELECT rowid FROM llm_cache WHERE namespace = ? ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (namespace, self.quotas.get(namespace, self.max_entries)))
+
+    def clear(self, namespace=None):
+        with self.pool.connection() as conn:
+            if namespace is None:
+                conn.execute("DELETE FROM llm_cache")
+            else:
+                conn.execute("DELETE FROM llm_cache WHERE namespace = ?", (namespace,))
+
+    def stats(self, namespace=None):
+        with self._lock:
+            if namespace is None:
+                hits = sum(c["hits"] for c in self._counters.values())
+                misses = sum(c["misses"] for c in self._counters.values())
+            else:
+                counters = self._counters.get(namespace, {"hits": 0, "misses": 0})
+                hits, misses = counters["hits"], counters["misses"]
+        with self.pool.connection() as conn:
+            if namespace is None:
+                entries = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            else:
+                entries = conn.execute("SELECT COUNT(*) FROM llm_cache WHERE namespace = ?", (namespace,)).fetchone()[0]
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Returns the process-wide cache, opening its database on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+                metrics.register_gauges("studygo_llm_cache", _cache.stats)
+    return _cache
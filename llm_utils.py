@@ -1,39 +1,520 @@
 #llm_utils.py
 
 import os
-from dotenv import load_dotenv
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import sys
+from env import load_env
+import metrics
 
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-from langchain_community.chat_models import AzureChatOpenAI
-from langchain_community.tools import DuckDuckGoSearchRun
+# LangChain, the Azure client, httpx and the search tool are imported on first
+# use, so pages that never call the LLM (like login) don't pay for them.
 
 # Load environment variables from .env file
-load_dotenv()
+load_env()
 
-def load_llm():
+# Environment variables that define which LLM client gets built
+LLM_CONFIG_KEYS = (
+    "LLM_PROVIDER",
+    "AZURE_OPENAI_ENDPOINT",
+    "AZURE_OPENAI_API_VERSION",
+    "AZURE_OPENAI_DEPLOYMENT_NAME",
+    "AZURE_OPENAI_API_KEY",
+    "FAKE_LLM_LATENCY",
+    "FAKE_LLM_TOKEN_DELAY",
+    "FAKE_LLM_ERROR_RATE",
+    "FAKE_LLM_ERROR_STATUS",
+)
+
+# Shared HTTP transport limits for all LLM clients
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "20"))
+LLM_HTTP_KEEPALIVE = int(os.getenv("LLM_HTTP_KEEPALIVE", "10"))
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "60"))
+
+def load_llm(temperature=0.7, max_tokens=1500, http_client=None):
     """
     Loads Azure OpenAI GPT-4o LLM from environment configuration.
+    With LLM_PROVIDER=fake, returns the local streaming stand-in from fake_llm.py.
+    Prefer get_llm(), which reuses clients across requests.
     """
+    if os.getenv("LLM_PROVIDER", "azure") == "fake":
+        from fake_llm import FakeStreamingLLM
+        return FakeStreamingLLM(
+            latency=float(os.getenv("FAKE_LLM_LATENCY", "0.2")),
+            token_delay=float(os.getenv("FAKE_LLM_TOKEN_DELAY", "0.01")),
+            error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+            error_status=int(os.getenv("FAKE_LLM_ERROR_STATUS", "429"))
+        )
+
+    from langchain_community.chat_models import AzureChatOpenAI
+
     return AzureChatOpenAI(
         azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
         openai_api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
         deployment_name=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
         api_key=os.getenv("AZURE_OPENAI_API_KEY"),
         model="gpt-4o",
-        temperature=0.7,
-        max_tokens=1500
+        temperature=temperature,
+        max_tokens=max_tokens,
+        http_client=http_client
     )
 
-def create_chain(prompt_template: PromptTemplate):
+# ---------------- Client / Chain Registry ----------------
+_registry_lock = threading.RLock()
+_registry_config = None
+_http_client = None
+_llms = {}
+_chains = {}
+# id(chain) -> registry name, used to label LLM metrics
+_chain_names = {}
+
+def _config_fingerprint():
+    return tuple(os.getenv(key) for key in LLM_CONFIG_KEYS)
+
+def _check_config():
+    """Drops every cached client and chain if the LLM environment config changed."""
+    global _registry_config
+    config = _config_fingerprint()
+    if config != _registry_config:
+        invalidate_llm_registry()
+        _registry_config = config
+
+def get_http_client():
+    """
+    Returns the process-wide pooled HTTP client shared by all LLM clients,
+    so keep-alive connections (and their TLS sessions) are reused between requests.
+    """
+    global _http_client
+    with _registry_lock:
+        if _http_client is None:
+            import httpx
+
+            _http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=LLM_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_HTTP_KEEPALIVE
+                ),
+                timeout=LLM_HTTP_TIMEOUT
+            )
+        return _http_client
+
+def get_llm(temperature=0.7, max_tokens=1500):
+    """
+    Returns the cached LLM client for this config, building it on first use.
+    """
+    key = (temperature, max_tokens)
+    with _registry_lock:
+        _check_config()
+        if key not in _llms:
+            _llms[key] = load_llm(temperature, max_tokens, http_client=get_http_client())
+        return _llms[key]
+
+def get_chain(name, prompt_factory, **llm_options):
+    """
+    Returns the chain registered under `name`, building its prompt (via
+    `prompt_factory()`) and LLMChain once per process and config.
+    """
+    key = (name, tuple(sorted(llm_options.items())))
+    with _registry_lock:
+        _check_config()
+        if key not in _chains:
+            from langchain.chains import LLMChain
+
+            _chains[key] = LLMChain(llm=get_llm(**llm_options), prompt=prompt_factory())
+            _chain_names[id(_chains[key])] = name
+        return _chains[key]
+
+def chain_name(chain):
+    return _chain_names.get(id(chain), "llm")
+
+def invalidate_llm_registry():
+    """
+    Forgets all cached clients, chains and the shared HTTP client.
+    Called automatically when the LLM environment config changes.
+    """
+    global _http_client
+    with _registry_lock:
+        _llms.clear()
+        _chains.clear()
+        _chain_names.clear()
+        client, _http_client = _http_client, None
+    if client is not None:
+        # Releases its pooled connections; a request still in flight on it fails and is retried
+        client.close()
+
+def reload_llm_config():
+    """Re-reads .env (overriding the current environment) and rebuilds clients on next use."""
+    load_env(override=True)
+    with _registry_lock:
+        _check_config()
+
+def create_chain(prompt_template):
     """
     Creates a LangChain LLMChain using GPT-4o and the provided prompt.
+    The underlying client is shared through the registry.
+    """
+    from langchain.chains import LLMChain
+
+    return LLMChain(llm=get_llm(), prompt=prompt_template)
+
+# ---------------- Executor ----------------
+# Concurrent LLM calls allowed per process; further calls wait in the queue
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# Seconds to wait for a call (or, when streaming, for the next chunk)
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "90"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+# Consecutive failures that open the circuit, and seconds before it is retried
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+
+class LLMUnavailableError(RuntimeError):
+    """Raised without calling the LLM while the circuit breaker is open."""
+
+class LLMTimeoutError(TimeoutError):
+    """Raised when an LLM call (or the next streamed chunk) takes longer than the timeout."""
+
+def error_status(exc):
+    """HTTP status of an LLM client error, if it carries one."""
+    status = getattr(exc, "status_code", None) or getattr(exc, "http_status", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status
+
+def is_retryable(exc):
+    """Rate limits, server errors, timeouts and dropped connections are worth retrying."""
+    if isinstance(exc, LLMTimeoutError):
+        return True
+    # httpx is only imported once a client exists; if it isn't loaded, this isn't one of its errors
+    httpx = sys.modules.get("httpx")
+    if httpx is not None and isinstance(exc, (httpx.TimeoutException, httpx.NetworkError)):
+        return True
+    if type(exc).__name__ in ("APIConnectionError", "APITimeoutError"):
+        return True
+    status = error_status(exc)
+    return status is not None and (status in (408, 429) or status >= 500)
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures; after `reset_after` seconds one
+    trial call is let through (half-open) and its outcome closes or re-opens it.
     """
-    llm = load_llm()
-    return LLMChain(llm=llm, prompt=prompt_template)
+
+    def __init__(self, threshold=LLM_BREAKER_THRESHOLD, reset_after=LLM_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_after:
+                self.state = "half_open"
+                return True
+            return self.state == "closed"
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    def record_client_error(self):
+        """The service answered but rejected the request: settles a trial, leaves the failure count alone."""
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "closed"
+                self._failures = 0
+
+    def release_trial(self):
+        """A trial call ended without telling anything (e.g. abandoned): let the next call try again."""
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+                self._opened_at = time.monotonic() - self.reset_after
+
+_STREAM_END = object()
+
+class LLMExecutor:
+    """
+    Process-wide gate for LLM calls: a bounded thread pool with per-call
+    timeouts, jittered exponential backoff on retryable errors and a circuit
+    breaker. The caller's thread only waits, so a stuck call can't hang a
+    session past the timeout (the worker is freed once the HTTP timeout fires).
+    """
+
+    def __init__(self, max_workers=LLM_MAX_CONCURRENCY, timeout=LLM_CALL_TIMEOUT,
+                 max_retries=LLM_MAX_RETRIES, breaker=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.breaker = breaker or CircuitBreaker()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self._lock = threading.Lock()
+        self._counts = {"queued": 0, "running": 0, "calls": 0, "retries": 0, "failures": 0,
+                        "timeouts": 0, "rejected": 0}
+
+    def _bump(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self._counts[name] += delta
+
+    def _submit(self, fn, *args):
+        self._bump(queued=1)
+
+        def run():
+            self._bump(queued=-1, running=1)
+            try:
+                return fn(*args)
+            finally:
+                self._bump(running=-1)
+
+        return self._pool.submit(run)
+
+    def _attempts(self):
+        """Yields attempt numbers, sleeping with backoff in between."""
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                self._bump(rejected=1)
+                raise LLMUnavailableError("The AI service is temporarily unavailable, please try again shortly.")
+            if attempt:
+                self._bump(retries=1)
+            yield attempt
+
+    def _release(self, future):
+        """After a timeout: True if the attempt doesn't hold a worker (cancelled before it started, or done)."""
+        if future.cancel():
+            # Never started, so its queued count won't be released by the worker
+            self._bump(queued=-1)
+            return True
+        return future.done()
+
+    def _failed(self, exc, attempt, retry=True):
+        """Records a failure; returns True if the call should be retried."""
+        self._bump(failures=1, timeouts=int(isinstance(exc, LLMTimeoutError)))
+        if not is_retryable(exc):
+            self.breaker.record_client_error()
+            return False
+        self.breaker.record_failure()
+        if retry and attempt < self.max_retries:
+            time.sleep(backoff_delay(attempt))
+            return True
+        return False
+
+    def call(self, fn, *args, timeout=None, **kwargs):
+        """Runs fn(*args, **kwargs) in the pool and returns its result."""
+        timeout = self.timeout if timeout is None else timeout
+        self._bump(calls=1)
+        for attempt in self._attempts():
+            future = self._submit(lambda: fn(*args, **kwargs))
+            try:
+                result = future.result(timeout=timeout)
+            except FutureTimeoutError:
+                exc = LLMTimeoutError(f"LLM call timed out after {timeout}s")
+                # A retry next to an attempt that is still running would hold two workers for one call
+                if not self._failed(exc, attempt, retry=self._release(future)):
+                    raise exc from None
+            except Exception as exc:
+                if not self._failed(exc, attempt):
+                    raise
+            else:
+                self.breaker.record_success()
+                return result
+
+    def stream(self, fn, *args, timeout=None, **kwargs):
+        """
+        Iterates fn(*args, **kwargs) in the pool and yields its chunks.
+        `timeout` bounds the wait for each chunk. Retries only happen before
+        the first chunk, so callers never see duplicated output.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        self._bump(calls=1)
+        for attempt in self._attempts():
+            chunks = queue.Queue()
+            cancelled = threading.Event()
+
+            def produce():
+                try:
+                    for chunk in fn(*args, **kwargs):
+                        if cancelled.is_set():
+                            return
+                        chunks.put(chunk)
+                    chunks.put(_STREAM_END)
+                except Exception as exc:
+                    chunks.put(exc)
+
+            future = self._submit(produce)
+            started = False
+            settled = False
+            stalled = False
+            try:
+                while True:
+                    try:
+                        item = chunks.get(timeout=timeout)
+                    except queue.Empty:
+                        stalled = True
+                        item = LLMTimeoutError(f"No LLM output for {timeout}s")
+                    if item is _STREAM_END:
+                        self.breaker.record_success()
+                        settled = True
+                        return
+                    if isinstance(item, Exception):
+                        raise item
+                    started = True
+                    yield item
+            except Exception as exc:
+                settled = True
+                if started or not self._failed(exc, attempt, retry=not stalled or self._release(future)):
+                    if started:
+                        self._bump(failures=1)
+                        if is_retryable(exc):
+                            self.breaker.record_failure()
+                        else:
+                            self.breaker.record_client_error()
+                    raise
+            finally:
+                cancelled.set()
+                if not settled:
+                    # Abandoned by the caller (GeneratorExit, e.g. a Streamlit rerun). Output
+                    # already arrived means the service works; otherwise free the trial slot.
+                    if started:
+                        self.breaker.record_success()
+                    else:
+                        self.breaker.release_trial()
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        counts.update({
+            "queue_depth": counts.pop("queued"),
+            "max_concurrency": self.max_workers,
+            "circuit_state": self.breaker.state,
+        })
+        return counts
+
+_executor = None
+
+def get_executor():
+    """Returns the process-wide LLM executor every caller goes through."""
+    global _executor
+    with _registry_lock:
+        if _executor is None:
+            _executor = LLMExecutor()
+            metrics.register_gauges("studygo_llm_executor", _executor.stats)
+        return _executor
+
+def record_llm_call(chain, inputs, text, seconds, outcome="ok", ttft=None):
+    """Records LLM latency and prompt/completion token counts (no-op when metrics are off)."""
+    if not metrics.METRICS_ENABLED:
+        return
+    from context import count_tokens
+
+    name = chain_name(chain)
+    try:
+        prompt_tokens = count_tokens(chain.prompt.format(**inputs))
+    except Exception:
+        prompt_tokens = 0
+    completion_tokens = count_tokens(text) if text else 0
+    metrics.observe("studygo_llm_seconds", seconds, chain=name)
+    metrics.increment("studygo_llm_calls_total", chain=name, outcome=outcome)
+    metrics.increment("studygo_llm_prompt_tokens_total", prompt_tokens, chain=name)
+    metrics.increment("studygo_llm_completion_tokens_total", completion_tokens, chain=name)
+    if ttft is not None:
+        metrics.observe("studygo_llm_ttft_seconds", ttft, chain=name)
+    metrics.log_event(
+        "llm", chain=name, outcome=outcome, duration_ms=round(seconds * 1000, 3),
+        ttft_ms=round(ttft * 1000, 3) if ttft is not None else None,
+        prompt_tokens=prompt_tokens, completion_tokens=completion_tokens
+    )
+
+def invoke_chain(chain, inputs, timeout=None):
+    """chain.invoke(inputs) through the shared executor."""
+    if not metrics.METRICS_ENABLED:
+        return get_executor().call(chain.invoke, inputs, timeout=timeout)
+    start = time.perf_counter()
+    try:
+        result = get_executor().call(chain.invoke, inputs, timeout=timeout)
+    except Exception as e:
+        record_llm_call(chain, inputs, "", time.perf_counter() - start, outcome=type(e).__name__)
+        raise
+    text = result.get("text", "") if isinstance(result, dict) else str(result)
+    record_llm_call(chain, inputs, text, time.perf_counter() - start)
+    return result
+
+# ---------------- Streaming ----------------
+def stream_chain(chain, inputs, timeout=None):
+    """
+    Yields the chain's response text chunk by chunk as the LLM produces it,
+    through the shared executor.
+    """
+    chunks = get_executor().stream(_iter_chain_text, chain, inputs, timeout=timeout)
+    if not metrics.METRICS_ENABLED:
+        return chunks
+    return _recorded_stream(chain, inputs, chunks)
+
+def _recorded_stream(chain, inputs, chunks):
+    start = time.perf_counter()
+    ttft, parts, outcome = None, [], "ok"
+    try:
+        for chunk in chunks:
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            parts.append(chunk)
+            yield chunk
+    except Exception as e:
+        outcome = type(e).__name__
+        raise
+    finally:
+        record_llm_call(chain, inputs, "".join(parts), time.perf_counter() - start, outcome, ttft)
+
+def _iter_chain_text(chain, inputs):
+    prompt = chain.prompt.format(**inputs)
+    for chunk in chain.llm.stream(prompt):
+        # Chat models yield message chunks, plain LLMs yield strings
+        text = getattr(chunk, "content", chunk)
+        if text:
+            yield text
+
+class TimedStream:
+    """
+    Wraps a chunk iterator and records time-to-first-token and total time (ms).
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.ttft_ms = None
+        self.total_ms = None
+
+    def __iter__(self):
+        start = time.perf_counter()
+        for chunk in self.chunks:
+            if self.ttft_ms is None:
+                self.ttft_ms = (time.perf_counter() - start) * 1000
+            yield chunk
+        self.total_ms = (time.perf_counter() - start) * 1000
+        if self.ttft_ms is None:
+            self.ttft_ms = self.total_ms
 
 def get_duckduckgo_tool():
     """
     Returns the DuckDuckGo search tool instance from LangChain.
     """
+    from langchain_community.tools import DuckDuckGoSearchRun
+
     return DuckDuckGoSearchRun(name="DuckDuckGo Search")
@@ -0,0 +1,295 @@
+# metrics.py
+"""
+Lightweight tracing and metrics for StudyGo.
+
+Enable with STUDYGO_METRICS=1. Spans time a block or function (DB helpers,
+bcrypt, LLM calls, rendering, whole reruns); each finished span is appended to
+a rotating JSONL log and aggregated into Prometheus histograms and counters,
+served as text on STUDYGO_METRICS_PORT when it is set.
+
+    with span("auth.bcrypt_hash"):
+        ...
+
+    @traced("db.load_chats")
+    def load_chats(user_id): ...
+
+When disabled, traced() returns the function unchanged and span() returns a
+shared no-op context manager, so instrumented code costs next to nothing.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from functools import wraps
+from logging.handlers import RotatingFileHandler
+
+from env import load_env
+
+# ---------------- Settings ----------------
+load_env()
+
+METRICS_ENABLED = os.getenv("STUDYGO_METRICS", "0") == "1"
+METRICS_LOG_PATH = os.getenv("STUDYGO_METRICS_LOG", "metrics.jsonl")
+METRICS_LOG_MAX_BYTES = int(os.getenv("STUDYGO_METRICS_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+METRICS_LOG_BACKUPS = int(os.getenv("STUDYGO_METRICS_LOG_BACKUPS", "3"))
+# Port for the Prometheus text endpoint (/metrics); unset means no server
+METRICS_PORT = os.getenv("STUDYGO_METRICS_PORT")
+METRICS_HOST = os.getenv("STUDYGO_METRICS_HOST", "127.0.0.1")
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Streamlit ends a rerun early by raising these; they are not errors
+_CONTROL_FLOW = {"StopException", "RerunException"}
+
+
+# ---------------- Registry ----------------
+class Registry:
+    """Thread-safe counters, histograms and gauge callbacks, rendered as Prometheus text."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def register_gauges(self, prefix, callback):
+        """`callback()` returns a dict; its numeric values are exported as `<prefix>_<key>`."""
+        with self._lock:
+            self._gauges[prefix] = callback
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: {"buckets": list(h["buckets"]), "sum": h["sum"], "count": h["count"]}
+                          for key, h in self._histograms.items()}
+            gauges = dict(self._gauges)
+
+        lines = []
+        for name in sorted({key[0] for key in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+        for name in sorted({key[0] for key in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(self.buckets, histogram["buckets"]):
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {count}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram['sum']:.6f}")
+                lines.append(f"{name}_count{_labels(labels)} {histogram['count']}")
+        for prefix, callback in sorted(gauges.items()):
+            try:
+                values = callback()
+            except Exception:
+                continue
+            for key, value in sorted(values.items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"# TYPE {prefix}_{key} gauge")
+                    lines.append(f"{prefix}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+registry = Registry()
+increment = registry.increment
+observe = registry.observe
+
+
+def register_gauges(prefix, callback):
+    """Exports the numeric values of `callback()` (e.g. a stats() method) as gauges."""
+    if METRICS_ENABLED:
+        registry.register_gauges(prefix, callback)
+
+
+# ---------------- JSONL log ----------------
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def _get_logger():
+    global _logger
+    if _logger is None:
+        with _logger_lock:
+            if _logger is None:
+                logger = logging.getLogger("studygo.metrics")
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                handler = RotatingFileHandler(
+                    METRICS_LOG_PATH, maxBytes=METRICS_LOG_MAX_BYTES, backupCount=METRICS_LOG_BACKUPS,
+                    encoding="utf-8"
+                )
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger.addHandler(handler)
+                _logger = logger
+    return _logger
+
+
+def log_event(event, **fields):
+    """Appends one JSON line to the metrics log."""
+    if not METRICS_ENABLED:
+        return
+    record = {"ts": round(time.time(), 3), "event": event}
+    session = getattr(_context, "session", None)
+    if session:
+        record["session"] = session
+    record.update(fields)
+    _get_logger().info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+# ---------------- Spans ----------------
+# Streamlit runs each session's script on its own thread, so the current
+# session id and rerun start are kept per thread
+_context = threading.local()
+
+
+class Span:
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.fields = {}
+        self.start = None
+
+    def set(self, **fields):
+        """Attaches extra fields to the span's log record."""
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        error = exc_type.__name__ if exc_type and exc_type.__name__ not in _CONTROL_FLOW else None
+        observe("studygo_span_seconds", seconds, span=self.name)
+        if error:
+            increment("studygo_span_errors_total", span=self.name)
+        log_event("span", name=self.name, duration_ms=round(seconds * 1000, 3),
+                  error=error, **self.labels, **self.fields)
+        return False
+
+
+class _NoopSpan:
+    def set(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name, **labels):
+    """Times the enclosed block. Returns a no-op context manager when metrics are off."""
+    if not METRICS_ENABLED:
+        return _NOOP
+    return Span(name, labels)
+
+
+def traced(name=None):
+    """Decorator version of span(); leaves the function untouched when metrics are off."""
+    def decorate(func):
+        if not METRICS_ENABLED:
+            return func
+        span_name = name or f"{func.__module__}.{func.__qualname__}"
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with Span(span_name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# ---------------- Reruns ----------------
+def begin_rerun(session_id, page=None):
+    """Marks the start of a Streamlit rerun for `session_id`."""
+    if not METRICS_ENABLED:
+        return
+    start_server()
+    _context.session = session_id
+    _context.rerun_start = time.perf_counter()
+    _context.page = page
+
+
+def end_rerun(page=None):
+    """
+    Records the duration of the rerun started by begin_rerun(). Reruns cut short
+    by st.rerun()/st.stop() are only recorded if this is called before them.
+    """
+    if not METRICS_ENABLED:
+        return
+    start = getattr(_context, "rerun_start", None)
+    if start is None:
+        return
+    _context.rerun_start = None
+    seconds = time.perf_counter() - start
+    page = page or getattr(_context, "page", None) or "unknown"
+    observe("studygo_rerun_seconds", seconds, page=page)
+    log_event("rerun", page=page, duration_ms=round(seconds * 1000, 3))
+
+
+# ---------------- Prometheus endpoint ----------------
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_server(port=METRICS_PORT):
+    """Serves registry.render() at /metrics on `port` in a daemon thread (once per process)."""
+    global _server
+    if not METRICS_ENABLED or not port or _server is not None:
+        return
+    with _server_lock:
+        if _server is not None:
+            return
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        _server = ThreadingHTTPServer((METRICS_HOST, int(port)), MetricsHandler)
+        threading.Thread(target=_server.serve_forever, name="studygo-metrics", daemon=True).start()
@@ -0,0 +1,364 @@
+# migrations.py
+"""
+Numbered schema migrations for the StudyGo SQLite database.
+
+The applied version is recorded in the schema_version table. The app applies
+pending migrations when the connection pool is first created; they can also be
+run by hand:
+
+    python migrations.py status
+    python migrations.py upgrade [--to N]
+"""
+import argparse
+import json
+import sqlite3
+from datetime import datetime
+
+
+def _create_base_tables(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id TEXT PRIMARY KEY,
+        username TEXT UNIQUE,
+        password_hash TEXT
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS chats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT,
+        title TEXT,
+        messages_json TEXT,
+        timestamp TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS timetables (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT,
+        name TEXT,
+        schedule_json TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+    """)
+
+
+def _create_chat_messages(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS chat_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        UNIQUE(chat_id, seq),
+        FOREIGN KEY(chat_id) REFERENCES chats(id) ON DELETE CASCADE
+    )
+    """)
+
+    # Move legacy chats.messages_json blobs into one row per message
+    rows = conn.execute("SELECT id, messages_json FROM chats WHERE messages_json IS NOT NULL").fetchall()
+    for chat_id, messages_json in rows:
+        messages = json.loads(messages_json)
+        conn.executemany(
+            "INSERT OR IGNORE INTO chat_messages (chat_id, seq, role, content) VALUES (?, ?, ?, ?)",
+            [(chat_id, seq, m["role"], m["content"]) for seq, m in enumerate(messages)]
+        )
+        conn.execute("UPDATE chats SET messages_json = NULL WHERE id = ?", (chat_id,))
+
+
+def _add_indexes_and_constraints(conn):
+    # Sidebar listing and keyset pagination: WHERE user_id = ? ORDER BY timestamp, id
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chats_user_timestamp ON chats(user_id, timestamp, id)")
+
+    # Keep only the newest copy of each (user_id, name) plan; INSERT OR REPLACE used
+    # to pile up duplicates because nothing made the pair unique
+    conn.execute("""
+        DELETE FROM timetables WHERE id NOT IN (
+            SELECT MAX(id) FROM timetables GROUP BY user_id, name
+        )
+    """)
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_timetables_user_name ON timetables(user_id, name)")
+
+
+def _create_search_index(conn):
+    # FTS5 tables keep their own copy of the text (needed for snippet()); the
+    # rowid is the chat_messages.id / chats.id they index. `owner` holds one
+    # token per user ('u' + user id without dashes) so a search only walks that
+    # user's postings instead of filtering every user's matches afterwards.
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts
+        USING fts5(owner, content, tokenize = 'unicode61 remove_diacritics 2')
+    """)
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS chats_fts
+        USING fts5(owner, title, tokenize = 'unicode61 remove_diacritics 2')
+    """)
+
+    # Triggers also fire for rows removed by ON DELETE CASCADE
+    triggers = [
+        """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_insert AFTER INSERT ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts (rowid, owner, content)
+            SELECT new.id, 'u' || replace(user_id, '-', ''), new.content FROM chats WHERE id = new.chat_id;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_delete AFTER DELETE ON chat_messages BEGIN
+            DELETE FROM chat_messages_fts WHERE rowid = old.id;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS chats_fts_insert AFTER INSERT ON chats BEGIN
+            INSERT INTO chats_fts (rowid, owner, title)
+            VALUES (new.id, 'u' || replace(new.user_id, '-', ''), COALESCE(new.title, ''));
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS chats_fts_update AFTER UPDATE OF title ON chats BEGIN
+            UPDATE chats_fts SET title = COALESCE(new.title, '') WHERE rowid = new.id;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS chats_fts_delete AFTER DELETE ON chats BEGIN
+            DELETE FROM chats_fts WHERE rowid = old.id;
+        END""",
+    ]
+    # Not executescript(): it would commit the migration's transaction
+    for trigger in triggers:
+        conn.execute(trigger)
+
+    conn.execute("DELETE FROM chat_messages_fts")
+    conn.execute("""
+        INSERT INTO chat_messages_fts (rowid, owner, content)
+        SELECT m.id, 'u' || replace(c.user_id, '-', ''), m.content
+        FROM chat_messages m JOIN chats c ON c.id = m.chat_id
+    """)
+    conn.execute("DELETE FROM chats_fts")
+    conn.execute("""
+        INSERT INTO chats_fts (rowid, owner, title)
+        SELECT id, 'u' || replace(user_id, '-', ''), COALESCE(title, '') FROM chats
+    """)
+
+
+def _create_sessions(conn):
+    # Only a SHA-256 of each token is stored; the token itself lives in a browser cookie (see auth.py)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sessions (
+        token_hash TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        expires_at REAL NOT NULL,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id)")
+
+
+def _add_storage_codecs(conn):
+    # NULL codec = plain text, so existing rows load unchanged (see compression.py)
+    conn.execute("ALTER TABLE chat_messages ADD COLUMN codec TEXT")
+    conn.execute("ALTER TABLE timetables ADD COLUMN codec TEXT")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS compression_dicts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        codec TEXT NOT NULL,
+        data BLOB NOT NULL,
+        created_at REAL NOT NULL
+    )
+    """)
+    # Stored content may now be compressed; utils.py indexes the plain text itself
+    conn.execute("DROP TRIGGER IF EXISTS chat_messages_fts_insert")
+
+
+def _create_jobs(conn):
+    # Background work queue, see jobs.py. Guests' jobs have no user_id and are
+    # found through the browser session instead.
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        user_id TEXT,
+        session_id TEXT,
+        payload_json TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        progress_json TEXT,
+        result_json TEXT,
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        worker TEXT,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        heartbeat_at REAL,
+        finished_at REAL,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs(user_id, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_session ON jobs(session_id, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs(finished_at)")
+
+
+def _decode_payload(conn, value, codec):
+    from compression import decode  # compression imports db, which imports this module
+
+    # Dictionaries are read through this connection: the pool isn't up yet
+    return decode(value, codec, conn)
+
+
+def register_functions(conn):
+    """SQL functions the schema relies on; every connection to the database needs them."""
+    # studygo_text(content, codec): stored payload back to plain text, for the search index
+    conn.create_function("studygo_text", 2, lambda value, codec: _decode_payload(conn, value, codec),
+                         deterministic=True)
+
+
+def _add_timetable_summaries(conn):
+    # The saved-plans list reads only these columns; schedule_json is loaded per plan on demand.
+    # Plans saved before this migration keep a NULL created_at.
+    from scheduler import schedule_summary
+
+    for column, kind in (("day_count", "INTEGER"), ("total_hours", "REAL"),
+                         ("topic_count", "INTEGER"), ("created_at", "REAL")):
+        conn.execute(f"ALTER TABLE timetables ADD COLUMN {column} {kind}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_timetables_user_id ON timetables(user_id, id)")
+
+    after = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, schedule_json, codec FROM timetables WHERE id > ? ORDER BY id LIMIT 500", (after,)
+        ).fetchall()
+        if not rows:
+            break
+        conn.executemany(
+            "UPDATE timetables SET day_count = ?, total_hours = ?, topic_count = ? WHERE id = ?",
+            [(*schedule_summary(json.loads(_decode_payload(conn, value, codec))), plan_id)
+             for plan_id, value, codec in rows]
+        )
+        after = rows[-1][0]
+
+
+def _add_job_retry_delay(conn):
+    # A retried job is not claimed again before not_before (NULL: right away), see jobs._retry
+    conn.execute("ALTER TABLE jobs ADD COLUMN not_before REAL")
+
+
+def _index_messages_from_storage(conn):
+    # The message index kept a plain copy of every message next to the compressed
+    # row. It now reads the text through a view that decodes chat_messages
+    # (external content), so the index stores only its postings. FTS5 removes an
+    # external-content row by the values it indexed, so deletes are replayed
+    # before the rows go; in an ON DELETE CASCADE the chat is already gone when
+    # its messages' triggers run, so the chats trigger covers those. Replaying a
+    # delete for a row that was never indexed corrupts the index, hence the
+    # _docsize checks (one row per indexed message).
+    conn.execute("DROP TRIGGER IF EXISTS chat_messages_fts_delete")
+    conn.execute("DROP TABLE IF EXISTS chat_messages_fts")
+    conn.execute("""
+        CREATE VIEW IF NOT EXISTS chat_messages_text AS
+        SELECT m.id AS id, 'u' || replace(c.user_id, '-', '') AS owner, studygo_text(m.content, m.codec) AS content
+        FROM chat_messages m JOIN chats c ON c.id = m.chat_id
+    """)
+    conn.execute("""
+        CREATE VIRTUAL TABLE chat_messages_fts
+        USING fts5(owner, content, content = 'chat_messages_text', content_rowid = 'id',
+                   tokenize = 'unicode61 remove_diacritics 2')
+    """)
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS chat_messages_fts_delete BEFORE DELETE ON chat_messages
+        WHEN EXISTS (SELECT 1 FROM chats WHERE id = old.chat_id)
+         AND EXISTS (SELECT 1 FROM chat_messages_fts_docsize WHERE id = old.id) BEGIN
+            INSERT INTO chat_messages_fts (chat_messages_fts, rowid, owner, content)
+            SELECT 'delete', old.id, 'u' || replace(user_id, '-', ''), studygo_text(old.content, old.codec)
+            FROM chats WHERE id = old.chat_id;
+        END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS chats_messages_fts_delete BEFORE DELETE ON chats BEGIN
+            INSERT INTO chat_messages_fts (chat_messages_fts, rowid, owner, content)
+            SELECT 'delete', m.id, 'u' || replace(old.user_id, '-', ''), studygo_text(m.content, m.codec)
+            FROM chat_messages m
+            WHERE m.chat_id = old.id AND EXISTS (SELECT 1 FROM chat_messages_fts_docsize WHERE id = m.id);
+        END""")
+    conn.execute("INSERT INTO chat_messages_fts (chat_messages_fts) VALUES ('rebuild')")
+
+
+# (version, description, function) — append only, never renumber
+MIGRATIONS = [
+    (1, "base users/chats/timetables tables", _create_base_tables),
+    (2, "per-message chat_messages table", _create_chat_messages),
+    (3, "indexes on user_id/timestamp, unique timetable names", _add_indexes_and_constraints),
+    (4, "FTS5 search index over chat titles and messages", _create_search_index),
+    (5, "persistent login sessions", _create_sessions),
+    (6, "per-row storage codecs for messages and timetables", _add_storage_codecs),
+    (7, "background job queue", _create_jobs),
+    (8, "timetable summary columns for the saved-plans list", _add_timetable_summaries),
+    (9, "retry delay for background jobs", _add_job_retry_delay),
+    (10, "message search index reads the stored messages", _index_messages_from_storage),
+]
+
+
+def _ensure_version_table(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TEXT
+    )
+    """)
+
+
+def current_version(conn):
+    _ensure_version_table(conn)
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def pending_migrations(conn, target=None):
+    version = current_version(conn)
+    return [m for m in MIGRATIONS if m[0] > version and (target is None or m[0] <= target)]
+
+
+def migrate(conn, target=None):
+    """
+    Applies pending migrations in order, each in its own transaction.
+    Returns the list of applied version numbers.
+    """
+    applied = []
+    for version, description, apply in pending_migrations(conn, target):
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have applied it while we waited for the lock
+            if current_version(conn) >= version:
+                conn.rollback()
+                continue
+            apply(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.now().isoformat())
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+def main(argv=None):
+    from db import DB_PATH
+
+    parser = argparse.ArgumentParser(description="StudyGo database migrations")
+    parser.add_argument("command", choices=["status", "upgrade"], nargs="?", default="status")
+    parser.add_argument("--db", default=DB_PATH, help="database file (default: %(default)s)")
+    parser.add_argument("--to", type=int, default=None, help="stop at this version")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    conn.execute("PRAGMA foreign_keys = 1")
+    register_functions(conn)
+    try:
+        if args.command == "upgrade":
+            applied = migrate(conn, args.to)
+            print(f"Applied migrations: {applied}" if applied else "Nothing to apply.")
+        version = current_version(conn)
+        print(f"Schema version: {version} (latest {MIGRATIONS[-1][0]})")
+        for number, description, _ in pending_migrations(conn, args.to):
+            print(f"  pending {number}: {description}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
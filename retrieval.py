@@ -0,0 +1,231 @@
+# retrieval.py
+"""
+Per-user BM25 index over a user's saved chats and timetables.
+
+Saved conversations are cut into short passages and saved plans into one
+passage per day. The chat prompt gets the best-scoring few within a token
+budget, so answers can build on earlier roadmaps without pasting them in.
+
+Indexes live in memory, one per user, built from the database on the user's
+first question and kept for the RETRIEVAL_MAX_USERS most recent users. The
+save/delete helpers in utils.py update a loaded index in place; other
+processes rebuild theirs once it is older than RETRIEVAL_MAX_AGE.
+"""
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from heapq import nlargest
+
+from compression import decode
+from context import count_tokens
+from db import get_db
+from metrics import span
+
+# ---------------- Settings ----------------
+# Default of the chat sidebar "Use my past chats and plans" toggle
+CHAT_RETRIEVAL = os.getenv("CHAT_RETRIEVAL", "1") == "1"
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+# Token budget for past-work passages in the prompt
+RETRIEVAL_CONTEXT_TOKENS = int(os.getenv("RETRIEVAL_CONTEXT_TOKENS", "300"))
+# Words per chat passage
+RETRIEVAL_PASSAGE_WORDS = int(os.getenv("RETRIEVAL_PASSAGE_WORDS", "60"))
+# Users whose index stays in memory, and seconds before an index is rebuilt
+RETRIEVAL_MAX_USERS = int(os.getenv("RETRIEVAL_MAX_USERS", "64"))
+RETRIEVAL_MAX_AGE = int(os.getenv("RETRIEVAL_MAX_AGE", "900"))
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def _terms(text):
+    return re.findall(r"\w+", text.casefold())
+
+
+# ---------------- Index ----------------
+class BM25Index:
+    """
+    Okapi BM25 over passages grouped by source ("chat:<id>", "timetable:<name>"),
+    with postings updated incrementally as sources are added or removed.
+    """
+
+    def __init__(self):
+        self.passages = {}   # passage id -> (source, text, length)
+        self.postings = {}   # term -> {passage id: term frequency}
+        self.sources = {}    # source -> [passage ids]
+        self.total_length = 0
+        self.built_at = time.time()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def add(self, source, texts):
+        """Appends passages to `source`."""
+        with self._lock:
+            for text in texts:
+                counts = Counter(_terms(text))
+                if not counts:
+                    continue
+                pid = self._next_id
+                self._next_id += 1
+                length = sum(counts.values())
+                self.passages[pid] = (source, text, length)
+                self.sources.setdefault(source, []).append(pid)
+                self.total_length += length
+                for term, tf in counts.items():
+                    self.postings.setdefault(term, {})[pid] = tf
+
+    def remove(self, source):
+        with self._lock:
+            for pid in self.sources.pop(source, ()):
+                _, text, length = self.passages.pop(pid)
+                self.total_length -= length
+                for term in set(_terms(text)):
+                    postings = self.postings.get(term)
+                    if postings is not None:
+                        postings.pop(pid, None)
+                        if not postings:
+                            del self.postings[term]
+
+    def replace(self, source, texts):
+        self.remove(source)
+        self.add(source, texts)
+
+    def search(self, query, k=RETRIEVAL_TOP_K, exclude=()):
+        """Returns up to k (score, source, text) tuples, best first."""
+        with self._lock:
+            count = len(self.passages)
+            if not count:
+                return []
+            average = self.total_length / count
+            scores = {}
+            for term in set(_terms(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for pid, tf in postings.items():
+                    length = self.passages[pid][2]
+                    norm = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / average))
+                    scores[pid] = scores.get(pid, 0.0) + idf * norm
+            if exclude:
+                scores = {pid: score for pid, score in scores.items() if self.passages[pid][0] not in exclude}
+            best = nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(score, *self.passages[pid][:2]) for pid, score in best]
+
+
+# ---------------- Passages ----------------
+def chat_passages(title, messages, size=RETRIEVAL_PASSAGE_WORDS):
+    """Cuts messages into passages of at most `size` words, each labelled with the chat title."""
+    passages = []
+    for message in messages:
+        words = message["content"].split()
+        speaker = "You" if message["role"] == "user" else "StudyGo"
+        for start in range(0, len(words), size):
+            passages.append(f'Chat "{title}", {speaker}: {" ".join(words[start:start + size])}')
+    return passages
+
+
+def timetable_passages(name, schedule):
+    """One passage per day of a saved "Day N" schedule."""
+    passages = []
+    for day, tasks in schedule.items():
+        topics = ", ".join(f"{task['topic']} ({task['hours']}h)" for task in tasks)
+        passages.append(f'Plan "{name}", {day}: {topics}')
+    return passages
+
+
+# ---------------- Per-user indexes ----------------
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _build(user_id):
+    index = BM25Index()
+    with get_db() as conn:
+        chats = conn.execute("SELECT id, title FROM chats WHERE user_id = ?", (user_id,)).fetchall()
+        rows = conn.execute("""
+            SELECT m.chat_id, m.role, m.content, m.codec
+            FROM chat_messages m JOIN chats c ON c.id = m.chat_id
+            WHERE c.user_id = ? ORDER BY m.chat_id, m.seq
+        """, (user_id,)).fetchall()
+        timetables = conn.execute(
+            "SELECT name, schedule_json, codec FROM timetables WHERE user_id = ?", (user_id,)
+        ).fetchall()
+    messages = {}
+    for chat_id, role, content, codec in rows:
+        messages.setdefault(chat_id, []).append({"role": role, "content": decode(content, codec)})
+    for chat_id, title in chats:
+        index.add(f"chat:{chat_id}", chat_passages(title, messages.get(chat_id, [])))
+    for name, schedule_json, codec in timetables:
+        index.add(f"timetable:{name}", timetable_passages(name, json.loads(decode(schedule_json, codec))))
+    return index
+
+
+def get_index(user_id):
+    """The user's index, built from the database on first use or once it is stale."""
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+        if index is not None and time.time() - index.built_at < RETRIEVAL_MAX_AGE:
+            _indexes.move_to_end(user_id)
+            return index
+    with span("retrieval.build"):
+        index = _build(user_id)
+    with _indexes_lock:
+        _indexes[user_id] = index
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > max(1, RETRIEVAL_MAX_USERS):
+            _indexes.popitem(last=False)
+    return index
+
+
+def _loaded(user_id):
+    with _indexes_lock:
+        return _indexes.get(user_id)
+
+
+def index_chat(user_id, chat_id, title, messages):
+    """Adds messages of a chat to the user's index if it is loaded (otherwise it is built later)."""
+    index = _loaded(user_id)
+    if index is not None:
+        index.add(f"chat:{chat_id}", chat_passages(title, messages))
+
+
+def index_timetable(user_id, name, schedule):
+    index = _loaded(user_id)
+    if index is not None:
+        index.replace(f"timetable:{name}", timetable_passages(name, schedule))
+
+
+def forget_chat(user_id, chat_id):
+    index = _loaded(user_id)
+    if index is not None:
+        index.remove(f"chat:{chat_id}")
+
+
+def drop_user(user_id):
+    with _indexes_lock:
+        _indexes.pop(user_id, None)
+
+
+# ---------------- Retrieval ----------------
+def retrieve_past_work(user_id, query, k=RETRIEVAL_TOP_K, budget=RETRIEVAL_CONTEXT_TOKENS, exclude_chat=None):
+    """
+    Returns (context, stats): the user's most relevant passages as one "- "
+    bulleted string within `budget` tokens, skipping the chat `exclude_chat`
+    (the one being continued, whose history is already in the prompt).
+    """
+    start = time.perf_counter()
+    with span("retrieval.search"):
+        exclude = (f"chat:{exclude_chat}",) if exclude_chat is not None else ()
+        hits = get_index(user_id).search(query, k, exclude)
+        kept, used = [], 0
+        for _, _, text in hits:
+            tokens = count_tokens(text) + 1
+            if used + tokens > budget:
+                continue
+            kept.append(text)
+            used += tokens
+    stats = {"passages": len(kept), "tokens": used, "elapsed_ms": (time.perf_counter() - start) * 1000}
+    return "\n".join(f"- {text}" for text in kept), stats
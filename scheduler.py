@@ -0,0 +1,131 @@
+# scheduler.py
+"""
+Deterministic study-plan packing.
+
+The LLM only estimates topics (difficulty and hours); this module turns that
+estimate into the "Day N" schedule for any number of days and daily hours, so
+re-planning never needs another LLM call.
+"""
+import math
+
+DIFFICULTY_RANK = {"easy": 0, "medium": 1, "hard": 2}
+# Smallest block of study time that gets scheduled
+SLOT_HOURS = 0.5
+# Days are filled to at least this many hours (or daily_hours if lower) before work is spread out
+MIN_DAY_HOURS = 2.0
+
+
+def _round_slots(hours, up=False):
+    slots = hours / SLOT_HOURS
+    slots = math.ceil(slots - 1e-9) if up else math.floor(slots + 1e-9)
+    return slots * SLOT_HOURS
+
+
+def _display_hours(hours):
+    return int(hours) if float(hours).is_integer() else hours
+
+
+def schedule_summary(schedule):
+    """(day count, total hours, distinct topic count) of a "Day N" schedule."""
+    total_hours = sum(task["hours"] for tasks in schedule.values() for task in tasks)
+    topics = {task["topic"] for tasks in schedule.values() for task in tasks}
+    return len(schedule), _display_hours(total_hours), len(topics)
+
+
+def normalize_topics(topics):
+    """Drops malformed entries and coerces difficulty/hours into known values."""
+    normalized = []
+    for item in topics or []:
+        if not isinstance(item, dict) or not str(item.get("topic", "")).strip():
+            continue
+        try:
+            hours = float(item.get("hours", 0))
+        except (TypeError, ValueError):
+            continue
+        if hours <= 0:
+            continue
+        difficulty = str(item.get("difficulty", "medium")).strip().lower()
+        normalized.append({
+            "topic": str(item["topic"]).strip(),
+            "difficulty": difficulty if difficulty in DIFFICULTY_RANK else "medium",
+            "hours": max(SLOT_HOURS, _round_slots(hours, up=True)),
+        })
+    return normalized
+
+
+def plan_schedule(topics, total_days, daily_hours, tips=None):
+    """
+    Packs topics into at most `total_days` days of at most `daily_hours` each.
+
+    Topics are ordered easy -> medium -> hard (keeping the given order within a
+    difficulty) and split across days when they don't fit. Work is spread over
+    the days, with at least MIN_DAY_HOURS per day. If the estimate exceeds
+    the available time, every topic is shrunk proportionally and `warning` is
+    set. Returns the structure timetable_page() renders:
+    schedule, warning, minimum_needed, tips, plus notes about spillover.
+    """
+    total_days = max(1, int(total_days))
+    daily_hours = max(SLOT_HOURS, float(daily_hours))
+    ordered = sorted(normalize_topics(topics), key=lambda t: DIFFICULTY_RANK[t["difficulty"]])
+
+    needed = sum(t["hours"] for t in ordered)
+    capacity = _round_slots(total_days * daily_hours)
+    warning = needed > capacity
+    minimum_needed = {
+        "days": max(1, math.ceil(needed / daily_hours - 1e-9)),
+        "daily_hours": min(24, max(1, math.ceil(needed / total_days - 1e-9))),
+    }
+    notes = []
+
+    if warning:
+        scale = capacity / needed
+        exact = [topic["hours"] * scale for topic in ordered]
+        for topic, hours in zip(ordered, exact):
+            topic["hours"] = max(SLOT_HOURS, _round_slots(hours))
+        # Hand the slots lost to rounding down back to the largest remainders
+        spare = int(round((capacity - sum(t["hours"] for t in ordered)) / SLOT_HOURS))
+        by_remainder = sorted(range(len(ordered)), key=lambda i: exact[i] - ordered[i]["hours"], reverse=True)
+        for i in by_remainder[:max(0, spare)]:
+            ordered[i]["hours"] += SLOT_HOURS
+        notes.append(
+            f"Estimated {_display_hours(needed)} hours of study but only {_display_hours(capacity)} are available; "
+            "time per topic was reduced proportionally."
+        )
+
+    # Spread the work evenly instead of cramming it into the first days, but
+    # never into study sessions shorter than MIN_DAY_HOURS: a light plan over
+    # many days ends early instead of becoming weeks of half-hour days
+    planned = sum(t["hours"] for t in ordered)
+    day_cap = min(daily_hours, max(MIN_DAY_HOURS, _round_slots(planned / total_days, up=True)))
+
+    schedule = {}
+    day, remaining = 1, day_cap
+    unscheduled = []
+    for topic in ordered:
+        left = topic["hours"]
+        first_day = day
+        while left > 1e-9:
+            if day > total_days:
+                unscheduled.append(topic["topic"])
+                break
+            chunk = min(left, remaining)
+            schedule.setdefault(f"Day {day}", []).append({"topic": topic["topic"], "hours": _display_hours(chunk)})
+            left -= chunk
+            remaining -= chunk
+            if remaining <= 1e-9:
+                day, remaining = day + 1, day_cap
+        last_day = day if remaining < day_cap else day - 1
+        if topic["topic"] not in unscheduled and last_day > first_day:
+            notes.append(f"'{topic['topic']}' spills over from Day {first_day} to Day {last_day}.")
+
+    if unscheduled:
+        warning = True
+        notes.append("Not enough time to schedule: " + ", ".join(unscheduled) + ".")
+
+    return {
+        "schedule": schedule,
+        "warning": warning,
+        "minimum_needed": minimum_needed,
+        "tips": list(tips or []),
+        "notes": notes,
+    }
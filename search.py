@@ -0,0 +1,210 @@
+# search.py
+"""
+Optional web-search retrieval for the chat prompt.
+
+A question is turned into a few search queries that run in parallel. Their
+snippets are deduplicated, trimmed to a token budget and handed to the prompt.
+Results are cached per backend and normalized query in the response cache
+("search" namespace), so popular topics skip the network.
+
+Backends are pluggable: "duckduckgo" (the LangChain tool from llm_utils) and
+"local", an in-process corpus with configurable latency for tests and
+benchmarks. Register more with register_backend().
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from context import count_tokens
+from llm_cache import LLM_CACHE_ENABLED, get_response_cache, make_key, normalize_query
+import metrics
+from metrics import span
+
+# ---------------- Settings ----------------
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "duckduckgo")
+# Searches run per question, and threads shared by all sessions
+SEARCH_MAX_QUERIES = int(os.getenv("SEARCH_MAX_QUERIES", "3"))
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", "4"))
+# Seconds to wait for all searches of one question; slower ones are dropped
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "6"))
+# Token budget for the snippets added to the prompt
+SEARCH_CONTEXT_TOKENS = int(os.getenv("SEARCH_CONTEXT_TOKENS", "400"))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", str(6 * 3600)))
+# Local stand-in backend: corpus file (one document per line, or JSONL with "text") and delay per search
+SEARCH_CORPUS_PATH = os.getenv("SEARCH_CORPUS_PATH")
+SEARCH_LOCAL_LATENCY = float(os.getenv("SEARCH_LOCAL_LATENCY", "0.05"))
+
+CACHE_NAMESPACE = "search"
+
+
+# ---------------- Backends ----------------
+class DuckDuckGoBackend:
+    name = "duckduckgo"
+
+    def __init__(self):
+        from llm_utils import get_duckduckgo_tool
+
+        self.tool = get_duckduckgo_tool()
+
+    def search(self, query):
+        """Returns a list of snippet strings."""
+        return [self.tool.run(query)]
+
+
+class LocalCorpusBackend:
+    """Ranks documents of an in-memory corpus by word overlap, after `latency` seconds."""
+
+    name = "local"
+
+    def __init__(self, documents=None, latency=SEARCH_LOCAL_LATENCY, limit=5):
+        if documents is None:
+            documents = load_corpus(SEARCH_CORPUS_PATH) if SEARCH_CORPUS_PATH else []
+        self.documents = [(doc, set(_words(doc))) for doc in documents]
+        self.latency = latency
+        self.limit = limit
+
+    def search(self, query):
+        if self.latency:
+            time.sleep(self.latency)
+        words = set(_words(query))
+        scored = sorted(
+            ((len(words & doc_words), doc) for doc, doc_words in self.documents if words & doc_words),
+            key=lambda item: item[0], reverse=True
+        )
+        return [doc for _, doc in scored[:self.limit]]
+
+
+def load_corpus(path):
+    documents = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                documents.append(json.loads(line)["text"] if line.startswith("{") else line)
+    return documents
+
+
+BACKENDS = {
+    "duckduckgo": DuckDuckGoBackend,
+    "local": LocalCorpusBackend,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def register_backend(name, factory):
+    """Makes `factory()` (returning an object with .name and .search(query)) selectable as SEARCH_BACKEND."""
+    with _backends_lock:
+        BACKENDS[name] = factory
+        _backends.pop(name, None)
+
+
+def get_backend(name=None):
+    name = name or SEARCH_BACKEND
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = BACKENDS[name]()
+        return _backends[name]
+
+
+# ---------------- Retrieval ----------------
+_pool = ThreadPoolExecutor(max_workers=max(1, SEARCH_WORKERS), thread_name_prefix="search")
+
+
+def _words(text):
+    return re.findall(r"\w+", text.casefold())
+
+
+def build_queries(question, limit=SEARCH_MAX_QUERIES):
+    """A few variations of the question that tend to surface study material."""
+    question = re.sub(r"\s+", " ", question).strip().rstrip("?!.")
+    candidates = [question, f"{question} explained", f"{question} study guide"]
+    return candidates[:max(1, limit)]
+
+
+def _cached_search(backend, query):
+    """Returns (snippets, cache_hit)."""
+    key = make_key(backend.name, normalize_query(query))
+    if LLM_CACHE_ENABLED:
+        try:
+            cached = get_response_cache().get(CACHE_NAMESPACE, key, ttl=SEARCH_CACHE_TTL)
+            if cached is not None:
+                return cached, True
+        except sqlite3.Error:
+            pass
+    snippets = backend.search(query)
+    if LLM_CACHE_ENABLED:
+        try:
+            get_response_cache().set(CACHE_NAMESPACE, key, snippets)
+        except sqlite3.Error:
+            pass
+    return snippets, False
+
+
+def split_snippets(texts):
+    """Splits result texts into sentences, dropping duplicates (case and whitespace insensitive)."""
+    seen, sentences = set(), []
+    for text in texts:
+        for sentence in re.split(r"(?<=[.!?])\s+|\s*\.\.\.\s*|\n+", text or ""):
+            sentence = re.sub(r"\s+", " ", sentence).strip()
+            key = " ".join(_words(sentence))
+            if len(key) < 20 or key in seen:
+                continue
+            seen.add(key)
+            sentences.append(sentence)
+    return sentences
+
+
+def trim_to_budget(sentences, budget=SEARCH_CONTEXT_TOKENS):
+    kept, used = [], 0
+    for sentence in sentences:
+        tokens = count_tokens(sentence) + 1
+        if used + tokens > budget:
+            break
+        kept.append(sentence)
+        used += tokens
+    return kept
+
+
+def retrieve_context(question, backend=None, timeout=SEARCH_TIMEOUT):
+    """
+    Searches for `question` and returns (context, stats): the snippets as one
+    "- " bulleted string ("" if nothing was found) and query/cache/timing counts.
+    Search failures and timeouts only shrink the context, they never raise.
+    """
+    backend = backend or get_backend()
+    queries = build_queries(question)
+    start = time.perf_counter()
+    with span("search.retrieve", backend=backend.name, queries=len(queries)):
+        futures = [_pool.submit(_cached_search, backend, query) for query in queries]
+        done, _ = wait(futures, timeout=timeout)
+
+        # Keep the queries' order so the plain question's results come first
+        results, cache_hits, failures = [], 0, 0
+        for future in futures:
+            if future not in done or future.exception() is not None:
+                failures += 1
+                continue
+            snippets, hit = future.result()
+            results.extend(snippets)
+            cache_hits += hit
+        sentences = trim_to_budget(split_snippets(results))
+
+    stats = {
+        "queries": len(queries),
+        "cache_hits": cache_hits,
+        "failures": failures,
+        "snippets": len(sentences),
+        "elapsed_ms": (time.perf_counter() - start) * 1000,
+    }
+    if metrics.METRICS_ENABLED:
+        metrics.observe("studygo_search_seconds", stats["elapsed_ms"] / 1000, backend=backend.name)
+        metrics.increment("studygo_search_queries_total", len(queries), backend=backend.name)
+        metrics.increment("studygo_search_cache_hits_total", cache_hits, backend=backend.name)
+        metrics.increment("studygo_search_failures_total", failures, backend=backend.name)
+    return "\n".join(f"- {sentence}" for sentence in sentences), stats
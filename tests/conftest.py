@@ -0,0 +1,19 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def app_db(tmp_path, monkeypatch):
+    """Points the app's connection pool at a fresh, migrated database under tmp_path."""
+    import db
+
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "test.db"))
+    monkeypatch.setattr(db, "_pool", None)
+    yield db.get_pool()
+    db._pool.close()
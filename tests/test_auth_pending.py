@@ -0,0 +1,25 @@
+# tests/test_auth_pending.py
+import threading
+
+import pytest
+
+import auth
+
+
+def test_timed_out_hash_keeps_its_slot_until_it_finishes(monkeypatch):
+    monkeypatch.setattr(auth, "_pending", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(auth, "AUTH_TIMEOUT", 0.05)
+    release = threading.Event()
+
+    with pytest.raises(auth.AuthBusyError, match="too long"):
+        auth._run_bcrypt("test", release.wait, 5)
+    # The first hash is still running, so a second one is refused
+    with pytest.raises(auth.AuthBusyError, match="busy"):
+        auth._run_bcrypt("test", lambda: None)
+
+    release.set()
+    for _ in range(100):
+        if auth._pending.acquire(timeout=0.05):
+            auth._pending.release()
+            break
+    assert auth._run_bcrypt("test", lambda: "ok") == "ok"
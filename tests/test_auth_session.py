@@ -0,0 +1,54 @@
+# tests/test_auth_session.py
+import os
+
+import pytest
+
+testing = pytest.importorskip("streamlit.testing.v1")
+
+APP = """
+import os
+import streamlit as st
+import auth
+
+# st.context.cookies can't be set from AppTest
+auth._cookie_token = lambda: os.environ.get("TEST_SESSION_COOKIE")
+auth.restore_session()
+st.write(f"user={st.session_state.get('username')}")
+if st.button("log out"):
+    auth.logout()
+    st.rerun()
+"""
+
+
+@pytest.fixture
+def app(tmp_path, app_db):
+    script = tmp_path / "app.py"
+    script.write_text(APP)
+    return str(script)
+
+
+def test_cookie_restores_login_and_logout_revokes_it(app, monkeypatch):
+    import auth
+
+    user_id = auth.create_user("ann", "secret password")
+    monkeypatch.setenv("TEST_SESSION_COOKIE", auth.create_session(user_id))
+
+    at = testing.AppTest.from_file(app).run()
+    assert not at.exception
+    assert at.markdown[0].value == "user=ann"
+    assert "session" not in at.query_params
+
+    at.button[0].click().run()
+    assert at.markdown[0].value == "user=None"
+    assert auth.resolve_session(os.environ["TEST_SESSION_COOKIE"]) is None
+
+
+def test_url_token_is_removed_from_the_url(app):
+    import auth
+
+    token = auth.create_session(auth.create_user("bob", "secret password"))
+    at = testing.AppTest.from_file(app)
+    at.query_params["session"] = token
+    at.run()
+    assert at.markdown[0].value == "user=bob"
+    assert "session" not in at.query_params
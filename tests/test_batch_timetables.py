@@ -0,0 +1,69 @@
+# tests/test_batch_timetables.py
+import pytest
+
+import batch_timetables
+import db
+from batch_timetables import Checkpoint, parse_row, run_batch
+from utils import load_timetables
+
+
+def analysis(topic):
+    return {"topics": [{"topic": topic, "difficulty": "medium", "hours": 4}], "tips": []}
+
+
+@pytest.fixture
+def cohort(app_db):
+    with db.get_db() as conn:
+        for name in ("ann", "bob"):
+            conn.execute("INSERT INTO users (id, username, password_hash) VALUES (?, ?, 'hash')", (f"id-{name}", name))
+    records = [{"user": user, "topics": topics, "days": 2, "hours": 2, "name": f"{topics} {user}"}
+               for topics in ("Physics", "Chemistry") for user in ("ann", "bob")]
+    return [parse_row(number, record) for number, record in enumerate(records, 2)]
+
+
+def test_interrupted_run_resumes_from_its_checkpoint(cohort, tmp_path, monkeypatch):
+    calls = []
+
+    def interrupted(topics, use_cache):
+        calls.append(topics)
+        if topics == "Chemistry":
+            raise KeyboardInterrupt
+        return analysis(topics)
+
+    monkeypatch.setattr(batch_timetables, "analyze_topics", interrupted)
+    path = str(tmp_path / "cohort.checkpoint")
+    with pytest.raises(KeyboardInterrupt):
+        run_batch(cohort, Checkpoint(path), workers=1, write_size=100)
+    # The plans finished before the interruption were written and checkpointed
+    assert set(load_timetables("id-ann")) == {"Physics ann"}
+    assert len(Checkpoint(path).done) == 2
+
+    calls.clear()
+    monkeypatch.setattr(batch_timetables, "analyze_topics", lambda topics, use_cache: calls.append(topics) or analysis(topics))
+    report = run_batch(cohort, Checkpoint(path), workers=1, write_size=1)
+    assert (report["skipped"], report["saved"], report["failed"]) == (2, 2, 0)
+    # Each topic list is analyzed once for all users asking for it
+    assert calls == ["Chemistry"]
+    assert set(load_timetables("id-bob")) == {"Physics bob", "Chemistry bob"}
+
+
+def test_failed_rows_are_retried_on_the_next_run(cohort, tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_timetables, "analyze_topics",
+                        lambda topics, use_cache: None if topics == "Chemistry" else analysis(topics))
+    messages = []
+    checkpoint = Checkpoint(str(tmp_path / "cohort.checkpoint"))
+    report = run_batch(cohort + [parse_row(9, {"user": "nobody", "topics": "Math"})], checkpoint, log=messages.append)
+    assert (report["saved"], report["failed"]) == (2, 3)
+    assert "line 9: unknown user 'nobody'" in messages
+
+    monkeypatch.setattr(batch_timetables, "analyze_topics", lambda topics, use_cache: analysis(topics))
+    report = run_batch(cohort, checkpoint)
+    assert (report["skipped"], report["saved"]) == (2, 2)
+
+
+def test_edited_rows_do_not_match_old_checkpoint_entries():
+    row = parse_row(2, {"user": "ann", "topics": "Physics", "days": 3})
+    assert parse_row(2, {"user": "ann", "topics": " physics ", "days": "3"})["id"] == row["id"]
+    assert parse_row(2, {"user": "ann", "topics": "Physics", "days": 4})["id"] != row["id"]
+    with pytest.raises(ValueError):
+        parse_row(3, {"user": "ann", "topics": "Physics", "hours": 30})
@@ -0,0 +1,22 @@
+# tests/test_benchmarks.py
+from benchmarks.run_benchmarks import CALIBRATION, compare
+
+
+def results(calibration, **medians):
+    return {CALIBRATION: {"median_ms": calibration}, **{name: {"median_ms": ms} for name, ms in medians.items()}}
+
+
+def test_slower_host_is_not_a_regression():
+    baseline = results(0.3, load_chats=2.0, save_chat=0.4)
+    assert compare(results(0.6, load_chats=4.2, save_chat=0.85), baseline, 0.25) == []
+
+
+def test_regression_is_measured_against_the_scaled_baseline():
+    baseline = results(0.3, load_chats=2.0)
+    assert compare(results(0.15, load_chats=2.0), baseline, 0.25, noise_ms=0.2) == [("load_chats", 1.0, 2.0)]
+
+
+def test_sub_millisecond_jitter_is_ignored():
+    baseline = results(0.3, extract_json=0.03)
+    assert compare(results(0.3, extract_json=0.09), baseline, 0.25, noise_ms=0.2) == []
+    assert compare(results(0.3, extract_json=0.09), baseline, 0.25, noise_ms=0.01) != []
@@ -0,0 +1,50 @@
+# tests/test_chat_render.py
+import pytest
+
+pytest.importorskip("markdown")
+chat = pytest.importorskip("chat")
+
+
+def test_markdown_is_rendered():
+    body = chat.format_message_html("assistant", "**Week 1**\n\n- Arrays\n- Loops")
+    assert "<strong>Week 1</strong>" in body
+    assert "<li>Arrays</li>" in body
+
+
+def test_raw_html_is_shown_as_text():
+    body = chat.format_message_html("assistant", "<script>alert(1)</script> <img src=x onerror=alert(1)>")
+    assert "<script>" not in body and "<img" not in body
+    assert "&lt;script&gt;" in body
+
+
+def test_unsafe_link_urls_are_dropped():
+    body = chat.format_message_html("assistant", "[a](javascript:alert(1)) [b](https://example.com)")
+    assert "javascript:" not in body
+    assert 'href="https://example.com"' in body
+
+
+def test_bubble_is_one_line_with_code_blocks():
+    # A blank line would end Streamlit's HTML block and the rest would be parsed as Markdown
+    body = chat.format_message_html("assistant", "```python\nif a < b:\n\n    print(a)\n```")
+    assert "\n" not in body
+    assert "a &lt; b" in body
+
+
+class FakeChain:
+    class prompt:
+        template = "{history} {past_work} {search_context} {query}"
+
+
+def test_repeated_question_with_saved_work_hits_the_cache(tmp_path):
+    from llm_cache import ResponseCache
+
+    cache = ResponseCache(path=str(tmp_path / "cache.db"))
+    first = {"history": "", "past_work": "Chat 'Python': Learn Python basics", "search_context": "",
+             "query": "How do I learn Python?"}
+    cache.set("chat", chat.chat_cache_key(FakeChain, first, 1), "answer")
+
+    # Asked again in a new chat: the earlier chat is now among the retrieved passages
+    again = dict(first, query="how do i learn python", past_work="Chat 'How do I learn Python?': answer")
+    assert cache.get("chat", chat.chat_cache_key(FakeChain, again, 1)) == "answer"
+    assert cache.get("chat", chat.chat_cache_key(FakeChain, again, 2)) is None
+    assert cache.get("chat", chat.chat_cache_key(FakeChain, dict(again, history="User: hi"), 1)) is None
@@ -0,0 +1,55 @@
+# tests/test_chat_storage.py
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+from utils import append_chat_message, count_chats, create_chat, list_chats, load_chat, save_chat
+
+
+def add_user(user_id):
+    with db.get_db() as conn:
+        conn.execute("INSERT INTO users (id, username, password_hash) VALUES (?, ?, 'hash')", (user_id, user_id))
+
+
+def test_pages_walk_every_chat_once_newest_first(app_db):
+    add_user("u-1")
+    # Several chats share a timestamp, so the id breaks the tie
+    ids = [save_chat("u-1", f"Chat {i}", [{"role": "user", "content": "hi"}] * (i % 3), f"2024-01-0{i // 3 + 1}")
+           for i in range(7)]
+
+    seen, before = [], None
+    while True:
+        page = list_chats("u-1", limit=3, before=before)
+        if not page:
+            break
+        seen.extend(page)
+        before = (page[-1]["timestamp"], page[-1]["id"])
+
+    assert [chat["id"] for chat in seen] == ids[::-1]
+    assert [chat["message_count"] for chat in seen] == [i % 3 for i in range(7)][::-1]
+    assert count_chats("u-1") == 7
+
+
+def test_messages_load_only_for_the_owner(app_db):
+    add_user("u-1")
+    add_user("u-2")
+    chat_id = save_chat("u-1", "Mine", [{"role": "user", "content": "hi"}], "2024-01-01")
+    assert list_chats("u-2") == []
+    assert load_chat("u-2", chat_id) is None
+    assert load_chat("u-1", chat_id) == [{"role": "user", "content": "hi"}]
+
+
+def test_appended_turns_keep_their_order(app_db):
+    add_user("u-1")
+    chat_id = create_chat("u-1", "Revision", "2024-01-01")
+    turns = [("user" if i % 2 == 0 else "assistant", f"turn {i}") for i in range(6)]
+    assert [append_chat_message(chat_id, role, content) for role, content in turns] == list(range(6))
+    assert load_chat("u-1", chat_id) == [{"role": role, "content": content} for role, content in turns]
+
+
+def test_concurrent_appends_get_distinct_seq(app_db):
+    add_user("u-1")
+    chat_id = create_chat("u-1", "Busy", "2024-01-01")
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        seqs = list(pool.map(lambda i: append_chat_message(chat_id, "user", f"message {i}"), range(20)))
+    assert sorted(seqs) == list(range(20))
+    assert len(load_chat("u-1", chat_id)) == 20
@@ -0,0 +1,41 @@
+# tests/test_compression.py
+import pytest
+
+import compression
+
+TEXT = "Week 1: limits, derivatives and the chain rule. Ünïcödé stays intact. " * 20
+
+
+@pytest.mark.parametrize("codec", ["zlib", "zstd", "none"])
+def test_round_trip(codec, app_db):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+    value, stored_codec = compression.encode(TEXT, codec)
+    assert compression.decode(value, stored_codec) == TEXT
+    if codec == "none":
+        assert (value, stored_codec) == (TEXT, None)
+    else:
+        assert stored_codec == codec and len(value) < len(TEXT.encode())
+
+
+def test_small_payloads_stay_plain():
+    assert compression.encode("short", "zlib") == ("short", None)
+
+
+def test_zstd_dictionary_round_trip(app_db, monkeypatch):
+    pytest.importorskip("zstandard")
+    from utils import load_chat, save_chat
+
+    with app_db.connection() as conn:
+        conn.execute("INSERT INTO users (id, username) VALUES ('u-1', 'ann')")
+    for number in range(50):
+        save_chat("u-1", f"Chat {number}", [{"role": "user", "content": f"{number} {TEXT}"}], "2024-01-01")
+    monkeypatch.setattr(compression, "_active_dict_id", compression._UNSET)
+    dict_id = compression.train_dictionary(size=4096)
+
+    value, codec = compression.encode(TEXT, "zstd")
+    assert codec == f"zstd:{dict_id}"
+    compression._dicts.clear()
+    assert compression.decode(value, codec) == TEXT
+    compression.recompress("zstd", dict_id)
+    assert load_chat("u-1", 1) == [{"role": "user", "content": f"0 {TEXT}"}]
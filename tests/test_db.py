@@ -0,0 +1,65 @@
+# tests/test_db.py
+import threading
+
+import pytest
+
+from db import ConnectionPool, PoolTimeoutError
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), size=2, timeout=0.05)
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE notes (body TEXT)")
+    yield pool
+    pool.close()
+
+
+def test_connections_are_reused(pool):
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    stats = pool.stats()
+    assert stats["open_connections"] == 1 and stats["checkouts"] == 3
+    assert first.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_nested_checkout_shares_the_transaction(pool):
+    with pytest.raises(RuntimeError):
+        with pool.connection() as outer:
+            with pool.connection() as inner:
+                assert inner is outer
+                inner.execute("INSERT INTO notes VALUES ('draft')")
+            raise RuntimeError("roll back")
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0] == 0
+
+
+def test_checkout_times_out_when_the_pool_is_exhausted(pool):
+    held = threading.Event()
+    done = threading.Event()
+
+    def hold():
+        with pool.connection():
+            held.set()
+            done.wait(5)
+
+    threads = [threading.Thread(target=hold) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+        held.wait(5)
+        held.clear()
+    try:
+        with pytest.raises(PoolTimeoutError):
+            with pool.connection():
+                pass
+    finally:
+        done.set()
+        for thread in threads:
+            thread.join()
+    assert pool.stats()["checkout_timeouts"] == 1
+    # Returned connections serve the next caller
+    with pool.connection() as conn:
+        assert conn.execute("SELECT 1").fetchone() == (1,)
+    assert pool.stats()["open_connections"] == 2
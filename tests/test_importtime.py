@@ -0,0 +1,23 @@
+# tests/test_importtime.py
+import pytest
+
+from benchmarks import check_importtime
+
+
+@pytest.fixture(scope="module")
+def startup():
+    try:
+        return check_importtime.check()
+    except RuntimeError as e:
+        # A dependency of the startup modules isn't installed here
+        pytest.skip(f"startup modules can't be imported: {e}")
+
+
+def test_startup_imports_no_heavy_modules(startup):
+    _, _, loaded = startup
+    assert not loaded, "imported at startup: " + ", ".join(loaded)
+
+
+def test_startup_import_time_within_budget(startup):
+    _, total_ms, _ = startup
+    assert total_ms <= check_importtime.IMPORT_BUDGET_MS
@@ -0,0 +1,127 @@
+# tests/test_jobs.py
+import threading
+import time
+
+import db
+import jobs
+
+
+def test_maintenance_logs_errors_and_keeps_running(monkeypatch):
+    calls, events = [], []
+
+    def broken_heartbeat(job_ids):
+        calls.append(job_ids)
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(jobs, "JOB_STALE_AFTER", 0.04)
+    monkeypatch.setattr(jobs, "_heartbeat", broken_heartbeat)
+    monkeypatch.setattr(jobs.metrics, "log_event", lambda event, **fields: events.append((event, fields)))
+    stop = threading.Event()
+    thread = threading.Thread(target=jobs._maintain, args=(stop,))
+    thread.start()
+    try:
+        for _ in range(100):
+            if len(calls) >= 2:
+                break
+            stop.wait(0.01)
+    finally:
+        stop.set()
+        thread.join()
+    assert len(calls) >= 2
+    assert events[0] == ("jobs.maintenance_error", {"error": "RuntimeError: database is locked"})
+
+
+def test_claim_takes_the_oldest_due_job_once(app_db, monkeypatch):
+    monkeypatch.setitem(jobs.HANDLERS, "echo", lambda job, progress: job["payload"])
+    first = jobs.submit_job("echo", {"n": 1}, session_id="s")
+    second = jobs.submit_job("echo", {"n": 2}, session_id="s")
+
+    claimed = [jobs.claim_job("w1"), jobs.claim_job("w2"), jobs.claim_job("w3")]
+    assert [job and job["id"] for job in claimed] == [first, second, None]
+    assert claimed[0]["status"] == "running" and claimed[0]["attempts"] == 1
+
+    jobs.run_job(claimed[0])
+    job = jobs.get_job(first)
+    assert job["status"] == "done" and job["result"] == {"n": 1}
+
+
+def test_concurrent_workers_never_share_a_job(app_db, monkeypatch):
+    monkeypatch.setitem(jobs.HANDLERS, "echo", lambda job, progress: None)
+    submitted = {jobs.submit_job("echo", {}) for _ in range(20)}
+    claimed, lock = [], threading.Lock()
+
+    def worker(name):
+        while (job := jobs.claim_job(name)) is not None:
+            with lock:
+                claimed.append(job["id"])
+
+    threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(submitted)
+
+
+def test_failed_job_waits_before_its_retry(app_db, monkeypatch):
+    def flaky(job, progress):
+        if job["attempts"] < 2:
+            raise ConnectionError("upstream down")
+        return "ok"
+
+    monkeypatch.setitem(jobs.HANDLERS, "flaky", flaky)
+    monkeypatch.setattr(jobs, "JOB_RETRY_BACKOFF", 60)
+    job_id = jobs.submit_job("flaky", {})
+    jobs.run_job(jobs.claim_job("w"))
+
+    job = jobs.get_job(job_id)
+    assert job["status"] == "queued" and job["error"] == "ConnectionError: upstream down"
+    assert job["not_before"] - time.time() > 30
+    assert jobs.claim_job("w") is None
+
+    with db.get_db() as conn:
+        conn.execute("UPDATE jobs SET not_before = ? WHERE id = ?", (time.time(), job_id))
+    jobs.run_job(jobs.claim_job("w"))
+    assert jobs.get_job(job_id)["status"] == "done"
+
+
+def test_job_errors_fail_without_retry(app_db, monkeypatch):
+    def invalid(job, progress):
+        raise jobs.JobError("No topics given.")
+
+    monkeypatch.setitem(jobs.HANDLERS, "invalid", invalid)
+    job_id = jobs.submit_job("invalid", {})
+    jobs.run_job(jobs.claim_job("w"))
+    job = jobs.get_job(job_id)
+    assert (job["status"], job["error"], job["attempts"]) == ("failed", "No topics given.", 1)
+
+
+def test_stale_jobs_are_requeued_then_failed(app_db, monkeypatch):
+    monkeypatch.setitem(jobs.HANDLERS, "echo", lambda job, progress: None)
+    monkeypatch.setattr(jobs, "JOB_RETRY_BACKOFF", 0)
+    job_id = jobs.submit_job("echo", {})
+
+    for attempt in range(1, jobs.JOB_MAX_ATTEMPTS + 1):
+        assert jobs.claim_job("dead-worker")["attempts"] == attempt
+        with db.get_db() as conn:
+            conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time() - 600, job_id))
+        requeued = jobs.requeue_stale(stale_after=120)
+        assert requeued == (1 if attempt < jobs.JOB_MAX_ATTEMPTS else 0)
+
+    job = jobs.get_job(job_id)
+    assert (job["status"], job["error"]) == ("failed", "The worker stopped responding.")
+    # A live heartbeat keeps a running job where it is
+    live = jobs.submit_job("echo", {})
+    jobs.claim_job("w")
+    assert jobs.requeue_stale(stale_after=120) == 0 and jobs.get_job(live)["status"] == "running"
+
+
+def test_finished_jobs_are_pruned_after_retention(app_db, monkeypatch):
+    monkeypatch.setitem(jobs.HANDLERS, "echo", lambda job, progress: None)
+    old = jobs.submit_job("echo", {})
+    jobs.run_job(jobs.claim_job("w"))
+    queued = jobs.submit_job("echo", {})
+    with db.get_db() as conn:
+        conn.execute("UPDATE jobs SET finished_at = ? WHERE id = ?", (time.time() - 3600, old))
+    assert jobs.prune_jobs(retention=60) == 1
+    assert jobs.get_job(old) is None and jobs.get_job(queued)["status"] == "queued"
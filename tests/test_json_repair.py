@@ -0,0 +1,47 @@
+# tests/test_json_repair.py
+import json
+
+import pytest
+
+from json_repair import JSONRepairer, loads_tolerant
+
+PLAN = '{"topics": [{"topic": "Intro", "difficulty": "easy", "hours": 2}], "tips": ["Rest"]}'
+
+
+def feed_in_chunks(text, size):
+    repairer = JSONRepairer()
+    for start in range(0, len(text), size):
+        repairer.feed(text[start:start + size])
+    return repairer
+
+
+@pytest.mark.parametrize("size", [1, 3, 1000])
+def test_code_block_wins_over_brackets_in_prose(size):
+    repairer = feed_in_chunks(f"Here [is] the plan: ```json\n{PLAN}\n```", size)
+    assert repairer.snapshot() == json.loads(PLAN)
+    assert repairer.complete
+
+
+def test_code_block_replaces_unclosed_bracket_in_prose():
+    assert loads_tolerant(f"Plan (see [1: ```json\n{PLAN}\n``` done") == json.loads(PLAN)
+
+
+def test_first_bracket_without_code_block():
+    assert loads_tolerant(f"Sure! {PLAN} Good luck.") == json.loads(PLAN)
+
+
+def test_backticks_inside_strings_are_kept():
+    text = '```json\n{"tips": ["Wrap code in ``` fences"], "n": 1}\n```'
+    assert loads_tolerant(text) == {"tips": ["Wrap code in ``` fences"], "n": 1}
+
+
+def test_truncated_code_block_keeps_complete_values():
+    repairer = JSONRepairer().feed('```json\n{"topics": [{"topic": "A", "hours": 1}, \n```\nmore [text]')
+    assert repairer.snapshot() == {"topics": [{"topic": "A", "hours": 1}]}
+    assert not repairer.complete
+
+
+def test_trailing_comma_is_repaired():
+    repairer = JSONRepairer().feed('```json\n{"a": [1, 2,], }\n```')
+    assert repairer.snapshot() == {"a": [1, 2]}
+    assert repairer.repaired
@@ -0,0 +1,133 @@
+# tests/test_llm_breaker.py
+import threading
+import time
+
+import pytest
+
+import llm_utils
+from llm_utils import CircuitBreaker, LLMExecutor, LLMTimeoutError
+
+
+class ClientError(Exception):
+    status_code = 400
+
+
+class ServerError(Exception):
+    status_code = 503
+
+
+def fail(exc):
+    raise exc
+
+
+def open_breaker():
+    """An executor whose breaker was opened by a server error and is due for a half-open trial."""
+    executor = LLMExecutor(max_workers=2, timeout=5, max_retries=0,
+                           breaker=CircuitBreaker(threshold=1, reset_after=0.05))
+    with pytest.raises(ServerError):
+        executor.call(fail, ServerError())
+    assert executor.breaker.state == "open"
+    time.sleep(0.06)
+    return executor
+
+
+def test_client_error_during_trial_closes_breaker():
+    executor = open_breaker()
+    with pytest.raises(ClientError):
+        executor.call(fail, ClientError())
+    assert executor.breaker.state == "closed"
+    assert executor.call(lambda: "ok") == "ok"
+
+
+def test_server_error_during_trial_reopens_breaker():
+    executor = open_breaker()
+    with pytest.raises(ServerError):
+        executor.call(fail, ServerError())
+    assert executor.breaker.state == "open"
+
+
+def test_client_error_during_streamed_trial_closes_breaker():
+    executor = open_breaker()
+
+    def chunks():
+        raise ClientError()
+        yield
+
+    with pytest.raises(ClientError):
+        list(executor.stream(chunks))
+    assert executor.breaker.state == "closed"
+
+
+def test_abandoned_stream_settles_trial():
+    executor = open_breaker()
+    stream = executor.stream(lambda: iter(["a", "b", "c"]))
+    assert next(stream) == "a"
+    stream.close()
+    assert executor.breaker.state == "closed"
+
+
+def test_released_trial_allows_next_call():
+    breaker = CircuitBreaker(threshold=1, reset_after=60)
+    breaker.record_failure()
+    breaker._opened_at -= 60
+    assert breaker.allow() and breaker.state == "half_open"
+    assert not breaker.allow()
+    breaker.release_trial()
+    assert breaker.allow()
+
+
+def test_client_errors_do_not_reset_failures():
+    executor = LLMExecutor(max_workers=2, timeout=5, max_retries=0,
+                           breaker=CircuitBreaker(threshold=2, reset_after=60))
+    with pytest.raises(ServerError):
+        executor.call(fail, ServerError())
+    with pytest.raises(ClientError):
+        executor.call(fail, ClientError())
+    with pytest.raises(ServerError):
+        executor.call(fail, ServerError())
+    assert executor.breaker.state == "open"
+
+
+def test_timed_out_call_is_not_retried_while_running():
+    executor = LLMExecutor(max_workers=2, timeout=0.05, max_retries=3)
+    release = threading.Event()
+    started = []
+
+    def slow():
+        started.append(1)
+        release.wait(5)
+
+    with pytest.raises(LLMTimeoutError):
+        executor.call(slow)
+    assert len(started) == 1
+    assert executor.stats()["retries"] == 0
+    release.set()
+
+
+def test_timed_out_stream_is_not_retried_while_running():
+    executor = LLMExecutor(max_workers=2, timeout=0.05, max_retries=3)
+    release = threading.Event()
+    started = []
+
+    def slow():
+        started.append(1)
+        release.wait(5)
+        yield "late"
+
+    with pytest.raises(LLMTimeoutError):
+        list(executor.stream(slow))
+    assert len(started) == 1
+    release.set()
+
+
+def test_invalidating_the_registry_closes_the_http_client(monkeypatch):
+    closed = []
+
+    class Client:
+        def close(self):
+            closed.append(self)
+
+    client = Client()
+    monkeypatch.setattr(llm_utils, "_http_client", client)
+    llm_utils.invalidate_llm_registry()
+    assert closed == [client] and llm_utils._http_client is None
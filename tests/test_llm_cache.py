@@ -0,0 +1,28 @@
+# tests/test_llm_cache.py
+from llm_cache import ResponseCache, parse_quotas
+
+
+def test_chat_answers_do_not_evict_cached_plans(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.db"), max_entries=3)
+    cache.set("timetable", "plan", {"topics": []})
+    for number in range(10):
+        cache.set("chat", f"question {number}", "answer")
+    assert cache.get("timetable", "plan") == {"topics": []}
+    assert cache.stats("chat")["entries"] == 3
+    # The oldest answers went first
+    assert cache.get("chat", "question 0") is None
+    assert cache.get("chat", "question 9") == "answer"
+
+
+def test_quotas_override_the_bound_per_namespace(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.db"), max_entries=5, quotas={"chat": 2})
+    for number in range(4):
+        cache.set("chat", str(number), number)
+        cache.set("search", str(number), number)
+    assert cache.stats("chat")["entries"] == 2
+    assert cache.stats("search")["entries"] == 4
+
+
+def test_parse_quotas():
+    assert parse_quotas(" chat=2000, timetable=10000 ,") == {"chat": 2000, "timetable": 10000}
+    assert parse_quotas("") == {}
@@ -0,0 +1,64 @@
+# tests/test_migrations.py
+import json
+import sqlite3
+
+import db
+from migrations import MIGRATIONS, current_version, migrate, register_functions
+from utils import list_chats, list_timetables, load_chat, load_timetables, search_chats
+
+
+def plan(hours):
+    return {"Day 1": [{"topic": "Limits", "hours": hours}]}
+
+
+def make_legacy_db(path):
+    """A database as the app created it before migrations: no version table, messages as one JSON blob."""
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE users (id TEXT PRIMARY KEY, username TEXT UNIQUE, password_hash TEXT)")
+    conn.execute("""CREATE TABLE chats (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, title TEXT,
+                    messages_json TEXT, timestamp TEXT, FOREIGN KEY(user_id) REFERENCES users(id))""")
+    conn.execute("""CREATE TABLE timetables (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, name TEXT,
+                    schedule_json TEXT, FOREIGN KEY(user_id) REFERENCES users(id))""")
+    conn.execute("INSERT INTO users VALUES ('u-1', 'ann', 'hash')")
+    messages = [{"role": "user", "content": "Plan my calculus exam"},
+                {"role": "assistant", "content": "Start with limits"}]
+    conn.execute("INSERT INTO chats (user_id, title, messages_json, timestamp) VALUES ('u-1', 'Calculus', ?, '2024-01-01')",
+                 (json.dumps(messages),))
+    # INSERT OR REPLACE without a unique index left duplicate plan names behind
+    for hours in (1, 2):
+        conn.execute("INSERT INTO timetables (user_id, name, schedule_json) VALUES ('u-1', 'Exam', ?)",
+                     (json.dumps(plan(hours)),))
+    conn.commit()
+    conn.close()
+    return messages
+
+
+def test_legacy_database_is_upgraded_on_first_use(tmp_path, monkeypatch):
+    path = str(tmp_path / "legacy.db")
+    messages = make_legacy_db(path)
+    monkeypatch.setattr(db, "DB_PATH", path)
+    monkeypatch.setattr(db, "_pool", None)
+
+    chats = list_chats("u-1")
+    assert [chat["title"] for chat in chats] == ["Calculus"]
+    assert load_chat("u-1", chats[0]["id"]) == messages
+    results, _ = search_chats("u-1", "limits")
+    assert [result["title"] for result in results] == ["Calculus"]
+    # Only the newest duplicate survives, with its summary columns filled in
+    assert load_timetables("u-1") == {"Exam": plan(2)}
+    assert [(plan["name"], plan["total_hours"]) for plan in list_timetables("u-1")] == [("Exam", 2)]
+    with db.get_db() as conn:
+        assert current_version(conn) == MIGRATIONS[-1][0]
+        assert conn.execute("SELECT messages_json FROM chats").fetchone() == (None,)
+    db._pool.close()
+
+
+def test_migrate_is_idempotent_and_stops_at_target(tmp_path):
+    make_legacy_db(tmp_path / "legacy.db")
+    conn = sqlite3.connect(tmp_path / "legacy.db")
+    register_functions(conn)
+    assert migrate(conn, target=3) == [1, 2, 3]
+    assert current_version(conn) == 3
+    assert migrate(conn) == [version for version, _, _ in MIGRATIONS[3:]]
+    assert migrate(conn) == []
+    conn.close()
@@ -0,0 +1,62 @@
+# tests/test_retrieval.py
+from collections import OrderedDict
+
+import pytest
+
+import db
+import retrieval
+from retrieval import BM25Index
+from utils import delete_chat, save_chat, save_timetable
+
+
+@pytest.fixture
+def indexes(app_db, monkeypatch):
+    # Indexes loaded by other tests belong to other databases
+    monkeypatch.setattr(retrieval, "_indexes", OrderedDict())
+    for user_id in ("u-1", "u-2"):
+        with db.get_db() as conn:
+            conn.execute("INSERT INTO users (id, username, password_hash) VALUES (?, ?, 'hash')", (user_id, user_id))
+
+
+def test_rarer_terms_and_shorter_passages_score_higher():
+    index = BM25Index()
+    index.add("chat:1", ["python basics and python loops"])
+    index.add("chat:2", ["python decorators explained"])
+    index.add("chat:3", ["python " + "filler " * 50 + "decorators"])
+
+    assert [source for _, source, _ in index.search("python decorators")] == ["chat:2", "chat:3", "chat:1"]
+    assert index.search("decorators", exclude=("chat:2",))[0][1] == "chat:3"
+    assert index.search("haskell") == []
+
+
+def test_removed_sources_leave_no_postings():
+    index = BM25Index()
+    index.add("chat:1", ["linear algebra"])
+    index.replace("chat:1", ["matrices"])
+    index.remove("chat:1")
+    assert index.search("matrices") == [] and index.postings == {} and index.total_length == 0
+
+
+def test_past_work_follows_saves_and_deletes(indexes):
+    save_timetable("u-1", "Finals", {"Day 1": [{"topic": "Eigenvalues", "hours": 2}]})
+    kept = save_chat("u-1", "Linear algebra", [{"role": "user", "content": "Explain eigenvalues simply"}], "2024-01-01")
+    save_chat("u-2", "Other", [{"role": "user", "content": "eigenvalues for bob"}], "2024-01-01")
+
+    context, stats = retrieval.retrieve_past_work("u-1", "eigenvalues")
+    assert stats["passages"] == 2
+    assert 'Plan "Finals", Day 1: Eigenvalues (2h)' in context and "bob" not in context
+
+    # The loaded index is updated in place, without a rebuild
+    gone = save_chat("u-1", "Spectral", [{"role": "user", "content": "eigenvalues of graphs"}], "2024-01-02")
+    assert "graphs" in retrieval.retrieve_past_work("u-1", "eigenvalues")[0]
+    delete_chat("u-1", gone)
+    context, _ = retrieval.retrieve_past_work("u-1", "eigenvalues", exclude_chat=kept)
+    assert context == '- Plan "Finals", Day 1: Eigenvalues (2h)'
+
+
+def test_context_stays_within_the_token_budget(indexes):
+    for number in range(10):
+        save_chat("u-1", f"Chat {number}", [{"role": "user", "content": f"calculus revision week {number}"}], "2024-01-01")
+    context, stats = retrieval.retrieve_past_work("u-1", "calculus", k=10, budget=30)
+    assert 0 < stats["passages"] < 10 and stats["tokens"] <= 30
+    assert len(context.splitlines()) == stats["passages"]
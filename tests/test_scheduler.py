@@ -0,0 +1,28 @@
+# tests/test_scheduler.py
+from scheduler import MIN_DAY_HOURS, plan_schedule
+
+
+def topics(*hours):
+    return [{"topic": f"Topic {i}", "difficulty": "medium", "hours": h} for i, h in enumerate(hours)]
+
+
+def day_totals(plan):
+    return [sum(task["hours"] for task in tasks) for tasks in plan["schedule"].values()]
+
+
+def test_light_plan_fills_days_to_the_minimum_block():
+    plan = plan_schedule(topics(2, 1.5, 3, 2.5, 2.5), total_days=30, daily_hours=8)
+    totals = day_totals(plan)
+    assert sum(totals) == 11.5
+    assert all(total == MIN_DAY_HOURS for total in totals[:-1])
+    assert len(totals) == 6
+    assert not plan["warning"]
+
+
+def test_heavy_plan_is_spread_evenly():
+    assert day_totals(plan_schedule(topics(2, 1.5, 3, 2.5, 2.5), total_days=3, daily_hours=8)) == [4, 4, 3.5]
+
+
+def test_minimum_block_never_exceeds_daily_hours():
+    totals = day_totals(plan_schedule(topics(3, 3), total_days=30, daily_hours=1))
+    assert totals == [1] * 6
@@ -0,0 +1,130 @@
+# tests/test_search_index.py
+import sqlite3
+
+import compression
+import db
+from migrations import migrate, register_functions
+from utils import append_chat_message, delete_chat, save_chat, search_chats
+
+LONG = "Spaced repetition of derivatives and integrals every evening. " * 10
+
+
+def add_user(user_id):
+    with db.get_db() as conn:
+        conn.execute("INSERT INTO users (id, username, password_hash) VALUES (?, ?, 'hash')", (user_id, user_id))
+
+
+def titles(user_id, query):
+    results, _ = search_chats(user_id, query, marker=("[", "]"))
+    return [result["title"] for result in results]
+
+
+def check_index():
+    with db.get_db() as conn:
+        # rank 1 also compares the index against the text it reads from chat_messages
+        conn.execute("INSERT INTO chat_messages_fts (chat_messages_fts, rank) VALUES ('integrity-check', 1)")
+
+
+def test_saved_and_appended_messages_are_found(app_db):
+    add_user("u-1")
+    add_user("u-2")
+    chat_id = save_chat("u-1", "Calculus", [{"role": "user", "content": LONG}], "2024-01-01")
+    save_chat("u-2", "Other", [{"role": "user", "content": LONG}], "2024-01-01")
+    append_chat_message(chat_id, "assistant", "Try flashcards for limits")
+
+    assert titles("u-1", "integrals") == ["Calculus"]
+    assert titles("u-1", "flashcards") == ["Calculus"]
+    results, _ = search_chats("u-1", "integrals", marker=("[", "]"))
+    # The long message is stored compressed; the snippet comes from its decoded text
+    assert "[integrals]" in results[0]["snippet"]
+    check_index()
+
+
+def test_deleted_chats_and_messages_leave_the_index(app_db):
+    add_user("u-1")
+    kept = save_chat("u-1", "Kept", [{"role": "user", "content": "limits"}], "2024-01-01")
+    gone = save_chat("u-1", "Gone", [{"role": "user", "content": LONG}], "2024-01-02")
+    append_chat_message(kept, "assistant", LONG)
+
+    delete_chat("u-1", gone)
+    assert titles("u-1", "integrals") == ["Kept"]
+    with db.get_db() as conn:
+        conn.execute("DELETE FROM chat_messages WHERE chat_id = ? AND seq = 1", (kept,))
+    assert titles("u-1", "integrals") == []
+    assert titles("u-1", "limits") == ["Kept"]
+    check_index()
+
+
+def test_index_keeps_no_copy_of_the_text(app_db):
+    add_user("u-1")
+    for number in range(20):
+        save_chat("u-1", f"Chat {number}", [{"role": "user", "content": LONG}], "2024-01-01")
+
+    indexes = compression.report()["search_index"]
+    assert 0 < indexes["chat_messages_fts"] < len(LONG) * 20 / 2
+    with db.get_db() as conn:
+        assert conn.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE name = 'chat_messages_fts_content'"
+        ).fetchone()[0] == 0
+
+
+def test_upgrade_indexes_existing_messages(tmp_path):
+    conn = sqlite3.connect(tmp_path / "old.db")
+    conn.execute("PRAGMA foreign_keys = 1")
+    register_functions(conn)
+    migrate(conn, target=9)
+    conn.execute("INSERT INTO users (id, username) VALUES ('u-1', 'ann')")
+    conn.execute("INSERT INTO chats (id, user_id, title, timestamp) VALUES (1, 'u-1', 'Old', '2024-01-01')")
+    value, codec = compression.encode(LONG, "zlib")
+    conn.execute("INSERT INTO chat_messages (chat_id, seq, role, content, codec) VALUES (1, 0, 'user', ?, ?)",
+                 (value, codec))
+    conn.execute("INSERT INTO chat_messages_fts (rowid, owner, content) VALUES (1, 'uu1', ?)", (LONG,))
+    conn.commit()
+
+    assert migrate(conn) == [10]
+    assert conn.execute(
+        "SELECT rowid FROM chat_messages_fts WHERE chat_messages_fts MATCH 'owner:uu1 AND content:integrals'"
+    ).fetchall() == [(1,)]
+    conn.execute("DELETE FROM chats WHERE id = 1")
+    conn.execute("INSERT INTO chat_messages_fts (chat_messages_fts, rank) VALUES ('integrity-check', 1)")
+    assert conn.execute("SELECT COUNT(*) FROM chat_messages_fts WHERE chat_messages_fts MATCH 'integrals'").fetchone()[0] == 0
+    conn.close()
+
+
+def test_deleting_unindexed_messages_keeps_the_index_intact(app_db):
+    add_user("u-1")
+    chat_id = save_chat("u-1", "Indexed", [{"role": "user", "content": "limits"}], "2024-01-01")
+    with db.get_db() as conn:
+        # Written around utils.insert_chat_messages, so never indexed
+        conn.execute("INSERT INTO chat_messages (chat_id, seq, role, content) VALUES (?, 1, 'user', 'raw')", (chat_id,))
+        conn.execute("DELETE FROM chat_messages WHERE content = 'raw'")
+    delete_chat("u-1", chat_id)
+    assert titles("u-1", "limits") == []
+    check_index()
+
+
+def test_title_matches_rank_first_and_pages_continue(app_db):
+    add_user("u-1")
+    for number in range(3):
+        save_chat("u-1", f"Notes {number}", [{"role": "user", "content": "integrals practice"}], f"2024-01-0{number + 1}")
+    save_chat("u-1", "Integrals", [{"role": "user", "content": "unrelated"}], "2024-01-01")
+
+    first, more = search_chats("u-1", "integrals", limit=2)
+    assert first[0]["title"] == "Integrals" and more
+    rest, more = search_chats("u-1", "integrals", limit=2, offset=2)
+    assert len(rest) == 2 and not more
+    assert {result["title"] for result in first + rest} == {"Integrals", "Notes 0", "Notes 1", "Notes 2"}
+
+
+def test_query_text_is_never_fts_syntax(app_db):
+    add_user("u-1")
+    chat_id = save_chat("u-1", "Physics", [{"role": "user", "content": "Newton's laws of motion"}], "2024-01-01")
+    # Punctuation and operators are plain words; the last word matches as a prefix
+    assert titles("u-1", 'newton "OF" (law') == ["Physics"]
+    assert titles("u-1", "NOT -*") == []
+    assert search_chats("u-1", "?!") == ([], False)
+
+    with db.get_db() as conn:
+        conn.execute("UPDATE chats SET title = 'Mechanics' WHERE id = ?", (chat_id,))
+    assert titles("u-1", "mechan") == ["Mechanics"]
+    assert titles("u-1", "physics") == []
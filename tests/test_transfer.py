@@ -0,0 +1,93 @@
+# tests/test_transfer.py
+import io
+
+import db
+import transfer
+from utils import list_chats, load_chat, load_timetables, save_chat, save_timetable, search_chats
+
+MESSAGES = [{"role": "user", "content": "Plan my calculus revision"},
+            {"role": "assistant", "content": "Week 1: limits and derivatives"}]
+PLAN = {"topics": [{"topic": "Limits", "difficulty": "easy", "hours": 2}], "schedule": {}}
+
+
+def add_user(user_id, username):
+    with db.get_db() as conn:
+        conn.execute("INSERT INTO users (id, username, password_hash) VALUES (?, ?, 'hash')", (user_id, username))
+
+
+def export_text(user_id=None, batch_size=2):
+    out = io.StringIO()
+    transfer.export_ndjson(out, user_id, batch_size)
+    return out.getvalue()
+
+
+def test_round_trip_into_a_fresh_database(app_db, tmp_path, monkeypatch):
+    add_user("u-1", "ann")
+    for number in range(3):
+        save_chat("u-1", f"Calculus {number}", MESSAGES, f"2024-01-0{number + 1}T10:00:00")
+    save_timetable("u-1", "Exam", PLAN)
+    dump = export_text()
+
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "restored.db"))
+    monkeypatch.setattr(db, "_pool", None)
+    counts = transfer.import_ndjson(io.StringIO(dump), batch_size=3)
+
+    assert counts == {"user": 1, "chat": 3, "timetable": 1}
+    chats = list_chats("u-1", limit=10)
+    assert [chat["title"] for chat in chats] == ["Calculus 2", "Calculus 1", "Calculus 0"]
+    assert load_chat("u-1", chats[0]["id"]) == MESSAGES
+    assert load_timetables("u-1") == {"Exam": PLAN}
+    # Imported messages are searchable
+    results, _ = search_chats("u-1", "derivatives")
+    assert len(results) == 3
+    assert export_text() == dump
+    db._pool.close()
+
+
+def test_importing_twice_adds_nothing(app_db):
+    add_user("u-1", "ann")
+    save_chat("u-1", "Calculus", MESSAGES, "2024-01-01T10:00:00")
+    save_timetable("u-1", "Exam", PLAN)
+    dump = export_text()
+
+    transfer.import_ndjson(io.StringIO(dump))
+    transfer.import_ndjson(io.StringIO(dump))
+    assert len(list_chats("u-1", limit=10)) == 1
+    assert export_text() == dump
+
+
+def test_imported_chats_get_fresh_ids(app_db):
+    add_user("u-1", "ann")
+    add_user("u-2", "bob")
+    save_chat("u-1", "Calculus", MESSAGES, "2024-01-01T10:00:00")
+    dump = export_text("u-1").replace("Calculus", "Algebra")
+    deleted = save_chat("u-2", "Physics", MESSAGES, "2024-01-02T10:00:00")
+    with db.get_db() as conn:
+        conn.execute("DELETE FROM chats WHERE id = ?", (deleted,))
+
+    transfer.import_ndjson(io.StringIO(dump))
+    # AUTOINCREMENT: the id of the deleted chat is never handed out again
+    assert deleted not in {chat["id"] for chat in list_chats("u-1", limit=10)}
+
+
+def test_account_deletion_in_chunks_removes_everything(app_db):
+    import auth
+
+    add_user("u-1", "ann")
+    add_user("u-2", "bob")
+    for number in range(5):
+        save_chat("u-1", f"Chat {number}", MESSAGES, f"2024-01-0{number + 1}")
+        save_timetable("u-1", f"Plan {number}", PLAN)
+    kept = save_chat("u-2", "Other", MESSAGES, "2024-01-01")
+    auth.create_session("u-1")
+
+    auth.delete_user("u-1", chunk_size=2)
+    with db.get_db() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM users WHERE id = 'u-1'").fetchone()[0] == 0
+        for table in ("chats", "timetables", "sessions"):
+            assert conn.execute(f"SELECT COUNT(*) FROM {table} WHERE user_id = 'u-1'").fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM chat_messages").fetchone()[0] == len(MESSAGES)
+        conn.execute("INSERT INTO chat_messages_fts (chat_messages_fts, rank) VALUES ('integrity-check', 1)")
+    assert load_chat("u-2", kept) == MESSAGES
+    results, _ = search_chats("u-1", "derivatives")
+    assert results == []
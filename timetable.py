@@ -1,56 +1,108 @@
 # timetable.py
 import streamlit as st
-from utils import save_timetable, load_timetables
-from llm_utils import create_chain
-from langchain.prompts import PromptTemplate
+from utils import save_timetable, list_timetables, count_timetables, load_timetable
+from llm_utils import get_chain, invoke_chain, stream_chain
+from llm_cache import LLM_CACHE_ENABLED, get_response_cache, make_key
+from scheduler import normalize_topics, plan_schedule
+from json_repair import JSONRepairer, loads_tolerant
+import metrics
+from metrics import traced
+from jobs import ACTIVE_STATUSES, JobError, list_jobs, queue_stats, start_workers, submit_job
 from datetime import datetime
-import json
+import os
 import re
-from utils import load_css
+import threading
+import time
+import uuid
+
+# Saved plans listed per page
+TIMETABLE_PAGE_SIZE = int(os.getenv("TIMETABLE_PAGE_SIZE", "10"))
+# Seconds between refreshes of the queued/running plans panel
+JOB_UI_POLL = float(os.getenv("JOB_UI_POLL", "2"))
+
+# Parse outcomes for LLM answers, see parse_stats(); updated from job worker threads
+_parse_counts = {"attempts": 0, "failures": 0, "repaired": 0}
+_parse_lock = threading.Lock()
 
 def extract_json(text):
-    match = re.search(r"```json(.*?)```", text, re.DOTALL)
-    raw_json = match.group(1).strip() if match else text.strip()
-    return json.loads(raw_json)
+    """
+    Parses the JSON in an LLM answer, tolerating code fences, trailing commas and
+    truncated output (see json_repair.py). Raises json.JSONDecodeError if nothing
+    can be recovered.
+    """
+    return loads_tolerant(text)
+
+def complete_topics(document):
+    """
+    Topic entries of a (possibly partial) analysis that are complete. Values only
+    appear in a repaired snapshot once they are complete, so an entry with all
+    three fields is final.
+    """
+    if not isinstance(document, dict) or not isinstance(document.get("topics"), list):
+        return []
+    return normalize_topics([
+        item for item in document["topics"]
+        if isinstance(item, dict) and {"topic", "difficulty", "hours"} <= item.keys()
+    ])
+
+def validate_topic_analysis(document):
+    """Checks a parsed answer against the analysis schema; returns it cleaned up or None."""
+    if not isinstance(document, dict):
+        return None
+    topics = normalize_topics(document.get("topics"))
+    if not topics:
+        return None
+    tips = document.get("tips", [])
+    tips = [str(tip) for tip in tips if isinstance(tip, (str, int, float))] if isinstance(tips, list) else []
+    return {"topics": topics, "tips": tips}
+
+def _count_parse(outcome):
+    """Records one parsed answer: "ok", "repaired" (fixed up or truncated) or "failed"."""
+    with _parse_lock:
+        _parse_counts["attempts"] += 1
+        if outcome == "failed":
+            _parse_counts["failures"] += 1
+        elif outcome == "repaired":
+            _parse_counts["repaired"] += 1
+    if metrics.METRICS_ENABLED:
+        metrics.increment("studygo_timetable_parse_total", outcome=outcome)
+
+def parse_stats():
+    with _parse_lock:
+        counts = dict(_parse_counts)
+    counts["failure_rate"] = counts["failures"] / counts["attempts"] if counts["attempts"] else 0.0
+    return counts
 
-def generate_schedule(topics_text, total_days, daily_hours):
-    prompt_template = PromptTemplate(
-    input_variables=["topics", "days", "hours"],
+def build_topics_prompt():
+    from langchain.prompts import PromptTemplate
+
+    return PromptTemplate(
+    input_variables=["topics"],
     template="""
 You are an intelligent study planning assistant.
 
-Your job is to help users break down serious academic or professional topics into a day-by-day study plan.
+Your job is to analyze what a user wants to learn so that a day-by-day study plan can be built from it.
 
 The user wants to learn the following topics:
+<topics>
 {topics}
-
-They have {days} days and {hours} hours per day available.
+</topics>
 
 Please:
-1. Extract only valid academic or professional subjects and subtopics.
+1. Extract only valid academic or professional subjects and subtopics, in a sensible learning order.
 2. Ignore or skip anything unrelated to education (e.g., movies, music, sports, entertainment, gossip).
 3. Estimate the difficulty of each topic (easy/medium/hard).
-4. Estimate total time required per topic (hard gets more time than easy).
-5. Check if the topics can reasonably fit in the total time available.
-6. If not, provide a schedule that fits the user's availability and add a flag to indicate a warning.
-7. Format response in strictly valid JSON. No comments, no extra text.
+4. Estimate the total hours needed to learn each topic well (hard gets more time than easy).
+5. Do NOT split topics into days; scheduling is done separately.
+6. Format response in strictly valid JSON. No comments, no extra text.
 
 Return only JSON in this format:
 ```json
 {{
-  "schedule": {{
-    "Day 1": [
-      {{"topic": "Intro to AI", "hours": 2}}
-    ],
-    "Day 2": [
-      {{"topic": "Neural Networks", "hours": 3}}
-    ]
-  }},
-  "warning": false,
-  "minimum_needed": {{
-    "days": 7,
-    "daily_hours": 5
-  }},
+  "topics": [
+    {{"topic": "Intro to AI", "difficulty": "easy", "hours": 2}},
+    {{"topic": "Neural Networks", "difficulty": "hard", "hours": 6}}
+  ],
   "tips": [
     "Use spaced repetition for better memory.",
     "Avoid multitasking during study blocks."
@@ -59,21 +111,191 @@ Return only JSON in this format:
 ```"""
     )
 
-    chain = create_chain(prompt_template)
+# ---------------- Generation Cache ----------------
+# Parsed topic analyses are shared across users in the "timetable" namespace of the response cache
+SCHEDULE_CACHE_NAMESPACE = "timetable"
 
-    response = chain.invoke({
-        "topics": topics_text,
-        "days": str(total_days),
-        "hours": str(daily_hours)
-    })
+def canonical_topics(topics_text):
+    """Topic list with whitespace and case normalized, duplicates removed and order ignored."""
+    items = re.split(r"[\n,;]+", topics_text)
+    return sorted({re.sub(r"\s+", " ", item).strip(" -•*\t").casefold() for item in items} - {""})
 
-    try:
-        return extract_json(response["text"])
-    except json.JSONDecodeError:
-        st.error("⚠️ Could not parse JSON. Please try again.")
+def topics_cache_key(topics_text, prompt_template):
+    # Days and hours are not part of the key: packing is done locally by scheduler.py.
+    # The prompt template is, so editing it never serves stale analyses.
+    return make_key(canonical_topics(topics_text), prompt_template)
+
+def invalidate_schedule_cache():
+    """Drops every cached topic analysis, e.g. after changing how plans are generated."""
+    get_response_cache().clear(SCHEDULE_CACHE_NAMESPACE)
+
+def schedule_cache_stats():
+    return get_response_cache().stats(SCHEDULE_CACHE_NAMESPACE)
+
+def analyze_topics(topics_text, use_cache=True, on_progress=None):
+    """
+    Asks the LLM for the topic list with difficulty and estimated hours.
+    Returns {"topics": [...], "tips": [...]} or None if the answer can't be parsed.
+    With `on_progress`, the answer is streamed and on_progress(topics) is called
+    each time another topic entry is complete.
+    """
+    # Built once per process and LLM config, see llm_utils.get_chain
+    chain = get_chain("timetable_topics", build_topics_prompt)
+
+    use_cache = use_cache and LLM_CACHE_ENABLED
+    if use_cache:
+        cache_key = topics_cache_key(topics_text, chain.prompt.template)
+        cached = get_response_cache().get(SCHEDULE_CACHE_NAMESPACE, cache_key)
+        if cached is not None:
+            return cached
+
+    repairer = JSONRepairer()
+    if on_progress is None:
+        response = invoke_chain(chain, {"topics": topics_text})
+        repairer.feed(response["text"])
+    else:
+        found = 0
+        for chunk in stream_chain(chain, {"topics": topics_text}):
+            topics = complete_topics(repairer.feed(chunk).snapshot())
+            if len(topics) > found:
+                found = len(topics)
+                on_progress(topics)
+
+    analysis = validate_topic_analysis(repairer.snapshot())
+    if analysis is None:
+        _count_parse("failed")
         return None
+    _count_parse("repaired" if repairer.repaired or not repairer.complete else "ok")
+
+    # A truncated answer is still usable, but don't serve it again from the cache
+    if use_cache and repairer.complete:
+        get_response_cache().set(SCHEDULE_CACHE_NAMESPACE, cache_key, analysis)
+    return analysis
+
+# ---------------- Background generation ----------------
+def job_plan_name(job):
+    """
+    The name a job's plan is saved under. Unnamed plans get the job id, so two
+    queued in the same minute don't replace each other.
+    """
+    created = datetime.fromtimestamp(job["created_at"]).strftime("%Y-%m-%d %H:%M")
+    return job["payload"].get("name") or f"Study Plan {created} #{job['id']}"
+
+def run_timetable_job(job, report_progress):
+    """
+    jobs.py handler: generates the plan described by the job payload, reporting
+    drafts as topics stream in, and saves it to the owner's account.
+    """
+    payload = job["payload"]
+    days, hours = payload["days"], payload["hours"]
+
+    def draft(topics):
+        report_progress({"topics": len(topics), "schedule": plan_schedule(topics, days, hours)["schedule"]})
+
+    analysis = analyze_topics(payload["topics"], on_progress=draft)
+    if analysis is None:
+        raise JobError("Could not parse the AI's answer. Please try again.")
+    result = plan_schedule(analysis["topics"], days, hours, analysis.get("tips"))
+    if job["user_id"]:
+        save_timetable(job["user_id"], job_plan_name(job), result["schedule"])
+    return result
+
+def _job_owner():
+    """(user_id, session_id) the Timetable page's jobs are filed under."""
+    if "job_session" not in st.session_state:
+        st.session_state.job_session = uuid.uuid4().hex
+    user_id = None if st.session_state.get("is_guest", False) else st.session_state.get("user_id")
+    return user_id, st.session_state.job_session
+
+def _poll(func):
+    # st.fragment reruns just this panel on a timer; older Streamlit gets a refresh button
+    fragment = getattr(st, "fragment", None)
+    return fragment(run_every=JOB_UI_POLL)(func) if fragment else func
+
+def show_plan_result(result, saved):
+    schedule = result["schedule"]
+    if result.get("warning", False):
+        needed = result.get("minimum_needed", {})
+        min_days = needed.get("days", "?")
+        min_hours = needed.get("daily_hours", "?")
+        st.warning(f"⚠️ Your selected time may not be enough to learn everything effectively. Recommended: {min_days} days with {min_hours} hours/day.")
+    for note in result.get("notes", []):
+        st.caption(f"ℹ️ {note}")
+
+    st.markdown("### 📌 Your Personalized Study Plan")
+    render_schedule(schedule)
+
+    tips = result.get("tips", [])
+    if tips:
+        st.markdown("### 💡 Bonus Study Tips")
+        for tip in tips:
+            st.markdown(f"- {tip}")
+
+    if saved:
+        st.success("💾 Timetable saved to your account.")
+    else:
+        st.info("📝 You're in guest mode — timetable won't be saved. Sign up to save your plans!")
+
+@_poll
+def render_timetable_jobs():
+    user_id, session_id = _job_owner()
+    jobs = list_jobs(user_id, session_id, limit=5)
+    if not jobs:
+        return
+    stats = queue_stats()
+    st.markdown("### ⏳ Your Plans")
+    st.caption(f"Queue: {stats['queued']} waiting, {stats['running']} generating • "
+               f"average wait {stats['avg_wait_seconds']:.0f}s, generation {stats['avg_run_seconds']:.0f}s")
+    if LLM_CACHE_ENABLED:
+        cache_stats = schedule_cache_stats()
+        st.caption(f"♻️ Topic analysis cache hit rate: {cache_stats['hit_rate']:.0%} "
+                   f"({cache_stats['hits']} of {cache_stats['hits'] + cache_stats['misses']} requests)")
+
+    now = time.time()
+    for job in jobs:
+        name = job_plan_name(job)
+        if job["status"] == "queued" and (job["not_before"] or 0) > now:
+            st.markdown(f"🔁 **{name}** — retrying in {job['not_before'] - now:.0f}s ({job['error']})")
+        elif job["status"] == "queued":
+            st.markdown(f"🕒 **{name}** — waiting for {now - job['created_at']:.0f}s")
+        elif job["status"] == "running":
+            progress = job["progress"] or {}
+            st.markdown(f"⚙️ **{name}** — generating for {now - job['started_at']:.0f}s, "
+                        f"{progress.get('topics', 0)} topic(s) analyzed so far")
+            if progress.get("schedule"):
+                with st.expander("✍️ Draft so far"):
+                    render_schedule(progress["schedule"])
+        elif job["status"] == "failed":
+            st.markdown(f"❌ **{name}** — {job['error']}")
+        else:
+            took = job["finished_at"] - job["started_at"]
+            with st.expander(f"✅ {name} — ready (generated in {took:.0f}s)"):
+                show_plan_result(job["result"], saved=job["user_id"] is not None)
+
+    active = {job["id"] for job in jobs if job["status"] in ACTIVE_STATUSES}
+    finished = st.session_state.get("timetable_jobs_active", set()) - active
+    st.session_state.timetable_jobs_active = active
+    if finished and user_id:
+        # A plan was just saved: rerun the whole page so the saved plans list shows it
+        st.rerun()
+    if active and not getattr(st, "fragment", None):
+        st.button("🔄 Refresh status")
+
+@traced("render.schedule")
+def render_schedule(schedule):
+    for day, tasks in schedule.items():
+        st.markdown(f'<div class="timetable-day">', unsafe_allow_html=True)
+        st.markdown(f"**{day}**")
+        for task in tasks:
+            st.markdown(f'''
+            <div class="timetable-task">
+                <strong>{task['topic']}</strong> — {task['hours']} hour(s)
+            </div>
+            ''', unsafe_allow_html=True)
+        st.markdown('</div>', unsafe_allow_html=True)
 
 def timetable_page():
+    start_workers()
     st.markdown("## 📆 AI-Powered Study Timetable")
     st.write("Tell us what you want to learn, and we'll generate a structured study plan.")
 
@@ -101,47 +323,14 @@ def timetable_page():
             st.warning("Please enter some topics.")
             return
 
-        with st.spinner("🤖 AI is creating your personalized study plan..."):
-            result = generate_schedule(topics_text, total_days, daily_hours)
+        user_id, session_id = _job_owner()
+        submit_job("timetable", {"topics": topics_text, "days": int(total_days), "hours": daily_hours,
+                                 "name": name.strip()}, user_id=user_id, session_id=session_id)
+        st.success("🤖 Your plan is being generated — you can queue more or come back later, nothing is lost.")
 
-        if result and "schedule" in result:
-            schedule = result["schedule"]
-            warning = result.get("warning", False)
-            tips = result.get("tips", [])
-
-            st.success("✅ Timetable generated successfully!")
-            if warning:
-                needed = result.get("minimum_needed", {})
-                min_days = needed.get("days", "?")
-                min_hours = needed.get("daily_hours", "?")
-                st.warning(f"⚠️ Your selected time may not be enough to learn everything effectively. Recommended: {min_days} days with {min_hours} hours/day.")
-
-            st.markdown("### 📌 Your Personalized Study Plan")
-            for day, tasks in schedule.items():
-                st.markdown(f'<div class="timetable-day">', unsafe_allow_html=True)
-                st.markdown(f"**{day}**")
-                for task in tasks:
-                    st.markdown(f'''
-                    <div class="timetable-task">
-                        <strong>{task['topic']}</strong> — {task['hours']} hour(s)
-                    </div>
-                    ''', unsafe_allow_html=True)
-                st.markdown('</div>', unsafe_allow_html=True)
-
-            if tips:
-                st.markdown("### 💡 Bonus Study Tips")
-                for tip in tips:
-                    st.markdown(f"- {tip}")
-
-            if not st.session_state.get("is_guest", False):
-                user_id = st.session_state.get("user_id")
-                if user_id:
-                    plan_name = name.strip() or f"Study Plan {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-                    save_timetable(user_id, plan_name, schedule)
-                    st.success("💾 Timetable saved to your account.")
-            else:
-                st.info("📝 You're in guest mode — timetable won't be saved. Sign up to save your plans!")
+    render_timetable_jobs()
 
+@traced("render.saved_timetables")
 def display_saved_timetables():
     if st.session_state.get("is_guest", False):
         st.markdown('''
@@ -152,9 +341,9 @@ def display_saved_timetables():
         return
 
     user_id = st.session_state.get("user_id")
-    timetables = load_timetables(user_id)
+    total_plans = count_timetables(user_id)
 
-    if not timetables:
+    if not total_plans:
         st.markdown('''
         <div class="info-card">
             <p>📚 No saved study plans found. Create your first timetable below!</p>
@@ -162,18 +351,44 @@ def display_saved_timetables():
         ''', unsafe_allow_html=True)
         return
 
+    if "timetable_page_cursors" not in st.session_state:
+        st.session_state.timetable_page_cursors = []
+    cursors = st.session_state.timetable_page_cursors
+    plans = list_timetables(user_id, limit=TIMETABLE_PAGE_SIZE, before=cursors[-1] if cursors else None)
+    if not plans and cursors:
+        # The page emptied (plans deleted elsewhere): go back to the first one
+        cursors.clear()
+        plans = list_timetables(user_id, limit=TIMETABLE_PAGE_SIZE)
+
     st.markdown("## 📁 Your Saved Study Plans")
-    for plan_name, schedule in timetables.items():
+    for plan in plans:
         st.markdown(f'<div class="timetable-card">', unsafe_allow_html=True)
-        st.markdown(f"### 📋 {plan_name}")
-        total_days = len(schedule)
-        total_hours = sum(sum(task['hours'] for task in tasks) for tasks in schedule.values())
-        st.markdown(f"**Duration:** {total_days} days • **Total Study Time:** {total_hours} hours")
+        st.markdown(f"### 📋 {plan['name']}")
+        summary = f"**Duration:** {plan['day_count']} days • **Total Study Time:** {plan['total_hours']:g} hours"
+        summary += f" • **Topics:** {plan['topic_count']}"
+        if plan["created_at"]:
+            summary += f" • **Saved:** {datetime.fromtimestamp(plan['created_at']).strftime('%Y-%m-%d')}"
+        st.markdown(summary)
 
-        with st.expander(f"📖 View Details - {plan_name}"):
+        # The schedule itself is only loaded while its toggle is on
+        if st.toggle(f"📖 View Details - {plan['name']}", key=f"timetable_details_{plan['id']}"):
+            schedule = load_timetable(user_id, plan["id"]) or {}
             for day, tasks in schedule.items():
                 st.markdown(f"**{day}:**")
                 for task in tasks:
                     st.markdown(f"  • {task['topic']} — {task['hours']} hour(s)")
 
         st.markdown('</div>', unsafe_allow_html=True)
+
+    shown_until = len(cursors) * TIMETABLE_PAGE_SIZE + len(plans)
+    if total_plans > TIMETABLE_PAGE_SIZE:
+        st.caption(f"Showing {shown_until - len(plans) + 1}–{shown_until} of {total_plans} plans")
+        col_newer, col_older = st.columns(2)
+        with col_newer:
+            if cursors and st.button("⬅️ Newer plans", key="timetables_newer", use_container_width=True):
+                cursors.pop()
+                st.rerun()
+        with col_older:
+            if shown_until < total_plans and st.button("Older plans ➡️", key="timetables_older", use_container_width=True):
+                cursors.append(plans[-1]["id"])
+                st.rerun()
@@ -0,0 +1,201 @@
+# transfer.py
+"""
+Streaming NDJSON export and import of StudyGo user data.
+
+One JSON object per line, each with a "type": a "user" line comes before that
+user's "chat" (with its messages) and "timetable" lines. Reads walk the tables
+with keyset cursors in batches, so memory stays flat however much a user has.
+The export includes password hashes; treat the file like the database itself.
+
+    python transfer.py export -o backup.ndjson            # every user
+    python transfer.py export --user alice -o alice.ndjson
+    python transfer.py import backup.ndjson
+"""
+import argparse
+import json
+import sys
+
+from compression import decode
+from db import get_db
+import retrieval
+from utils import TIMETABLE_INSERT, insert_chat_messages, timetable_row
+
+TRANSFER_BATCH_SIZE = 500
+
+
+# ---------------- Export ----------------
+def _batches(sql, params, after, batch_size):
+    """Yields pages of rows for a query ending in `id > ? ORDER BY id LIMIT ?` (id first column)."""
+    while True:
+        with get_db() as conn:
+            rows = conn.execute(sql, (*params, after, batch_size)).fetchall()
+        if not rows:
+            return
+        yield rows
+        after = rows[-1][0]
+
+
+def iter_user_records(user_id, batch_size=TRANSFER_BATCH_SIZE):
+    """Yields the export records of one user."""
+    with get_db() as conn:
+        user = conn.execute("SELECT id, username, password_hash FROM users WHERE id = ?", (user_id,)).fetchone()
+    if user is None:
+        return
+    yield {"type": "user", "id": user[0], "username": user[1], "password_hash": user[2]}
+
+    for chats in _batches(
+        "SELECT id, title, timestamp FROM chats WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+        (user_id,), 0, batch_size
+    ):
+        with get_db() as conn:
+            rows = conn.execute(f"""
+                SELECT chat_id, role, content, codec FROM chat_messages
+                WHERE chat_id IN ({",".join("?" * len(chats))}) ORDER BY chat_id, seq
+            """, [chat[0] for chat in chats]).fetchall()
+        messages = {}
+        for chat_id, role, content, codec in rows:
+            messages.setdefault(chat_id, []).append({"role": role, "content": decode(content, codec)})
+        for chat_id, title, timestamp in chats:
+            yield {"type": "chat", "user_id": user_id, "title": title, "timestamp": timestamp,
+                   "messages": messages.get(chat_id, [])}
+
+    for timetables in _batches(
+        "SELECT id, name, schedule_json, codec, created_at FROM timetables"
+        " WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+        (user_id,), 0, batch_size
+    ):
+        for _, name, schedule_json, codec, created_at in timetables:
+            yield {"type": "timetable", "user_id": user_id, "name": name, "created_at": created_at,
+                   "schedule": json.loads(decode(schedule_json, codec))}
+
+
+def iter_records(user_id=None, batch_size=TRANSFER_BATCH_SIZE):
+    """Yields the export records of one user, or of every user when user_id is None."""
+    if user_id is not None:
+        yield from iter_user_records(user_id, batch_size)
+        return
+    for users in _batches("SELECT rowid, id FROM users WHERE rowid > ? ORDER BY rowid LIMIT ?", (), 0, batch_size):
+        for _, uid in users:
+            yield from iter_user_records(uid, batch_size)
+
+
+def export_ndjson(out, user_id=None, batch_size=TRANSFER_BATCH_SIZE):
+    """Writes records as NDJSON to the text stream `out`; returns counts per record type."""
+    counts = {"user": 0, "chat": 0, "timetable": 0}
+    for record in iter_records(user_id, batch_size):
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        counts[record["type"]] += 1
+    return counts
+
+
+# ---------------- Import ----------------
+def _flush(users, chats, timetables):
+    """Writes one batch in a single transaction."""
+    with get_db() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO users (id, username, password_hash) VALUES (?, ?, ?)",
+            [(u["id"], u["username"], u["password_hash"]) for u in users]
+        )
+        for u in users:
+            if conn.execute("SELECT 1 FROM users WHERE id = ?", (u["id"],)).fetchone() is None:
+                raise ValueError(f"username {u['username']!r} already belongs to another account")
+        for c in chats:
+            # A chat with the same owner, title and timestamp was imported before
+            if conn.execute(
+                "SELECT 1 FROM chats WHERE user_id = ? AND timestamp = ? AND title = ?",
+                (c["user_id"], c["timestamp"], c["title"])
+            ).fetchone():
+                continue
+            # Ids from the source database may be taken here, so new ones are assigned
+            chat_id = conn.execute(
+                "INSERT INTO chats (user_id, title, timestamp) VALUES (?, ?, ?)",
+                (c["user_id"], c["title"], c["timestamp"])
+            ).lastrowid
+            insert_chat_messages(conn, chat_id, c["messages"])
+        conn.executemany(
+            TIMETABLE_INSERT,
+            [timetable_row(t["user_id"], t["name"], t["schedule"], t.get("created_at")) for t in timetables]
+        )
+    # Loaded retrieval indexes of these users are rebuilt on their next question
+    for user_id in {record["user_id"] for record in (*chats, *timetables)}:
+        retrieval.drop_user(user_id)
+
+
+def import_ndjson(lines, batch_size=TRANSFER_BATCH_SIZE):
+    """
+    Imports NDJSON records from an iterable of lines in batched transactions.
+    Existing users are kept (matched by id); chats are appended unless the user
+    already has one with the same title and timestamp, and timetables replace
+    ones with the same name, so importing a file twice changes nothing.
+    Returns counts of the records read per type.
+    """
+    counts = {"user": 0, "chat": 0, "timetable": 0}
+    batch = {"user": [], "chat": [], "timetable": []}
+    pending = 0
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        kind = record.get("type")
+        if kind not in batch:
+            raise ValueError(f"line {number}: unknown record type {kind!r}")
+        if kind == "user" and pending:
+            # Flush first so this user's rows never reach the database before the user does
+            _flush(batch["user"], batch["chat"], batch["timetable"])
+            batch = {"user": [], "chat": [], "timetable": []}
+            pending = 0
+        batch[kind].append(record)
+        counts[kind] += 1
+        pending += 1 + len(record.get("messages", ()))
+        if pending >= batch_size:
+            _flush(batch["user"], batch["chat"], batch["timetable"])
+            batch = {"user": [], "chat": [], "timetable": []}
+            pending = 0
+    if pending:
+        _flush(batch["user"], batch["chat"], batch["timetable"])
+    return counts
+
+
+# ---------------- CLI ----------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or import StudyGo user data as NDJSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_cmd = commands.add_parser("export", help="write users, chats and timetables as NDJSON")
+    export_cmd.add_argument("--user", help="username to export (default: every user)")
+    export_cmd.add_argument("-o", "--output", default="-", help="output file (default: stdout)")
+    export_cmd.add_argument("--batch-size", type=int, default=TRANSFER_BATCH_SIZE)
+
+    import_cmd = commands.add_parser("import", help="load an NDJSON export")
+    import_cmd.add_argument("input", help="NDJSON file, or - for stdin")
+    import_cmd.add_argument("--batch-size", type=int, default=TRANSFER_BATCH_SIZE)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        user_id = None
+        if args.user:
+            with get_db() as conn:
+                row = conn.execute("SELECT id FROM users WHERE username = ?", (args.user,)).fetchone()
+            if row is None:
+                parser.error(f"no such user: {args.user}")
+            user_id = row[0]
+        out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+        try:
+            counts = export_ndjson(out, user_id, args.batch_size)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    else:
+        source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+        try:
+            counts = import_ndjson(source, args.batch_size)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+
+    print(", ".join(f"{count} {kind}s" for kind, count in counts.items()), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,117 +1,288 @@
 #utils.py
 import streamlit as st
-import sqlite3
 import json
 import os
+import re
+import time
+from db import DB_PATH, get_db
+from metrics import traced
+from compression import encode, decode
+from scheduler import schedule_summary
+import retrieval
 
 # ---------------- CSS Loader ----------------
-def load_css(file_path="theme.css"):
+@st.cache_resource
+def read_css(file_path):
+    """Reads the stylesheet once per process."""
     if os.path.exists(file_path):
         with open(file_path) as f:
-            st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+            return f.read()
+    return ""
+
+def load_css(file_path="theme.css"):
+    # Injected on every rerun (Streamlit redraws the page), read from disk once
+    css = read_css(file_path)
+    if css:
+        st.markdown(f"<style>{css}</style>", unsafe_allow_html=True)
 
 
 # ---------------- SQLite Database Setup ----------------
-DB_PATH = "database.db"
-
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("PRAGMA foreign_keys = 1")
-    return conn
-
-def init_db():
-    conn = get_db()
-    cursor = conn.cursor()
-
-    # Users
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id TEXT PRIMARY KEY,
-        username TEXT UNIQUE,
-        password_hash TEXT
-    )
-    """)
-
-    # Chats
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS chats (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT,
-        title TEXT,
-        messages_json TEXT,
-        timestamp TEXT,
-        FOREIGN KEY(user_id) REFERENCES users(id)
-    )
-    """)
-
-    # Timetables
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS timetables (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT,
-        name TEXT,
-        schedule_json TEXT,
-        FOREIGN KEY(user_id) REFERENCES users(id)
-    )
-    """)
+# Schema lives in migrations.py and is applied on first use of the pool
 
+# ---------------- DB Helper Functions ----------------
+@traced("db.create_chat")
+def create_chat(user_id, title, timestamp):
+    """Creates an empty conversation and returns its id."""
+    with get_db() as conn:
+        cursor = conn.execute("INSERT INTO chats (user_id, title, timestamp) VALUES (?, ?, ?)", (user_id, title, timestamp))
+        return cursor.lastrowid
 
-    conn.commit()
-    conn.close()
+def _index_messages(conn, chat_id, rows):
+    """Adds (message id, plain text) rows to the search index; stored content may be compressed."""
+    conn.executemany("""
+        INSERT INTO chat_messages_fts (rowid, owner, content)
+        SELECT ?, 'u' || replace(user_id, '-', ''), ? FROM chats WHERE id = ?
+    """, [(message_id, text, chat_id) for message_id, text in rows])
 
-init_db()
+def insert_chat_messages(conn, chat_id, messages, first_seq=0):
+    """Stores messages with seq numbers from first_seq, compressed per compression.py, and indexes them."""
+    conn.executemany(
+        "INSERT INTO chat_messages (chat_id, seq, role, content, codec) VALUES (?, ?, ?, ?, ?)",
+        [(chat_id, first_seq + i, m["role"], *encode(m["content"])) for i, m in enumerate(messages)]
+    )
+    ids = conn.execute(
+        "SELECT id FROM chat_messages WHERE chat_id = ? AND seq >= ? ORDER BY seq LIMIT ?",
+        (chat_id, first_seq, len(messages))
+    ).fetchall()
+    _index_messages(conn, chat_id, [(row[0], m["content"]) for row, m in zip(ids, messages)])
 
-# ---------------- DB Helper Functions ----------------
+@traced("db.append_chat_message")
+def append_chat_message(chat_id, role, content):
+    """Appends one turn to a conversation as a single-row insert and returns its sequence number."""
+    value, codec = encode(content)
+    with get_db() as conn:
+        cursor = conn.execute("""
+            INSERT INTO chat_messages (chat_id, seq, role, content, codec)
+            SELECT ?, COALESCE(MAX(seq), -1) + 1, ?, ?, ? FROM chat_messages WHERE chat_id = ?
+        """, (chat_id, role, value, codec, chat_id))
+        _index_messages(conn, chat_id, [(cursor.lastrowid, content)])
+        seq = conn.execute("SELECT seq FROM chat_messages WHERE id = ?", (cursor.lastrowid,)).fetchone()[0]
+        user_id, title = conn.execute("SELECT user_id, title FROM chats WHERE id = ?", (chat_id,)).fetchone()
+    retrieval.index_chat(user_id, chat_id, title, [{"role": role, "content": content}])
+    return seq
+
+@traced("db.save_chat")
 def save_chat(user_id, title, messages, timestamp):
-    conn = get_db()
-    cursor = conn.cursor()
-    messages_json = json.dumps(messages)
-    cursor.execute("""
-        INSERT INTO chats (user_id, title, messages_json, timestamp)
-        VALUES (?, ?, ?, ?)
-    """, (user_id, title, messages_json, timestamp))
-    conn.commit()
-    conn.close()
+    with get_db() as conn:
+        chat_id = create_chat(user_id, title, timestamp)
+        insert_chat_messages(conn, chat_id, messages)
+    retrieval.index_chat(user_id, chat_id, title, messages)
+    return chat_id
 
+@traced("db.load_chats")
 def load_chats(user_id):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT title, messages_json, timestamp FROM chats WHERE user_id = ?", (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
+    with get_db() as conn:
+        chats = conn.execute("SELECT id, title, timestamp FROM chats WHERE user_id = ? ORDER BY timestamp, id", (user_id,)).fetchall()
+        rows = conn.execute("""
+            SELECT m.chat_id, m.role, m.content, m.codec
+            FROM chat_messages m JOIN chats c ON c.id = m.chat_id
+            WHERE c.user_id = ?
+            ORDER BY c.timestamp, c.id, m.seq
+        """, (user_id,)).fetchall()
+    messages = {}
+    for chat_id, role, content, codec in rows:
+        messages.setdefault(chat_id, []).append({"role": role, "content": decode(content, codec)})
     return [
         {
-            "title": row[0],
-            "messages": json.loads(row[1]),
+            "id": row[0],
+            "title": row[1],
+            "messages": messages.get(row[0], []),
             "timestamp": row[2]
         }
+        for row in chats
+    ]
+
+@traced("db.list_chats")
+def list_chats(user_id, limit=8, before=None):
+    """
+    Returns chat metadata only (id, title, timestamp, message_count), newest first.
+    Pass the (timestamp, id) of the last chat of a page as `before` to get the next page.
+    """
+    message_count = "(SELECT COUNT(*) FROM chat_messages m WHERE m.chat_id = chats.id)"
+    with get_db() as conn:
+        if before is None:
+            rows = conn.execute(f"""
+                SELECT id, title, timestamp, {message_count}
+                FROM chats WHERE user_id = ?
+                ORDER BY timestamp DESC, id DESC LIMIT ?
+            """, (user_id, limit)).fetchall()
+        else:
+            rows = conn.execute(f"""
+                SELECT id, title, timestamp, {message_count}
+                FROM chats WHERE user_id = ? AND (timestamp, id) < (?, ?)
+                ORDER BY timestamp DESC, id DESC LIMIT ?
+            """, (user_id, before[0], before[1], limit)).fetchall()
+    return [
+        {"id": row[0], "title": row[1], "timestamp": row[2], "message_count": row[3]}
         for row in rows
     ]
 
-def delete_chat(user_id, title):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM chats WHERE user_id = ? AND title = ?", (user_id, title))
-    conn.commit()
-    conn.close()
+@traced("db.count_chats")
+def count_chats(user_id):
+    with get_db() as conn:
+        return conn.execute("SELECT COUNT(*) FROM chats WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+@traced("db.load_chat")
+def load_chat(user_id, chat_id):
+    """Returns the messages of a single conversation, or None if it doesn't belong to the user."""
+    with get_db() as conn:
+        if conn.execute("SELECT 1 FROM chats WHERE id = ? AND user_id = ?", (chat_id, user_id)).fetchone() is None:
+            return None
+        rows = conn.execute("SELECT role, content, codec FROM chat_messages WHERE chat_id = ? ORDER BY seq", (chat_id,)).fetchall()
+    return [{"role": role, "content": decode(content, codec)} for role, content, codec in rows]
+
+@traced("db.delete_chat")
+def delete_chat(user_id, chat_id):
+    # chat_messages rows go with it through ON DELETE CASCADE
+    with get_db() as conn:
+        conn.execute("DELETE FROM chats WHERE id = ? AND user_id = ?", (chat_id, user_id))
+    retrieval.forget_chat(user_id, chat_id)
 
+def fts_query(text):
+    """
+    Turns free text into an FTS5 expression: every word must match, the last one
+    as a prefix so results update while typing. Returns None if there are no words.
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words) + "*"
+
+def fts_owner(user_id):
+    # Same token the migration 4 triggers write into the `owner` column
+    return "u" + user_id.replace("-", "")
+
+@traced("db.search_chats")
+def search_chats(user_id, query, limit=8, offset=0, marker=("**", "**")):
+    """
+    Ranked full-text search over the user's chat titles and messages.
+
+    Returns up to `limit` chats (id, title, timestamp, snippet, matches), best
+    match first, and whether more results follow. Title matches weigh double.
+    """
+    terms = fts_query(query)
+    if terms is None:
+        return [], False
+    owner = f'owner:"{fts_owner(user_id)}"'
+    message_match = f"{owner} AND content:({terms})"
+    title_match = f"{owner} AND title:({terms})"
+    with get_db() as conn:
+        # MATERIALIZED keeps bm25() inside the FTS scans rather than the GROUP BY
+        rows = conn.execute("""
+            WITH hits AS MATERIALIZED (
+                SELECT m.chat_id AS chat_id, chat_messages_fts.rowid AS message_id,
+                       bm25(chat_messages_fts, 0.0, 1.0) AS score
+                FROM chat_messages_fts JOIN chat_messages m ON m.id = chat_messages_fts.rowid
+                WHERE chat_messages_fts MATCH ?
+                UNION ALL
+                SELECT rowid, NULL, 2 * bm25(chats_fts, 0.0, 1.0)
+                FROM chats_fts WHERE chats_fts MATCH ?
+            )
+            SELECT c.id, c.title, c.timestamp, h.message_id, MIN(h.score), COUNT(*)
+            FROM hits h JOIN chats c ON c.id = h.chat_id
+            GROUP BY c.id
+            ORDER BY MIN(h.score), c.timestamp DESC
+            LIMIT ? OFFSET ?
+        """, (message_match, title_match, limit + 1, offset)).fetchall()
+
+        results = []
+        # Snippets only for the page being returned, from the best-ranked hit
+        for chat_id, title, timestamp, message_id, _, matches in rows[:limit]:
+            if message_id is None:
+                snippet = conn.execute(
+                    "SELECT snippet(chats_fts, 1, ?, ?, '…', 12) FROM chats_fts WHERE chats_fts MATCH ? AND rowid = ?",
+                    (*marker, title_match, chat_id)
+                ).fetchone()[0]
+            else:
+                snippet = conn.execute(
+                    "SELECT snippet(chat_messages_fts, 1, ?, ?, '…', 12) FROM chat_messages_fts "
+                    "WHERE chat_messages_fts MATCH ? AND rowid = ?",
+                    (*marker, message_match, message_id)
+                ).fetchone()[0]
+            results.append({"id": chat_id, "title": title, "timestamp": timestamp,
+                            "snippet": snippet, "matches": matches})
+    return results, len(rows) > limit
+
+TIMETABLE_INSERT = """
+    INSERT OR REPLACE INTO timetables
+        (user_id, name, schedule_json, codec, day_count, total_hours, topic_count, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def timetable_row(user_id, name, schedule, created_at=None):
+    """Values for TIMETABLE_INSERT: the encoded schedule plus its summary columns."""
+    return (user_id, name, *encode(json.dumps(schedule)), *schedule_summary(schedule),
+            time.time() if created_at is None else created_at)
+
+@traced("db.save_timetable")
 def save_timetable(user_id, name, schedule):
-    conn = get_db()
-    cursor = conn.cursor()
-    schedule_json = json.dumps(schedule)
-    cursor.execute("""
-        INSERT OR REPLACE INTO timetables (user_id, name, schedule_json)
-        VALUES (?, ?, ?)
-    """, (user_id, name, schedule_json))
-    conn.commit()
-    conn.close()
+    with get_db() as conn:
+        conn.execute(TIMETABLE_INSERT, timetable_row(user_id, name, schedule))
+    retrieval.index_timetable(user_id, name, schedule)
+
+@traced("db.save_timetables")
+def save_timetables(plans):
+    """Saves many (user_id, name, schedule) plans in one transaction."""
+    rows = [timetable_row(user_id, name, schedule) for user_id, name, schedule in plans]
+    with get_db() as conn:
+        conn.executemany(TIMETABLE_INSERT, rows)
+    for user_id, name, schedule in plans:
+        retrieval.index_timetable(user_id, name, schedule)
+
+@traced("db.list_timetables")
+def list_timetables(user_id, limit=10, before=None):
+    """
+    Returns saved-plan summaries (id, name, day_count, total_hours, topic_count,
+    created_at), newest first, without the schedules themselves. Pass the id of
+    the last plan of a page as `before` to get the next page.
+    """
+    with get_db() as conn:
+        if before is None:
+            rows = conn.execute("""
+                SELECT id, name, day_count, total_hours, topic_count, created_at
+                FROM timetables WHERE user_id = ?
+                ORDER BY id DESC LIMIT ?
+            """, (user_id, limit)).fetchall()
+        else:
+            rows = conn.execute("""
+                SELECT id, name, day_count, total_hours, topic_count, created_at
+                FROM timetables WHERE user_id = ? AND id < ?
+                ORDER BY id DESC LIMIT ?
+            """, (user_id, before, limit)).fetchall()
+    return [
+        {"id": row[0], "name": row[1], "day_count": row[2], "total_hours": row[3],
+         "topic_count": row[4], "created_at": row[5]}
+        for row in rows
+    ]
+
+@traced("db.count_timetables")
+def count_timetables(user_id):
+    with get_db() as conn:
+        return conn.execute("SELECT COUNT(*) FROM timetables WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+@traced("db.load_timetable")
+def load_timetable(user_id, plan_id):
+    """Returns the schedule of one saved plan, or None if it doesn't belong to the user."""
+    with get_db() as conn:
+        row = conn.execute(
+            "SELECT schedule_json, codec FROM timetables WHERE id = ? AND user_id = ?", (plan_id, user_id)
+        ).fetchone()
+    return json.loads(decode(row[0], row[1])) if row else None
 
+@traced("db.load_timetables")
 def load_timetables(user_id):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT name, schedule_json FROM timetables WHERE user_id = ?", (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
+    with get_db() as conn:
+        rows = conn.execute("SELECT name, schedule_json, codec FROM timetables WHERE user_id = ?", (user_id,)).fetchall()
     return {
-        row[0]: json.loads(row[1]) for row in rows
+        row[0]: json.loads(decode(row[1], row[2])) for row in rows
     }